@@ -0,0 +1 @@
+"""Бенчмарки этапов обработки данных на синтетических каталогах"""
@@ -0,0 +1,228 @@
+"""
+Локальная замена API Яндекс.Маркета для нагрузочных проверок без реальных ключей.
+
+Поддерживаются генерация отчета по ценам, проверка его статуса, скачивание
+ZIP с CSV и обновление цен. Задержка ответов, время генерации отчета,
+лимиты запросов (ответ 420/429 с Retry-After), доля ошибок 5xx и ошибок
+по отдельным товарам настраиваются параметрами.
+
+    python -m benchmarks.fake_ym_server --port 8080 --offers 100000 --rps 5
+    YM_API_BASE_URL=http://127.0.0.1:8080 python main.py
+
+Счетчики запросов доступны по GET /_stats.
+"""
+import argparse
+import asyncio
+import itertools
+import math
+import random
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from aiohttp import web
+
+from benchmarks.synthetic import make_catalog, make_report_frame, report_zip_bytes
+
+MAX_OFFERS_PER_REQUEST = 500
+
+
+class FakeYandexMarket:
+    """Состояние и настройки поддельного API"""
+
+    def __init__(self, latency: float = 0.05, latency_jitter: float = 0.05, generation_delay: float = 5.0,
+                 estimate_factor: float = 1.5, offers: int = 10_000, rps: Optional[float] = None,
+                 offers_per_minute: Optional[int] = 10_000, throttle_status: int = 420,
+                 throttle_rate: float = 0.0, error_rate: float = 0.0, offer_error_rate: float = 0.0,
+                 seed: int = 0):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.generation_delay = generation_delay
+        self.estimate_factor = estimate_factor
+        self.offers = offers
+        self.rps = rps
+        self.offers_per_minute = offers_per_minute
+        self.throttle_status = throttle_status
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.offer_error_rate = offer_error_rate
+        self.seed = seed
+        self.random = random.Random(seed)
+
+        self.report_ids = itertools.count(1)
+        # reportId -> (business_id, время готовности)
+        self.reports: Dict[str, Tuple[str, float]] = {}
+        # ZIP отчета по business_id, строится один раз
+        self.report_files: Dict[str, asyncio.Task] = {}
+        # Окна лимитов: (группа, business_id) -> (начало окна, израсходовано)
+        self.windows: Dict[Tuple[str, str], Tuple[float, float]] = {}
+        self.stats = Counter()
+
+    def _consume(self, group: str, business_id: str, amount: float, limit: Optional[float],
+                 window: float) -> Optional[float]:
+        """Расходует лимит группы; возвращает секунды до нового окна, если лимит исчерпан"""
+        if limit is None:
+            return None
+        now = time.monotonic()
+        started, used = self.windows.get((group, business_id), (now, 0.0))
+        if now - started >= window:
+            started, used = now, 0.0
+        if used + amount > limit:
+            return window - (now - started)
+        self.windows[(group, business_id)] = (started, used + amount)
+        return None
+
+    def _throttled(self, retry_after: float) -> web.Response:
+        self.stats['throttled'] += 1
+        return web.json_response(
+            {"status": "ERROR", "errors": [{"code": "LIMIT_EXCEEDED", "message": "Too many requests"}]},
+            status=self.throttle_status, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+    async def _before(self, request: web.Request, group: str, business_id: str,
+                      amount: float = 1.0) -> Optional[web.Response]:
+        """Общая обработка запроса: задержка, проверка ключа, лимиты и случайные ошибки"""
+        self.stats[f'requests_{group}'] += 1
+        await asyncio.sleep(self.latency + self.random.uniform(0, self.latency_jitter))
+
+        if group != 'download' and not request.headers.get('Api-Key'):
+            return web.json_response({"status": "ERROR", "errors": [{"code": "UNAUTHORIZED"}]}, status=401)
+
+        limit, window = (self.offers_per_minute, 60.0) if group == 'price_updates' else (self.rps, 1.0)
+        retry_after = self._consume(group, business_id, amount, limit, window)
+        if retry_after is not None:
+            return self._throttled(retry_after)
+        if self.random.random() < self.throttle_rate:
+            return self._throttled(1.0)
+        if self.random.random() < self.error_rate:
+            self.stats['server_errors'] += 1
+            return web.json_response({"status": "ERROR", "errors": [{"code": "INTERNAL_ERROR"}]},
+                                     status=self.random.choice([500, 502, 503]))
+        return None
+
+    async def _report_file(self, business_id: str) -> bytes:
+        if business_id not in self.report_files:
+            def build() -> bytes:
+                catalog = make_catalog(self.offers, self.seed + int(business_id) % 1000)
+                return report_zip_bytes(make_report_frame(catalog, self.seed))
+            self.report_files[business_id] = asyncio.ensure_future(asyncio.to_thread(build))
+        return await self.report_files[business_id]
+
+    async def generate_report(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        business_id = str(body.get('businessId', ''))
+        error = await self._before(request, 'reports_generate', business_id)
+        if error is not None:
+            return error
+
+        report_id = str(next(self.report_ids))
+        delay = self.generation_delay * self.random.uniform(0.8, 1.2)
+        self.reports[report_id] = (business_id, time.monotonic() + delay)
+        # Файл отчета готовится, пока клиент ждет генерации
+        asyncio.ensure_future(self._report_file(business_id))
+        return web.json_response({"status": "OK", "result": {
+            "reportId": report_id,
+            "estimatedGenerationTime": int(self.generation_delay * self.estimate_factor * 1000),
+        }})
+
+    async def report_info(self, request: web.Request) -> web.Response:
+        report_id = request.match_info['report_id']
+        business_id, ready_at = self.reports.get(report_id, ('', 0.0))
+        error = await self._before(request, 'reports_info', business_id)
+        if error is not None:
+            return error
+        if not business_id:
+            return web.json_response({"status": "ERROR", "errors": [{"code": "NOT_FOUND"}]}, status=404)
+
+        result = {"reportId": report_id, "status": "PROCESSING"}
+        if time.monotonic() >= ready_at and self.report_files[business_id].done():
+            result = {"reportId": report_id, "status": "DONE",
+                      "file": str(request.url.with_path(f"/files/{report_id}.zip").with_query(None))}
+        return web.json_response({"status": "OK", "result": result})
+
+    async def download_report(self, request: web.Request) -> web.StreamResponse:
+        report_id = request.match_info['report_id']
+        business_id, _ = self.reports.get(report_id, ('', 0.0))
+        error = await self._before(request, 'download', business_id)
+        if error is not None:
+            return error
+        if not business_id:
+            return web.Response(status=404)
+
+        data = await self._report_file(business_id)
+        self.stats['downloaded_bytes'] += len(data)
+        return web.Response(body=data, content_type='application/zip')
+
+    async def update_prices(self, request: web.Request) -> web.Response:
+        business_id = request.match_info['business_id']
+        body = await request.json()
+        offers = body.get('offers') or []
+        error = await self._before(request, 'price_updates', business_id, amount=len(offers))
+        if error is not None:
+            return error
+        if len(offers) > MAX_OFFERS_PER_REQUEST:
+            return web.json_response({"status": "ERROR", "errors": [{
+                "code": "BAD_REQUEST", "message": f"offers: size must be at most {MAX_OFFERS_PER_REQUEST}"}]},
+                status=400)
+
+        errors = []
+        for i, offer in enumerate(offers):
+            value = (offer.get('price') or {}).get('value')
+            if not isinstance(value, (int, float)) or value <= 0:
+                errors.append({"code": "INVALID_PRICE", "message": f"offers[{i}].price.value: must be positive"})
+            elif self.random.random() < self.offer_error_rate:
+                errors.append({"code": "OFFER_NOT_FOUND", "message": "Offer not found",
+                               "offerId": offer.get('offerId')})
+        self.stats['offers_received'] += len(offers)
+        self.stats['offers_rejected'] += len(errors)
+        if errors:
+            return web.json_response({"status": "OK", "errors": errors})
+        return web.json_response({"status": "OK"})
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.stats))
+
+
+def create_app(api: Optional[FakeYandexMarket] = None) -> web.Application:
+    api = api or FakeYandexMarket()
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app['api'] = api
+    app.router.add_post('/reports/prices/generate', api.generate_report)
+    app.router.add_get('/reports/info/{report_id}', api.report_info)
+    app.router.add_get('/files/{report_id}.zip', api.download_report)
+    app.router.add_post('/businesses/{business_id}/offer-prices/updates', api.update_prices)
+    app.router.add_get('/_stats', api.get_stats)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальная замена API Яндекс.Маркета")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.05, help="Базовая задержка ответа, секунд")
+    parser.add_argument('--latency-jitter', type=float, default=0.05, help="Случайная добавка к задержке, секунд")
+    parser.add_argument('--generation-delay', type=float, default=5.0, help="Время генерации отчета, секунд")
+    parser.add_argument('--estimate-factor', type=float, default=1.5,
+                        help="Во сколько раз estimatedGenerationTime больше фактического времени")
+    parser.add_argument('--offers', type=int, default=10_000, help="Товаров в отчете")
+    parser.add_argument('--rps', type=float, help="Запросов в секунду на группу и бизнес")
+    parser.add_argument('--offers-per-minute', type=int, default=10_000,
+                        help="Товаров в минуту в обновлениях цен на бизнес")
+    parser.add_argument('--throttle-status', type=int, choices=[420, 429], default=420)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Доля случайных ответов о превышении лимита")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Доля ответов 5xx")
+    parser.add_argument('--offer-error-rate', type=float, default=0.0, help="Доля товаров с ошибкой")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    api = FakeYandexMarket(
+        latency=args.latency, latency_jitter=args.latency_jitter, generation_delay=args.generation_delay,
+        estimate_factor=args.estimate_factor, offers=args.offers, rps=args.rps,
+        offers_per_minute=args.offers_per_minute, throttle_status=args.throttle_status,
+        throttle_rate=args.throttle_rate, error_rate=args.error_rate, offer_error_rate=args.offer_error_rate,
+        seed=args.seed,
+    )
+    web.run_app(create_app(api), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Сравнение соединения таблицы с отчетом: join_report_prices против прежнего
+update_dataframe на merge (копии обоих DataFrame, astype(str), merge с
+суффиксами, fillna и drop).
+
+Для каждого размера каталога выводятся время (минимум по повторам), пиковый
+прирост памяти и счетчики сопоставления артикулов; результаты обоих
+вариантов сверяются.
+
+    python -m benchmarks.join --sizes 100k 1m
+"""
+import argparse
+import io
+import logging
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from benchmarks.synthetic import (
+    make_catalog, make_report_frame, make_sheet_values, parse_size, report_zip_bytes
+)
+from scr.data_fetcher import values_to_dataframe
+from scr.schema import YM_COLUMN_NAMES
+from scr.update_data_ym import join_report_prices
+from scr.yandex_market_report import process_csv_from_zip
+
+
+def merge_report_prices(df1: pd.DataFrame, df2: pd.DataFrame, column_names: Dict[str, str]) -> pd.DataFrame:
+    """Прежняя реализация update_dataframe; магазины заполняются как object, fillna категорий не работает"""
+    df1_updated = df1.copy()
+    df2_updated = df2.copy()
+
+    seller_id = column_names['seller_id']
+    mp_on_market = column_names['mp_on_market']
+    market_with_mp = column_names['market_with_mp']
+
+    df1_updated[seller_id] = df1_updated[seller_id].astype(str)
+    df2_updated[seller_id] = df2_updated[seller_id].astype(str)
+
+    merged_df = df1_updated.merge(df2_updated[[seller_id, mp_on_market, market_with_mp]],
+                                  on=seller_id,
+                                  how='left',
+                                  suffixes=('', '_new'))
+
+    merged_df[mp_on_market] = merged_df[f'{mp_on_market}_new'].fillna(merged_df[mp_on_market])
+    merged_df[market_with_mp] = (merged_df[f'{market_with_mp}_new'].astype(object)
+                                 .fillna(merged_df[market_with_mp].astype(object)))
+
+    merged_df = merged_df.drop([f'{mp_on_market}_new', f'{market_with_mp}_new'], axis=1)
+
+    original_type = df1[seller_id].dtype
+    merged_df[seller_id] = merged_df[seller_id].astype(original_type)
+
+    return merged_df
+
+
+def measure(func: Callable[[], object], repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(times), 'peak_mb': (peak - baseline) / 2 ** 20}
+
+
+def comparable(values: pd.Series) -> pd.Series:
+    values = values.astype(object)
+    return values.where(values.notna(), '')
+
+
+def same_result(merged: pd.DataFrame, joined: pd.DataFrame) -> bool:
+    if len(merged) != len(joined) or list(merged.columns) != list(joined.columns):
+        return False
+    return all(comparable(merged[column]).equals(comparable(joined[column])) for column in merged.columns)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Сравнение соединения таблицы с отчетом")
+    parser.add_argument('--sizes', nargs='+', default=['100k', '1m'],
+                        help="Размеры каталога: 1k, 10k, 100k, 1m или число")
+    parser.add_argument('--repeat', type=int, default=3, help="Повторов на вариант")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.ERROR)
+
+    print(f"{'размер':>7} {'вариант':<20} {'время, с':>10} {'пик, МБ':>9}")
+    mismatches = 0
+    for size in args.sizes:
+        catalog = make_catalog(parse_size(size), args.seed)
+        sheet_df = values_to_dataframe(make_sheet_values(catalog))
+        report_df = process_csv_from_zip(io.BytesIO(report_zip_bytes(make_report_frame(catalog, args.seed))))
+
+        variants = {
+            'merge': lambda: merge_report_prices(sheet_df, report_df, YM_COLUMN_NAMES),
+            'join_report_prices': lambda: join_report_prices(sheet_df, report_df, YM_COLUMN_NAMES),
+        }
+        results = {name: measure(func, args.repeat) for name, func in variants.items()}
+        for name, result in results.items():
+            print(f"{size:>7} {name:<20} {result['seconds']:>10.4f} {result['peak_mb']:>9.1f}")
+
+        joined, stats = join_report_prices(sheet_df, report_df, YM_COLUMN_NAMES)
+        speedup = results['merge']['seconds'] / results['join_report_prices']['seconds']
+        print(f"{size:>7} ускорение x{speedup:.1f}; " + ", ".join(f"{key}={value}" for key, value in stats.items()))
+        if not same_result(merge_report_prices(sheet_df, report_df, YM_COLUMN_NAMES), joined):
+            mismatches += 1
+            print(f"{size:>7} РАСХОЖДЕНИЕ результатов merge и join_report_prices")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
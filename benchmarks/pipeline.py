@@ -0,0 +1,223 @@
+"""
+Бенчмарк этапов обработки магазина на синтетическом каталоге.
+
+Для каждого размера каталога и этапа измеряется время (минимум и медиана
+по повторам) и пиковый прирост памяти по tracemalloc. Результаты можно
+сохранить как базовые и сравнивать с ними последующие запуски.
+
+    python -m benchmarks.pipeline --sizes 1k 10k 100k --save-baseline benchmarks/baseline.json
+    python -m benchmarks.pipeline --sizes 1k 10k 100k --baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import (
+    MY_MARKETS, make_catalog, make_report_frame, make_sheet_values, parse_size, report_zip_bytes
+)
+from main import keep_specific_columns
+from scr.data_fetcher import values_to_dataframe
+from scr.data_writer import build_delta_ranges, sheet_values
+from scr.schema import YM_COLUMN_NAMES
+from scr.update_data_ym import compare_prices_and_create_for_update, update_dataframe
+from scr.yandex_market_report import process_csv_from_zip
+
+# Доля строк листа, изменившихся с прошлой записи, для этапа формирования записи
+CHANGED_ROWS_SHARE = 0.05
+# Разница меньше этой не считается регрессией: шум измерения
+MIN_SECONDS_DELTA = 0.005
+MIN_PEAK_MB_DELTA = 1.0
+
+
+def build_stages(loop: asyncio.AbstractEventLoop, seed: int) -> List[Tuple[str, Callable[[dict], object]]]:
+    """
+    Этапы в порядке выполнения. Каждый этап берет входные данные из контекста,
+    результат записывается в контекст под именем этапа.
+    """
+    def read_sheet(ctx):
+        return values_to_dataframe(ctx['sheet_values'])
+
+    def read_report(ctx):
+        return process_csv_from_zip(io.BytesIO(ctx['report_zip']))
+
+    def keep_columns(ctx):
+        return loop.run_until_complete(keep_specific_columns(ctx['process_csv_from_zip']))
+
+    def merge(ctx):
+        return loop.run_until_complete(update_dataframe(ctx['values_to_dataframe'], ctx['keep_specific_columns'],
+                                                        YM_COLUMN_NAMES))
+
+    def compare(ctx):
+        return loop.run_until_complete(compare_prices_and_create_for_update(
+            ctx['update_dataframe'], YM_COLUMN_NAMES, MY_MARKETS, rng=np.random.default_rng(seed)))
+
+    def sheet_payload(ctx):
+        updated_df = ctx['compare_prices_and_create_for_update'][0]
+        data = sheet_values(updated_df)
+        return build_delta_ranges('YM!A3:L', ctx['previous_payload'], data)
+
+    return [
+        ('values_to_dataframe', read_sheet),
+        ('process_csv_from_zip', read_report),
+        ('keep_specific_columns', keep_columns),
+        ('update_dataframe', merge),
+        ('compare_prices_and_create_for_update', compare),
+        ('sheet_payload', sheet_payload),
+    ]
+
+
+def previous_payload(ctx: dict, seed: int) -> List[list]:
+    """Данные прошлой записи: текущие данные с измененной долей CHANGED_ROWS_SHARE строк"""
+    data = sheet_values(ctx['compare_prices_and_create_for_update'][0])
+    rng = np.random.default_rng(seed + 2)
+    for i in np.flatnonzero(rng.random(len(data)) < CHANGED_ROWS_SHARE):
+        data[i] = data[i][:-1] + ['прошлое значение']
+    return data
+
+
+def measure(func: Callable[[dict], object], ctx: dict, repeat: int) -> Dict[str, float]:
+    """Время по повторам и пиковый прирост памяти в отдельном запуске под tracemalloc"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(ctx)
+        times.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func(ctx)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds': round(min(times), 6),
+        'median_seconds': round(statistics.median(times), 6),
+        'peak_mb': round((peak - baseline) / 2 ** 20, 3),
+    }
+
+
+def run_size(n: int, repeat: int, seed: int, loop: asyncio.AbstractEventLoop) -> Dict[str, Dict[str, float]]:
+    catalog = make_catalog(n, seed)
+    ctx = {
+        'sheet_values': make_sheet_values(catalog),
+        'report_zip': report_zip_bytes(make_report_frame(catalog, seed)),
+    }
+    stages = build_stages(loop, seed)
+
+    # Прогон для подготовки входных данных каждого этапа
+    for name, func in stages:
+        ctx[name] = func(ctx)
+        if name == 'compare_prices_and_create_for_update':
+            ctx['previous_payload'] = previous_payload(ctx, seed)
+
+    results = {}
+    for name, func in stages:
+        results[name] = measure(func, ctx, repeat)
+    return results
+
+
+def compare_with_baseline(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """Список регрессий: этапы, ставшие медленнее или прожорливее threshold раз"""
+    regressions = []
+    for size, stages in results['results'].items():
+        for stage, current in stages.items():
+            previous = baseline.get('results', {}).get(size, {}).get(stage)
+            if not previous:
+                continue
+            if (current['seconds'] > previous['seconds'] * threshold
+                    and current['seconds'] - previous['seconds'] > MIN_SECONDS_DELTA):
+                regressions.append(f"{size} {stage}: время {previous['seconds']:.4f} -> {current['seconds']:.4f} с")
+            if (current['peak_mb'] > previous['peak_mb'] * threshold
+                    and current['peak_mb'] - previous['peak_mb'] > MIN_PEAK_MB_DELTA):
+                regressions.append(f"{size} {stage}: память {previous['peak_mb']:.1f} -> {current['peak_mb']:.1f} МБ")
+    return regressions
+
+
+def print_table(results: dict, baseline: Optional[dict]) -> None:
+    header = f"{'размер':>7} {'этап':<38} {'время, с':>10} {'медиана, с':>11} {'пик, МБ':>9}"
+    if baseline:
+        header += f" {'x базы':>7}"
+    print(header)
+    for size, stages in results['results'].items():
+        for stage, current in stages.items():
+            line = (f"{size:>7} {stage:<38} {current['seconds']:>10.4f} {current['median_seconds']:>11.4f}"
+                    f" {current['peak_mb']:>9.1f}")
+            previous = (baseline or {}).get('results', {}).get(size, {}).get(stage)
+            if previous and previous['seconds']:
+                line += f" {current['seconds'] / previous['seconds']:>7.2f}"
+            print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов обработки данных магазина")
+    parser.add_argument('--sizes', nargs='+', default=['1k', '10k', '100k'],
+                        help="Размеры каталога: 1k, 10k, 100k, 1m или число")
+    parser.add_argument('--repeat', type=int, default=3, help="Повторов на этап")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Сохранить результаты в JSON")
+    parser.add_argument('--save-baseline', metavar='PATH', help="Сохранить результаты как базовые")
+    parser.add_argument('--baseline', metavar='PATH', help="Сравнить с базовыми результатами")
+    parser.add_argument('--threshold', type=float, default=1.3,
+                        help="Во сколько раз этап может стать медленнее базового без регрессии")
+    args = parser.parse_args(argv)
+
+    # Логи этапов не должны влиять на замеры
+    logging.getLogger().setLevel(logging.ERROR)
+
+    results = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': {},
+    }
+    loop = asyncio.new_event_loop()
+    try:
+        for size in args.sizes:
+            results['results'][size] = run_size(parse_size(size), args.repeat, args.seed, loop)
+    finally:
+        loop.close()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {path}")
+
+    if baseline:
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"РЕГРЕССИЯ {regression}")
+        if regressions:
+            return 1
+        print("Регрессий относительно базовых результатов нет")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
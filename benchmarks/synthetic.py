@@ -0,0 +1,125 @@
+"""
+Синтетические данные для бенчмарков: значения листа Google Sheets и отчет
+Яндекс.Маркета с согласованными артикулами и правдоподобными ценами.
+"""
+import io
+import zipfile
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from scr.yandex_market_report import REPORT_COLUMNS
+
+SIZES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+MY_MARKETS = ['SSmart shop', 'Tech PC Components', 'ByMarket']
+COMPETITORS = [f'Конкурент {i}' for i in range(1, 41)]
+
+# Колонки листа магазина (A:L)
+SHEET_COLUMNS = [
+    'SHOP_SKU', 'OFFER', 'LINK', 'MAIN_PRICE', 'MERCH_PRICE_WITH_PROMOS', 'PRICE_GREEN_THRESHOLD',
+    'PRICE_RED_THRESHOLD', 'PRICE_WITH_PROMOS', 'SHOP_WITH_BEST_PRICE_ON_MARKET', 'PRICE.1', 'STOP', 'PRIM'
+]
+# Колонки отчета, которые не используются и отбрасываются при чтении
+EXTRA_REPORT_COLUMNS = ['CATEGORY', 'BARCODE', 'VENDOR', 'PRICE.2', 'SHOP_WITH_SECOND_PRICE']
+
+
+def parse_size(value: str) -> int:
+    """'10k' -> 10000, '1m' -> 1000000, число - как есть"""
+    return SIZES.get(value.lower()) or int(value)
+
+
+def make_catalog(n: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """
+    Каталог из n товаров.
+
+    Цены логнормальные (медиана ~3000), лучшая цена на рынке в среднем на 3%
+    ниже нашей, стоп-цена - 75-95% от нашей. Примерно у 20% товаров лучшая
+    цена у своего магазина, у 2% пустая стоп-цена, у 5% нет цены конкурента.
+    """
+    rng = np.random.default_rng(seed)
+    price = np.round(np.exp(rng.normal(np.log(3000), 0.8, n)), -1).clip(50, None)
+    market_price = np.round(price * (1 + rng.normal(-0.03, 0.06, n)))
+    stop = np.round(price * rng.uniform(0.75, 0.95, n))
+    own_best = rng.random(n) < 0.2
+    shops = np.where(own_best,
+                     np.array(MY_MARKETS, dtype=object)[rng.integers(0, len(MY_MARKETS), n)],
+                     np.array(COMPETITORS, dtype=object)[rng.integers(0, len(COMPETITORS), n)])
+    market_price[own_best] = np.minimum(market_price[own_best], price[own_best])
+    return {
+        'sku': np.array([f'SKU-{i:07d}' for i in range(n)], dtype=object),
+        'price': price,
+        'market_price': np.where(rng.random(n) < 0.05, np.nan, market_price),
+        'stop': np.where(rng.random(n) < 0.02, np.nan, stop),
+        'shop': shops,
+    }
+
+
+def money(values: np.ndarray) -> List[str]:
+    """Цены так, как их возвращает Sheets API: '1234.5', пустая строка для NaN"""
+    return ['' if np.isnan(value) else f'{value:g}' for value in values]
+
+
+def make_sheet_values(catalog: Dict[str, np.ndarray]) -> List[list]:
+    """Значения диапазона листа в формате values().get: заголовок, служебная строка и данные"""
+    n = len(catalog['sku'])
+    price = money(catalog['price'])
+    columns = {
+        'SHOP_SKU': catalog['sku'].tolist(),
+        'OFFER': [f'Товар {sku}' for sku in catalog['sku']],
+        'LINK': [f'https://market.yandex.ru/product/{i}' for i in range(n)],
+        'MAIN_PRICE': price,
+        'MERCH_PRICE_WITH_PROMOS': price,
+        'PRICE_GREEN_THRESHOLD': money(catalog['price'] * 0.97),
+        'PRICE_RED_THRESHOLD': money(catalog['price'] * 1.05),
+        'PRICE_WITH_PROMOS': price,
+        'SHOP_WITH_BEST_PRICE_ON_MARKET': catalog['shop'].tolist(),
+        'PRICE.1': money(catalog['market_price']),
+        'STOP': money(catalog['stop']),
+        'PRIM': [''] * n,
+    }
+    rows = [list(row) for row in zip(*(columns[col] for col in SHEET_COLUMNS))]
+    return [SHEET_COLUMNS, [''] * len(SHEET_COLUMNS)] + rows
+
+
+def make_report_frame(catalog: Dict[str, np.ndarray], seed: int = 0) -> pd.DataFrame:
+    """
+    Отчет Маркета по тому же каталогу: 95% товаров листа и 5% чужих артикулов,
+    в случайном порядке и с лишними колонками.
+    """
+    rng = np.random.default_rng(seed + 1)
+    n = len(catalog['sku'])
+    present = rng.random(n) < 0.95
+    extra = max(1, n // 20)
+    sku = np.concatenate([catalog['sku'][present], [f'OTHER-{i:07d}' for i in range(extra)]])
+    price = np.concatenate([catalog['price'][present], np.round(rng.uniform(100, 20000, extra), -1)])
+    market_price = np.concatenate([catalog['market_price'][present], np.round(price[-extra:] * 0.97)])
+    shop = np.concatenate([catalog['shop'][present], np.full(extra, COMPETITORS[0], dtype=object)])
+    order = rng.permutation(len(sku))
+    m = len(sku)
+    df = pd.DataFrame({
+        'SHOP_SKU': sku,
+        'OFFER': [f'Товар {value}' for value in sku],
+        'MAIN_PRICE': price,
+        'MERCH_PRICE_WITH_PROMOS': price,
+        'PRICE_GREEN_THRESHOLD': np.round(price * 0.97, 2),
+        'PRICE_RED_THRESHOLD': np.round(price * 1.05, 2),
+        'PRICE_WITH_PROMOS': price,
+        'SHOP_WITH_BEST_PRICE_ON_MARKET': shop,
+        'PRICE.1': market_price,
+        'CATEGORY': rng.integers(1, 500, m),
+        'BARCODE': rng.integers(10 ** 12, 10 ** 13, m),
+        'VENDOR': 'Vendor',
+        'PRICE.2': np.round(market_price * 1.02),
+        'SHOP_WITH_SECOND_PRICE': COMPETITORS[1],
+    }).iloc[order].reset_index(drop=True)
+    return df[REPORT_COLUMNS[:8] + EXTRA_REPORT_COLUMNS[:2] + ['PRICE.1'] + EXTRA_REPORT_COLUMNS[2:]]
+
+
+def report_zip_bytes(report: pd.DataFrame) -> bytes:
+    """ZIP-архив с CSV отчета, как его отдает API"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr('report.csv', report.to_csv(index=False))
+    return buffer.getvalue()
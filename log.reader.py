@@ -1,16 +1,149 @@
 import json
-from datetime import datetime
+import gzip
+import itertools
+import os
+import time
+from datetime import datetime, timedelta, timezone
 import argparse
 from colorama import init, Fore, Style
 
+from log_index import get_index, read_ranges
+
 init(autoreset=True)  # Инициализация colorama
 
+GZIP_MAGIC = b'\x1f\x8b'
+FOLLOW_POLL_SECONDS = 0.5
+
+
+def open_log(path):
+    """Открывает лог в бинарном режиме; сжатые gzip файлы распаковываются на лету"""
+    with open(path, 'rb') as probe:
+        compressed = probe.read(2) == GZIP_MAGIC
+    return gzip.open(path, 'rb') if compressed else open(path, 'rb')
+
+
+def decode_line(raw):
+    """Декодирует строку как UTF-8, при ошибке - как cp1251"""
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw.decode('cp1251', errors='replace')
+
+
+def read_lines(paths):
+    """Строки всех файлов по порядку, без загрузки файлов в память"""
+    for path in paths:
+        with open_log(path) as file:
+            yield from file
+
+
+def follow_lines(path):
+    """
+    Строки живого лога с начала файла, затем новые по мере дописывания.
+    После ротации (файл заменен или стал короче) файл переоткрывается.
+    """
+    file = open(path, 'rb')
+    buffer = b''
+    try:
+        while True:
+            chunk = file.readline()
+            if chunk:
+                buffer += chunk
+                if buffer.endswith(b'\n'):
+                    yield buffer
+                    buffer = b''
+                continue
+            time.sleep(FOLLOW_POLL_SECONDS)
+            try:
+                rotated = os.stat(path).st_ino != os.fstat(file.fileno()).st_ino or os.path.getsize(path) < file.tell()
+            except FileNotFoundError:
+                continue
+            if rotated:
+                file.close()
+                file = open(path, 'rb')
+                buffer = b''
+    finally:
+        file.close()
+
 
 def parse_log_line(line):
     try:
-        return json.loads(line)
+        entry = json.loads(decode_line(line) if isinstance(line, bytes) else line)
     except json.JSONDecodeError:
         return None
+    return entry if isinstance(entry, dict) else None
+
+
+def parse_entries(lines, level=None):
+    """
+    Разбирает каждую строку один раз. При фильтре по уровню строки без
+    нужного уровня отбрасываются до разбора JSON.
+    """
+    marker = f'"level":"{level.lower()}"'.encode() if level else None
+    for line in lines:
+        if marker is not None and marker not in line:
+            continue
+        entry = parse_log_line(line)
+        if entry is not None:
+            yield entry
+
+
+class TimestampBound:
+    """
+    Граница периода для сравнения со строковыми метками времени лога
+    вида 'YYYY-MM-DD HH:MM:SS +ZZZZ' без разбора каждой метки.
+
+    Для каждого смещения часового пояса граница один раз переводится в
+    местное время этого смещения, дальше сравниваются строки.
+    """
+
+    def __init__(self, moment):
+        self.moment = moment
+        self.by_offset = {}
+
+    def local(self, offset):
+        text = self.by_offset.get(offset)
+        if text is None:
+            try:
+                zone = datetime.strptime(offset, '%z').tzinfo
+            except ValueError:
+                zone = timezone.utc
+            text = self.by_offset[offset] = self.moment.astimezone(zone).strftime('%Y-%m-%d %H:%M:%S')
+        return text
+
+
+def indexed_lines(paths, level=None, start_date=None, end_date=None, marketplace=None, range_name=None):
+    """Строки файлов, которые по индексу могут подойти под фильтры; остальные части файлов не читаются"""
+    start_minute = int(start_date.timestamp()) // 60 if start_date else None
+    end_minute = int(end_date.timestamp()) // 60 if end_date else None
+    for path in paths:
+        ranges = get_index(path).select(start_minute, end_minute, level=level.lower() if level else None,
+                                        marketplace=marketplace, range=range_name)
+        yield from read_ranges(path, ranges)
+
+
+def filter_logs(entries, level=None, start_date=None, end_date=None, marketplace=None, range_name=None):
+    """Лениво отбирает записи по уровню, полям и периоду [start_date, end_date] (aware datetime)"""
+    level = level.lower() if level else None
+    start = TimestampBound(start_date) if start_date else None
+    end = TimestampBound(end_date) if end_date else None
+    for entry in entries:
+        if level and entry.get('level') != level:
+            continue
+        if marketplace and entry.get('marketplace') != marketplace:
+            continue
+        if range_name and entry.get('range') != range_name:
+            continue
+        if start or end:
+            timestamp = entry.get('timestamp')
+            if not timestamp:
+                continue
+            local, offset = timestamp[:19], timestamp[20:]
+            if start and local < start.local(offset):
+                continue
+            if end and local > end.local(offset):
+                continue
+        yield entry
 
 
 def format_log_entry(entry):
@@ -37,45 +170,52 @@ def format_log_entry(entry):
     return formatted + Style.RESET_ALL
 
 
-def filter_logs(logs, level=None, start_date=None, end_date=None):
-    filtered = logs
-    if level:
-        filtered = [log for log in filtered if log.get('level') == level.lower()]
-    if start_date:
-        filtered = [log for log in filtered if
-                    datetime.strptime(log.get('timestamp', '1900-01-01'), "%Y-%m-%d %H:%M:%S %z") >= start_date]
-    if end_date:
-        filtered = [log for log in filtered if
-                    datetime.strptime(log.get('timestamp', '2100-01-01'), "%Y-%m-%d %H:%M:%S %z") <= end_date]
-    return filtered
+def parse_date(value, end=False):
+    """
+    Дата или дата со временем в местном часовом поясе. Для конца периода
+    дата без времени означает конец этого дня.
+    """
+    moment = datetime.fromisoformat(value)
+    if end and len(value) <= 10:
+        moment += timedelta(days=1, microseconds=-1)
+    return moment.astimezone() if moment.tzinfo is None else moment
+
+
+def main(file_paths, level=None, start_date=None, end_date=None, follow=False, marketplace=None, range_name=None,
+         use_index=True):
+    # Ротированные файлы читаются от старых к новым
+    file_paths = sorted(file_paths, key=os.path.getmtime)
+    history, live = (file_paths[:-1], file_paths[-1:]) if follow else (file_paths, [])
+    if use_index and any([level, start_date, end_date, marketplace, range_name]):
+        lines = indexed_lines(history, level, start_date, end_date, marketplace, range_name)
+    else:
+        lines = read_lines(history)
+    if live:
+        lines = itertools.chain(lines, follow_lines(live[0]))
 
-
-def main(file_path, level=None, start_date=None, end_date=None):
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            logs = [parse_log_line(line) for line in file if parse_log_line(line)]
-    except UnicodeDecodeError:
-        print("Ошибка при чтении файла с UTF-8 кодировкой. Попытка чтения с cp1251...")
-        with open(file_path, 'r', encoding='cp1251') as file:
-            logs = [parse_log_line(line) for line in file if parse_log_line(line)]
-
-    filtered_logs = filter_logs(logs, level, start_date, end_date)
-
-    for log in filtered_logs:
-        print(format_log_entry(log))
-        print('-' * 80)  # Разделитель между записями
+        for log in filter_logs(parse_entries(lines, level), level, start_date, end_date, marketplace, range_name):
+            print(format_log_entry(log))
+            print('-' * 80)  # Разделитель между записями
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Log viewer")
-    parser.add_argument("file", help="Path to the log file")
+    parser.add_argument("files", nargs='+', help="Paths to the log files (plain or .gz)")
     parser.add_argument("-l", "--level", help="Filter by log level (e.g., INFO, WARNING, ERROR)")
-    parser.add_argument("-s", "--start", help="Start date for filtering (YYYY-MM-DD)")
-    parser.add_argument("-e", "--end", help="End date for filtering (YYYY-MM-DD)")
+    parser.add_argument("-s", "--start", help="Start date for filtering (YYYY-MM-DD or 'YYYY-MM-DD HH:MM')")
+    parser.add_argument("-e", "--end", help="End date for filtering, inclusive (YYYY-MM-DD or 'YYYY-MM-DD HH:MM')")
+    parser.add_argument("-m", "--marketplace", help="Filter by marketplace field")
+    parser.add_argument("-r", "--range", dest="range_name", help="Filter by range (shop) field")
+    parser.add_argument("-f", "--follow", action="store_true", help="Keep reading new lines of the last file")
+    parser.add_argument("--no-index", action="store_true", help="Scan files fully without the .idx sidecar index")
 
     args = parser.parse_args()
 
-    start_date = datetime.strptime(args.start, "%Y-%m-%d") if args.start else None
-    end_date = datetime.strptime(args.end, "%Y-%m-%d") if args.end else None
+    start_date = parse_date(args.start) if args.start else None
+    end_date = parse_date(args.end, end=True) if args.end else None
 
-    main(args.file, args.level, start_date, end_date)
\ No newline at end of file
+    main(args.files, args.level, start_date, end_date, args.follow,
+         args.marketplace, args.range_name, not args.no_index)
@@ -0,0 +1,260 @@
+"""
+Индекс JSON-логов приложения для быстрого поиска по времени и полям.
+
+Для каждого файла лога сохраняется .index/<имя лога>.idx: блоки строк по
+минутам (минута UTC и диапазон байтовых смещений) и для полей level,
+marketplace и range - номера блоков, где встречается каждое значение.
+log.reader.py по индексу читает только нужные диапазоны файла. Индексы
+лежат в подкаталоге, чтобы TimedRotatingFileHandler не считал их
+резервными копиями лога.
+
+Индекс живого файла дополняется с места, на котором остановилась
+прошлая индексация; после ротации или замены файла строится заново.
+Для .gz файлов смещения относятся к распакованному потоку.
+
+    python log_index.py logs/app.log*
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+
+INDEX_DIR = '.index'
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+INDEXED_FIELDS = ('level', 'marketplace', 'range')
+GZIP_MAGIC = b'\x1f\x8b'
+
+FIELD_PATTERNS = {
+    field: re.compile(rb'"' + field.encode() + rb'":"((?:[^"\\]|\\.)*)"')
+    for field in ('timestamp',) + INDEXED_FIELDS
+}
+
+
+def is_gzip(path):
+    with open(path, 'rb') as probe:
+        return probe.read(2) == GZIP_MAGIC
+
+
+def index_path(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, INDEX_DIR, name + INDEX_SUFFIX)
+
+
+def remove_orphans(directory):
+    """Удаляет индексы логов, удаленных при ротации; возвращает их пути"""
+    index_directory = os.path.join(directory, INDEX_DIR)
+    if not os.path.isdir(index_directory):
+        return []
+    removed = []
+    for name in os.listdir(index_directory):
+        if name.endswith(INDEX_SUFFIX) and not os.path.exists(os.path.join(directory, name[:-len(INDEX_SUFFIX)])):
+            os.remove(os.path.join(index_directory, name))
+            removed.append(os.path.join(index_directory, name))
+    return removed
+
+
+def file_identity(path):
+    """Признаки файла, по которым видно, что это все еще тот же файл"""
+    stat = os.stat(path)
+    if is_gzip(path):
+        return {'inode': stat.st_ino, 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+    return {'inode': stat.st_ino}
+
+
+def field_value(raw):
+    try:
+        return json.loads(b'"' + raw + b'"')
+    except ValueError:
+        return raw.decode('utf-8', errors='replace')
+
+
+class LogIndex:
+    """Минутные блоки строк одного файла лога и значения полей по блокам"""
+
+    def __init__(self, path):
+        self.path = path
+        self.identity = None
+        self.offset = 0
+        # Блоки: минута UTC, начало и конец диапазона байтов
+        self.minutes = []
+        self.starts = []
+        self.ends = []
+        # поле -> значение -> множество номеров блоков
+        self.fields = {field: {} for field in INDEXED_FIELDS}
+        self._minute_cache = {}
+        self._value_cache = {}
+
+    @property
+    def index_path(self):
+        return index_path(self.path)
+
+    def _minute(self, timestamp):
+        """'YYYY-MM-DD HH:MM:SS +ZZZZ' -> номер минуты UTC; разбор один раз на минуту"""
+        key = timestamp[:16] + timestamp[19:]
+        minute = self._minute_cache.get(key)
+        if minute is None:
+            try:
+                moment = datetime.strptime(timestamp[:16] + timestamp[19:], '%Y-%m-%d %H:%M %z')
+                minute = int(moment.timestamp()) // 60
+            except ValueError:
+                minute = -1
+            self._minute_cache[key] = minute
+        return minute
+
+    def _add_line(self, line, start, end):
+        match = FIELD_PATTERNS['timestamp'].search(line)
+        minute = self._minute(match.group(1).decode('ascii', errors='replace')) if match else None
+        if minute is None or minute < 0:
+            # Строка без метки времени относится к текущему блоку
+            if not self.minutes:
+                return
+            minute = self.minutes[-1]
+        if self.minutes and self.minutes[-1] == minute and self.ends[-1] == start:
+            self.ends[-1] = end
+        else:
+            self.minutes.append(minute)
+            self.starts.append(start)
+            self.ends.append(end)
+        block = len(self.minutes) - 1
+        for field in INDEXED_FIELDS:
+            match = FIELD_PATTERNS[field].search(line)
+            if match:
+                raw = match.group(1)
+                value = self._value_cache.get(raw)
+                if value is None:
+                    value = self._value_cache[raw] = field_value(raw)
+                self.fields[field].setdefault(value, set()).add(block)
+
+    def update(self):
+        """Индексирует строки, добавленные после прошлой индексации; возвращает их число"""
+        identity = file_identity(self.path)
+        if identity != self.identity:
+            self.__init__(self.path)
+            self.identity = identity
+        opener = gzip.open if is_gzip(self.path) else open
+        added = 0
+        with opener(self.path, 'rb') as file:
+            if not is_gzip(self.path) and os.path.getsize(self.path) < self.offset:
+                # Файл обрезан: индекс строится заново
+                self.__init__(self.path)
+                self.identity = identity
+            file.seek(self.offset)
+            position = self.offset
+            for line in file:
+                if not line.endswith(b'\n'):
+                    # Недописанная строка будет проиндексирована при следующем обновлении
+                    break
+                self._add_line(line, position, position + len(line))
+                position += len(line)
+                added += 1
+            self.offset = position
+        return added
+
+    def select(self, start_minute=None, end_minute=None, **filters):
+        """
+        Диапазоны байтов блоков, попадающих в период [start_minute, end_minute]
+        и содержащих заданные значения полей. Соседние диапазоны объединяются.
+        """
+        candidates = None
+        for field, value in filters.items():
+            if value is None:
+                continue
+            blocks = self.fields.get(field, {}).get(value, set())
+            candidates = blocks if candidates is None else candidates & blocks
+        blocks = range(len(self.minutes)) if candidates is None else sorted(candidates)
+
+        ranges = []
+        for block in blocks:
+            minute = self.minutes[block]
+            if start_minute is not None and minute < start_minute:
+                continue
+            if end_minute is not None and minute > end_minute:
+                continue
+            if ranges and ranges[-1][1] == self.starts[block]:
+                ranges[-1][1] = self.ends[block]
+            else:
+                ranges.append([self.starts[block], self.ends[block]])
+        return ranges
+
+    def save(self):
+        data = {
+            'version': INDEX_VERSION,
+            'identity': self.identity,
+            'offset': self.offset,
+            'blocks': [[m, s, e] for m, s, e in zip(self.minutes, self.starts, self.ends)],
+            'fields': {field: {value: sorted(blocks) for value, blocks in values.items()}
+                       for field, values in self.fields.items()},
+        }
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.index_path)
+
+    @classmethod
+    def load(cls, path):
+        """Читает сохраненный индекс или возвращает пустой"""
+        index = cls(path)
+        try:
+            with open(index.index_path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        if data.get('version') != INDEX_VERSION:
+            return index
+        index.identity = data['identity']
+        index.offset = data['offset']
+        for minute, start, end in data['blocks']:
+            index.minutes.append(minute)
+            index.starts.append(start)
+            index.ends.append(end)
+        index.fields = {field: {value: set(blocks) for value, blocks in data['fields'].get(field, {}).items()}
+                        for field in INDEXED_FIELDS}
+        return index
+
+
+def get_index(path, save=True):
+    """Индекс файла, дополненный до текущего конца файла"""
+    index = LogIndex.load(path)
+    offset, identity = index.offset, index.identity
+    index.update()
+    if save and (index.offset != offset or index.identity != identity):
+        try:
+            index.save()
+        except OSError:
+            pass  # каталог только для чтения: индекс используется без сохранения
+    return index
+
+
+def read_ranges(path, ranges):
+    """Строки из заданных диапазонов байтов файла (для .gz - распакованного потока)"""
+    opener = gzip.open if is_gzip(path) else open
+    with opener(path, 'rb') as file:
+        for start, end in ranges:
+            file.seek(start)
+            position = start
+            while position < end:
+                line = file.readline()
+                if not line:
+                    break
+                position += len(line)
+                yield line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Построение индексов логов")
+    parser.add_argument('files', nargs='+', help="Файлы логов (обычные или .gz)")
+    args = parser.parse_args()
+    for path in args.files:
+        index = get_index(path)
+        print(f"{path}: {len(index.minutes)} блоков, {index.offset} байт проиндексировано")
+    for directory in {os.path.dirname(path) for path in args.files}:
+        for path in remove_orphans(directory):
+            print(f"{path}: лог удален, индекс удален")
+
+
+if __name__ == '__main__':
+    main()
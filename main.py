@@ -1,25 +1,38 @@
 import asyncio
 import random
+import time
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 
 import pandas as pd
-from aiohttp import ClientError
+from aiohttp import ClientError, ClientSession
 
 from scr.config import (
    SAMPLE_SPREADSHEET_ID  , Tech_PC_Components_YM, B_id_Tech_PC_Components_YM, SSmart_shop_YM,
-    B_id_SSmart_shop_YM, ByMarket_YM, B_id_ByMarket_YM
+    B_id_SSmart_shop_YM, ByMarket_YM, B_id_ByMarket_YM, YM_SHOP_CONCURRENCY,
+    YM_SHOP_START_STAGGER_SECONDS, YM_SHOP_START_JITTER_SECONDS, PRICE_HISTORY_ENABLED,
+    PRICE_LEDGER_ENABLED, METRICS_HOST, METRICS_PORT, UPDATE_INTERVAL_MINUTES, SCHEDULER_ENABLED
 )
-from scr.data_fetcher import get_sheet_data
+from scr.data_fetcher import get_sheet_data, get_sheets_data
 from scr.data_writer import write_sheet_data
 from scr.logger import logger
-from scr.yandex_market_report import get_yandex_market_report
+from scr.metrics import metrics, current_shop, start_metrics_server
+from scr.price_history import save_price_history
+from scr.price_ledger import skip_already_sent, record_accepted
+from scr.report_cache import report_cache, frame_digest
+from scr.scheduler import scheduler, compare_due_prices, limit_price_pushes
+from scr.schema import YM_COLUMN_NAMES
+from scr.yandex_market_report import get_yandex_market_report, REPORT_COLUMNS
 from scr.update_data_ym import compare_prices_and_create_for_update, update_dataframe
 from scr.update_ym import update_price_ym
+from scr.ym_client import YandexMarketClient
 
 DEBUG = False
 
+# Хэши отчета и таблицы, обработанных в последнем успешном цикле, по диапазону
+last_processed_inputs: Dict[str, Tuple[Optional[str], str]] = {}
+
 async def save_debug_csv(df: pd.DataFrame, filename: str) -> None:
     if DEBUG:
         try:
@@ -29,50 +42,44 @@ async def save_debug_csv(df: pd.DataFrame, filename: str) -> None:
             logger.error(f"Ошибка при сохранении отладочного CSV {filename}: {str(e)}")
 
 async def keep_specific_columns(df):
-    columns_to_keep = [
-        'SHOP_SKU', 'OFFER', 'MAIN_PRICE', 'MERCH_PRICE_WITH_PROMOS',
-        'PRICE_GREEN_THRESHOLD', 'PRICE_RED_THRESHOLD', 'PRICE_WITH_PROMOS',
-        'SHOP_WITH_BEST_PRICE_ON_MARKET', 'PRICE.1'
-    ]
-    return await asyncio.to_thread(lambda: df[columns_to_keep].dropna(subset=['PRICE.1']))
+    return await asyncio.to_thread(lambda: df[REPORT_COLUMNS].dropna(subset=['PRICE.1']))
 
 async def process_yandex_market_range(
         range_name: str,
         sheet_range: str,
         api_key: str,
         business_id: int,
-        executor: ThreadPoolExecutor
+        executor: ThreadPoolExecutor,
+        sheet_df: Optional[pd.DataFrame] = None,
+        session: Optional[ClientSession] = None
 ) -> None:
     ym_logger = logger.bind(marketplace="YandexMarket", range=range_name)
     my_market = ['SSmart shop','Tech PC Components','ByMarket']
-    column_names = {
-        'seller_id': 'SHOP_SKU',
-        'name': 'OFFER',
-        'link': 'LINK',
-        'price': 'MERCH_PRICE_WITH_PROMOS',
-        'stop': 'STOP',
-        'mp_on_market': 'PRICE.1',
-        'market_with_mp': 'SHOP_WITH_BEST_PRICE_ON_MARKET',
-        'prim': 'PRIM'
-    }
+    column_names = YM_COLUMN_NAMES
+    # Метки метрик этой задачи относятся к магазину
+    current_shop.set(range_name)
     try:
         ym_logger.info("Начало обработки диапазона")
 
-        # Получение данных из Google Sheets
-        df: Optional[pd.DataFrame] = None
-        try:
-            df = await get_sheet_data(SAMPLE_SPREADSHEET_ID, sheet_range)
-        except Exception as e:
-            ym_logger.error(f"Ошибка при получении данных из Google Sheets: {str(e)}")
-            return
+        # Получение данных из Google Sheets, если они не прочитаны заранее общим запросом
+        df: Optional[pd.DataFrame] = sheet_df
+        if df is None:
+            try:
+                with metrics.stage('sheets_read'):
+                    df = await get_sheet_data(SAMPLE_SPREADSHEET_ID, sheet_range)
+            except Exception as e:
+                ym_logger.error(f"Ошибка при получении данных из Google Sheets: {str(e)}")
+                return
 
+        if df is not None:
+            metrics.inc('ym_rows_read_total', len(df))
         current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
         await save_debug_csv(df, f"report/{range_name}{current_time}_first.csv")
 
         # Получение отчета с Яндекс.Маркета
         ym_report_df: Optional[pd.DataFrame] = None
         try:
-            ym_report_df = await get_yandex_market_report(api_key, business_id)
+            ym_report_df = await get_yandex_market_report(api_key, business_id, session)
             ym_report_df = await keep_specific_columns(ym_report_df)
             # ym_report_df = ym_report_df.dropna(subset=['PRICE.1'])
             await save_debug_csv(ym_report_df, f"report/{range_name}{current_time}_ym_report.csv")
@@ -81,26 +88,70 @@ async def process_yandex_market_range(
             ym_logger.error(f"Ошибка при получении отчета с Яндекс.Маркета: {str(e)}")
             return
 
+        # Если ни отчет, ни таблица не изменились с прошлого цикла, повторная обработка не нужна.
+        # С планировщиком - только если нет товаров, срок проверки которых уже наступил
+        # (например, не поместившихся в лимит товаров прошлого цикла)
+        inputs = (report_cache.current_digest(business_id), await asyncio.to_thread(frame_digest, df))
+        if report_cache.is_unchanged(business_id) and last_processed_inputs.get(range_name) == inputs:
+            due_in = scheduler.seconds_until_due(business_id=business_id) if SCHEDULER_ENABLED else None
+            if due_in is None or due_in > 0:
+                ym_logger.info("Отчет и таблица не изменились с прошлого цикла, сравнение и запись пропущены")
+                return
+            ym_logger.info("Отчет и таблица не изменились, но есть товары к проверке по расписанию")
+
         # Обновление и сравнение данных
         try:
-
-
-            updated_df = await update_dataframe(df, ym_report_df,column_names)
+            with metrics.stage('merge'):
+                merged_df = await update_dataframe(df, ym_report_df,column_names)
             # print(ym_report_df.info())
-            updated_df, for_update_df = await compare_prices_and_create_for_update(updated_df,column_names,my_market)
-            await write_sheet_data(updated_df, SAMPLE_SPREADSHEET_ID, sheet_range.replace('1', '3'))
+            with metrics.stage('compare'):
+                if SCHEDULER_ENABLED:
+                    updated_df, for_update_df, decisions = await compare_due_prices(
+                        business_id, merged_df, column_names, my_market)
+                else:
+                    updated_df, for_update_df, decisions = await compare_prices_and_create_for_update(
+                        merged_df, column_names, my_market, with_decisions=True, business_id=business_id)
+            if PRICE_LEDGER_ENABLED:
+                with metrics.stage('price_ledger'):
+                    for_update_df = await skip_already_sent(business_id, updated_df, for_update_df, decisions,
+                                                            column_names)
+            if SCHEDULER_ENABLED:
+                for_update_df = limit_price_pushes(business_id, merged_df, updated_df, for_update_df, decisions,
+                                                   column_names)
+            metrics.inc('ym_skus_repriced_total', len(for_update_df))
+            if PRICE_HISTORY_ENABLED:
+                with metrics.stage('price_history'):
+                    await save_price_history(business_id, updated_df, column_names, decisions)
+            with metrics.stage('sheets_write'):
+                written = await write_sheet_data(updated_df, SAMPLE_SPREADSHEET_ID, sheet_range.replace('1', '3'))
+            if written:
+                last_processed_inputs[range_name] = inputs
+                if SCHEDULER_ENABLED:
+                    scheduler.remember_prices(business_id, updated_df[column_names['seller_id']],
+                                              updated_df[column_names['price']])
         except Exception as e:
             ym_logger.error(f"Ошибка при обновлении и сравнении данных: {str(e)}")
             return
 
         # Обновление цен через API
         if not for_update_df.empty :
-            print(for_update_df.info())
+            ym_logger.info("Товаров к обновлению цен", rows=len(for_update_df))
             ym_logger.warning("Начало обновления цен через API", importance="high")
             try:
-                await update_price_ym(for_update_df, api_key, business_id, "SHOP_SKU",
-                                      "MERCH_PRICE_WITH_PROMOS",'discount_base' ,debug=DEBUG)
-                ym_logger.warning("Завершено обновление цен через API")
+                with metrics.stage('price_push'):
+                    push_summary = await update_price_ym(for_update_df, api_key, business_id, "SHOP_SKU",
+                                                         "MERCH_PRICE_WITH_PROMOS",'discount_base' ,debug=DEBUG,
+                                                         session=session)
+                metrics.inc('ym_offers_pushed_total', push_summary["succeeded"])
+                metrics.inc('ym_offers_failed_total', push_summary["failed"])
+                if PRICE_LEDGER_ENABLED:
+                    await record_accepted(business_id, for_update_df, push_summary["accepted"],
+                                          "SHOP_SKU", "MERCH_PRICE_WITH_PROMOS", 'discount_base')
+                ym_logger.warning("Завершено обновление цен через API",
+                                  offers=push_summary["offers"],
+                                  succeeded=push_summary["succeeded"],
+                                  failed=push_summary["failed"],
+                                  batches=len(push_summary["batches"]))
             except ClientError as e:
                 ym_logger.error(f"Ошибка при обновлении цен через API: {str(e)}")
             except Exception as e:
@@ -116,8 +167,47 @@ async def process_yandex_market_range(
     except Exception as e:
         ym_logger.error(f"Критическая ошибка при обработке диапазона {range_name}: {str(e)}", exc_info=True)
 
-async def update_data_ym() -> None:
+def build_start_schedule(count: int) -> List[float]:
+    """Сдвиги старта магазинов в секундах: равномерный шаг плюс случайный разброс"""
+    return [
+        i * YM_SHOP_START_STAGGER_SECONDS + random.uniform(0, YM_SHOP_START_JITTER_SECONDS) if i > 0 else 0.0
+        for i in range(count)
+    ]
+
+async def run_shop(
+        range_name: str,
+        sheet_range: str,
+        api_key: str,
+        business_id: int,
+        executor: ThreadPoolExecutor,
+        start_delay: float,
+        semaphore: asyncio.Semaphore,
+        sheet_df: Optional[pd.DataFrame] = None,
+        session: Optional[ClientSession] = None
+) -> Dict[str, object]:
+    """Запускает обработку магазина по расписанию и замеряет время обработки"""
+    ym_logger = logger.bind(marketplace="YandexMarket", range=range_name)
+    if start_delay > 0:
+        ym_logger.info(f"Старт обработки {range_name} через {start_delay:.1f} секунд")
+        await asyncio.sleep(start_delay)
+
+    async with semaphore:
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            await process_yandex_market_range(range_name, sheet_range, api_key, business_id, executor, sheet_df,
+                                              session)
+        except Exception as e:
+            status = "error"
+            ym_logger.error(f"Ошибка при обработке магазина {range_name}: {str(e)}", exc_info=True)
+        elapsed = time.perf_counter() - started
+
+    ym_logger.info(f"Время обработки {range_name}: {elapsed:.1f} секунд", status=status)
+    return {"range": range_name, "status": status, "seconds": round(elapsed, 3)}
+
+async def update_data_ym(ym_client: Optional[YandexMarketClient] = None) -> List[Dict[str, object]]:
     ym_logger = logger.bind(marketplace="YandexMarket")
+    timings: List[Dict[str, object]] = []
 
     try:
         ym_logger.warning("Начало обновления данных Yandex Market")
@@ -127,29 +217,64 @@ async def update_data_ym() -> None:
             ('SSmart_shop', 'YM_SSmart_Shop!A1:L', SSmart_shop_YM, B_id_SSmart_shop_YM)
         ]
 
+        cycle_started = time.perf_counter()
+        metrics.start_cycle()
+        semaphore = asyncio.Semaphore(YM_SHOP_CONCURRENCY)
+        schedule = build_start_schedule(len(ym_ranges))
+
+        # Все диапазоны магазинов читаются одним запросом; при ошибке каждый магазин читает свой сам
+        with metrics.stage('sheets_read'):
+            sheet_frames = await get_sheets_data(SAMPLE_SPREADSHEET_ID,
+                                                 [sheet_range for _, sheet_range, _, _ in ym_ranges])
+        if sheet_frames is None:
+            ym_logger.warning("Не удалось прочитать диапазоны одним запросом, чтение по отдельности")
+            sheet_frames = {}
+
         with ThreadPoolExecutor() as executor:
-            for i, (range_name, sheet_range, api_key, business_id) in enumerate(ym_ranges):
-                if i > 0:
-                    pause_duration = random.uniform(1 * 60, 1 * 60)
-                    ym_logger.warning(f"Пауза перед обработкой {range_name}: {pause_duration / 60:.2f} минут")
-                    await asyncio.sleep(pause_duration)
+            results = await asyncio.gather(
+                *[run_shop(range_name, sheet_range, api_key, business_id, executor, start_delay, semaphore,
+                           sheet_frames.get(sheet_range), ym_client.session if ym_client else None)
+                  for (range_name, sheet_range, api_key, business_id), start_delay in zip(ym_ranges, schedule)],
+                return_exceptions=True
+            )
 
-                await process_yandex_market_range(range_name, sheet_range, api_key, business_id, executor)
+        for (range_name, *_), result in zip(ym_ranges, results):
+            if isinstance(result, BaseException):
+                ym_logger.error(f"Обработка {range_name} прервана: {str(result)}")
+                timings.append({"range": range_name, "status": "error", "seconds": None})
+            else:
+                timings.append(result)
 
-        ym_logger.info("Обновление данных Yandex Market успешно завершено")
+        ym_logger.warning("Обновление данных Yandex Market завершено",
+                          cycle_seconds=round(time.perf_counter() - cycle_started, 3),
+                          shops=timings)
+        metrics.finish_cycle(timings=timings)
+        if ym_client:
+            ym_logger.info("Статистика пула соединений Яндекс.Маркета", **ym_client.pool_stats())
     except Exception as e:
         ym_logger.error(f"Критическая ошибка при обновлении данных Yandex Market: {str(e)}", exc_info=True)
+    return timings
 
 async def update_loop() -> None:
-    while True:
-        try:
-            logger.info("Начало цикла обновления данных для Yandex Market")
-            await update_data_ym()
-            logger.info("Цикл обновления данных для Yandex Market успешно завершен")
-        except Exception as e:
-            logger.warning(f"Критическая ошибка в цикле обновления данных: {str(e)}")
-        logger.warning(f"Ожидание 30 минут до следующего обновления")
-        await asyncio.sleep(30 * 60)
+    if METRICS_PORT:
+        await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    # Один клиент на все циклы: соединения с API переиспользуются между магазинами и циклами
+    async with YandexMarketClient() as ym_client:
+        while True:
+            try:
+                logger.info("Начало цикла обновления данных для Yandex Market")
+                await update_data_ym(ym_client)
+                logger.info("Цикл обновления данных для Yandex Market успешно завершен")
+            except Exception as e:
+                logger.warning(f"Критическая ошибка в цикле обновления данных: {str(e)}")
+            delay = UPDATE_INTERVAL_MINUTES * 60
+            if SCHEDULER_ENABLED:
+                # Следующий цикл - к ближайшему сроку проверки товаров, но не чаще минимального интервала
+                due_in = scheduler.seconds_until_due()
+                if due_in is not None:
+                    delay = min(max(due_in, scheduler.min_interval), delay)
+            logger.warning(f"Ожидание {delay / 60:.0f} минут до следующего обновления")
+            await asyncio.sleep(delay)
 
 async def main() -> None:
     await update_loop()
@@ -6,16 +6,27 @@ from .logger import logger
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
+# Получаем абсолютный путь к директории, где находится этот скрипт
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Определяем пути к файлам относительно директории скрипта
+token_path = os.path.join(script_dir, "acsess/token.json")
+credentials_path = os.path.join(script_dir, "acsess/credentials.json")
 
-async def get_credentials():
-    logger.info("Запуск функции get_credentials")
 
-    # Получаем абсолютный путь к директории, где находится этот скрипт
-    script_dir = os.path.dirname(os.path.abspath(__file__))
+def save_credentials(creds):
+    """Сохраняет учетные данные в token.json"""
+    logger.debug(f"Сохранение новых учетных данных в {token_path}")
+    try:
+        with open(token_path, "w") as token:
+            token.write(creds.to_json())
+        logger.info("Новые учетные данные сохранены в token.json")
+    except Exception as e:
+        logger.error(f"Не удалось сохранить учетные данные в token.json: {str(e)}")
 
-    # Определяем пути к файлам относительно директории скрипта
-    token_path = os.path.join(script_dir, "acsess/token.json")
-    credentials_path = os.path.join(script_dir, "acsess/credentials.json")
+
+async def get_credentials():
+    logger.info("Запуск функции get_credentials")
 
     creds = None
     if os.path.exists(token_path):
@@ -46,13 +57,7 @@ async def get_credentials():
                 logger.error(f"Не удалось получить новые учетные данные: {str(e)}")
                 raise
 
-        logger.debug(f"Сохранение новых учетных данных в {token_path}")
-        try:
-            with open(token_path, "w") as token:
-                token.write(creds.to_json())
-            logger.info("Новые учетные данные сохранены в token.json")
-        except Exception as e:
-            logger.error(f"Не удалось сохранить учетные данные в token.json: {str(e)}")
+        save_credentials(creds)
 
     logger.info("Учетные данные успешно получены")
     return creds
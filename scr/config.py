@@ -36,3 +36,87 @@ B_id_SSmart_shop_YM ="121883700"
 
 ByMarket_YM = os.getenv('ByMarket_YM')
 B_id_ByMarket_YM = "95137059"
+
+# Адрес API Яндекс.Маркета; для локальных проверок можно указать benchmarks/fake_ym_server.py
+YM_API_BASE_URL = os.getenv('YM_API_BASE_URL', 'https://api.partner.market.yandex.ru').rstrip('/')
+
+# Обновление цен через API Яндекс.Маркета
+YM_MAX_OFFERS_PER_REQUEST = 500  # максимум товаров в одном запросе offer-prices/updates
+YM_PRICE_BATCH_SIZE = 500  # количество товаров, отправляемых одним запросом
+
+# Ограничение частоты запросов к Partner API.
+# Группа -> (единиц в секунду, емкость корзины, одновременных запросов).
+# Для обновления цен единица - один товар, для остальных групп - один запрос.
+YM_RATE_LIMITS = {
+    'reports_generate': (100 / 3600, 5, 2),
+    'reports_info': (100 / 60, 10, 4),
+    'reports_download': (5, 10, 4),
+    'price_updates': (10000 / 60, 10000, 4),
+}
+YM_MAX_RETRIES = 5  # повторов при троттлинге (420/429) и ошибках сервера
+YM_RETRY_BASE_DELAY = 1.0  # базовая задержка экспоненциального backoff, секунд
+YM_RETRY_MAX_DELAY = 60.0  # максимальная задержка между повторами, секунд
+
+# Параллельная обработка магазинов
+YM_SHOP_CONCURRENCY = 3  # сколько магазинов обрабатывается одновременно
+YM_SHOP_START_STAGGER_SECONDS = 10  # сдвиг старта каждого следующего магазина
+YM_SHOP_START_JITTER_SECONDS = 10  # случайная добавка к сдвигу старта
+
+# Ожидание генерации отчета
+REPORT_POLL_MIN_INTERVAL = 2.0  # первый интервал опроса после ожидаемого времени, секунд
+REPORT_POLL_MAX_INTERVAL = 30.0  # максимальный интервал опроса, секунд
+REPORT_POLL_BACKOFF = 1.5  # множитель интервала опроса
+REPORT_POLL_TIMEOUT = 30 * 60  # общее время ожидания отчета, секунд
+
+# Кэш отчетов Яндекс.Маркета
+REPORT_CACHE_DIR = 'cache/reports'
+REPORT_CACHE_TTL_SECONDS = 24 * 60 * 60  # время жизни записи с последнего обращения
+REPORT_CACHE_MAX_BYTES = 512 * 1024 * 1024  # общий размер кэша на диске
+
+# Запись в Google Sheets
+SHEETS_DELTA_MAX_SHARE = 0.3  # доля измененных строк, после которой таблица пишется целиком
+SHEETS_MAX_WORKERS = 4  # потоков для блокирующих вызовов Google Sheets API
+SHEETS_TOKEN_REFRESH_MARGIN = 5 * 60  # обновлять токен за столько секунд до истечения
+
+# История цен конкурентов
+PRICE_HISTORY_ENABLED = True
+
+# Журнал последних принятых API цен
+PRICE_LEDGER_ENABLED = True
+PRICE_LEDGER_TTL_SECONDS = 6 * 60 * 60  # после этого срока запись не считается подтверждением цены
+
+# Общий пул HTTP-соединений с API Яндекс.Маркета
+YM_HTTP_POOL_LIMIT = 20  # всего соединений
+YM_HTTP_POOL_LIMIT_PER_HOST = 10  # соединений с одним хостом
+YM_HTTP_KEEPALIVE_SECONDS = 60  # сколько держать простаивающее соединение открытым
+YM_HTTP_DNS_TTL_SECONDS = 300  # время жизни записей DNS-кэша
+YM_HTTP_CONNECT_TIMEOUT = 10  # секунд на установку соединения
+YM_HTTP_READ_TIMEOUT = 120  # секунд ожидания данных от сервера
+
+# Метрики циклов обновления
+METRICS_ENABLED = True
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108  # порт /metrics в формате Prometheus; None - без HTTP-сервера
+METRICS_SUMMARY_PATH = 'metrics/cycles.jsonl'  # сводка по каждому циклу, строка JSON на цикл
+
+# Планировщик переоценки по волатильности цены конкурента
+SCHEDULER_ENABLED = True
+SCHEDULER_MIN_INTERVAL_MINUTES = 10  # минимальный интервал проверки товара и пауза между циклами
+SCHEDULER_MAX_INTERVAL_MINUTES = 4 * 60  # стабильные товары проверяются не реже
+SCHEDULER_VOLATILITY_ALPHA = 0.3  # вес нового наблюдения в оценке частоты изменений цены
+SCHEDULER_MAX_SKUS_PER_CYCLE = 200_000  # товаров на проверку за цикл на магазин
+SCHEDULER_CPU_BUDGET_SECONDS = 10.0  # бюджет времени сравнения цен за цикл на магазин
+SCHEDULER_MAX_PRICE_REQUESTS_PER_CYCLE = 20  # запросов на обновление цен за цикл на магазин
+
+# Сравнение цен больших каталогов в пуле процессов
+REPRICING_EXECUTOR = 'thread'  # 'thread' - в процессе приложения, 'process' - по частям в пуле процессов
+REPRICING_PROCESSES = None  # процессов в пуле; None - по числу ядер, но не больше числа частей
+REPRICING_SHARDS = 8  # частей каталога; при фиксированном seed результат зависит от числа частей, а не процессов
+REPRICING_PROCESS_MIN_ROWS = 500_000  # меньшие каталоги сравниваются в процессе приложения
+
+# Стратегии расчета новой цены (scr/pricing.py): {'strategy': имя, **параметры};
+# 'discount_base': (min, max) - множители цены для discount_base стратегии
+PRICING_DEFAULT_STRATEGY = {'strategy': 'fixed_step', 'min_step': 50, 'max_step': 200}
+PRICING_DISCOUNT_BASE_RANGE = (1.3, 1.6)  # discount_base по умолчанию - случайно из [цена * 1.3, цена * 1.6]
+PRICING_SHOP_STRATEGIES = {}  # business_id -> стратегия магазина, например {B_id_ByMarket_YM: {'strategy': 'match'}}
+PRICING_SKU_GROUP_STRATEGIES = []  # [(префикс артикула, стратегия)], первая подходящая группа важнее магазина
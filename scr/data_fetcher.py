@@ -1,98 +1,174 @@
+import asyncio
 import pandas as pd
-from .auth import get_credentials
-from googleapiclient.discovery import build
+from .sheets_client import sheets_client
 import sqlite3
 import traceback
 from .logger import logger  # Импорт логгера
+from .schema import YM_COLUMN_NAMES, PRICE, apply_schema, schema_dtypes
+
+def values_to_dataframe(values, column_names=YM_COLUMN_NAMES):
+    """
+    Преобразует значения диапазона (первая строка - заголовки) в pandas DataFrame.
+    Колонки из схемы приводятся к своим типам, цены без значения остаются NA.
+    """
+    df = pd.DataFrame(values[2:], columns=values[0])
+
+    # Заменяем пустые строки и None на NaN
+    df = df.replace(['', None], pd.NA)
+    # Заполняем пустые значения нечисловых колонок фразой "Нет значения"
+    prices = [column for column, dtype in schema_dtypes(column_names).items() if dtype == PRICE]
+    text_columns = df.columns.difference(prices, sort=False)
+    df[text_columns] = df[text_columns].fillna("Нет значения")
+    return apply_schema(df, column_names)
 
 async def get_sheet_data(spreadsheet_id, range_name):
     """Получает данные из Google Sheets и возвращает их в виде pandas DataFrame"""
-    creds = await get_credentials()
-    service = build('sheets', 'v4', credentials=creds)
-
     try:
-        result = service.spreadsheets().values().get(spreadsheetId=spreadsheet_id,
-                                                    range=range_name).execute()
+        service = await sheets_client.get_service()
+        request = service.spreadsheets().values().get(spreadsheetId=spreadsheet_id,
+                                                      range=range_name)
+        result = await sheets_client.execute(request)
         values = result.get('values', [])
     except Exception as e:
         logger.error("google_sheets_error", error=str(e))
         return None
 
-    df = pd.DataFrame(values[2:], columns=values[0])
+    return values_to_dataframe(values)
 
-    # Заменяем пустые строки и None на NaN
-    df = df.replace(['', None], pd.NA)
-    # Заполняем все пустые значения фразой "Нет значения"
-    df = df.fillna("Нет значения")
-    return df
+async def get_sheets_data(spreadsheet_id, range_names):
+    """
+    Получает несколько диапазонов одним запросом values().batchGet.
 
-async def save_to_database(df, db_name, product_data_table='product_data_ozon1', primary_key_cols=None):
-    """Записывает данные из DataFrame в таблицу базы данных, обновляя и удаляя существующие записи"""
+    :return: Словарь диапазон -> DataFrame (None для пустого диапазона)
+             или None при ошибке запроса
+    """
+    try:
+        service = await sheets_client.get_service()
+        request = service.spreadsheets().values().batchGet(spreadsheetId=spreadsheet_id,
+                                                           ranges=list(range_names))
+        result = await sheets_client.execute(request)
+    except Exception as e:
+        logger.error("google_sheets_error", error=str(e))
+        return None
+
+    # Диапазоны в ответе идут в порядке запроса, но их имена нормализованы API
+    frames = {}
+    for range_name, value_range in zip(range_names, result.get('valueRanges', [])):
+        values = value_range.get('values', [])
+        if not values:
+            logger.error("google_sheets_empty_range", range=range_name)
+            frames[range_name] = None
+        else:
+            frames[range_name] = values_to_dataframe(values)
+    logger.info("google_sheets_batch_get", ranges=len(frames))
+    return frames
+
+def quote_identifier(name):
+    """Экранирует имя таблицы или колонки для SQLite"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def sync_dataframe_to_table(conn, df, table, primary_key_cols):
+    """
+    Синхронизирует таблицу с DataFrame набором операций над множествами.
+
+    DataFrame загружается во временную таблицу через executemany, затем
+    удаления, вставки и обновления выполняются отдельными SQL-запросами
+    (анти-join и INSERT ... ON CONFLICT) в одной транзакции.
+
+    :return: Словарь со счетчиками inserted, updated, unchanged, deleted
+    """
+    c = conn.cursor()
+    table_name = quote_identifier(table)
+    columns = [quote_identifier(col) for col in df.columns]
+    key_columns = [quote_identifier(col) for col in primary_key_cols]
+    value_columns = [col for col in columns if col not in key_columns]
+    column_list = ", ".join(columns)
+    key_list = ", ".join(key_columns)
+    key_match = " AND ".join(f"s.{col} = t.{col}" for col in key_columns)
+    index_name = quote_identifier(f"{table}_pk")
+
+    logger.info("creating_table_if_not_exists")
+    c.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({column_list})")
+    try:
+        c.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index_name} ON {table_name} ({key_list})")
+    except sqlite3.IntegrityError:
+        # В старых данных могли остаться дубликаты ключей: оставляем последнюю запись
+        logger.warning("duplicate_keys_removed", table=table)
+        c.execute(f"DELETE FROM {table_name} WHERE rowid NOT IN "
+                  f"(SELECT MAX(rowid) FROM {table_name} GROUP BY {key_list})")
+        c.execute(f"CREATE UNIQUE INDEX {index_name} ON {table_name} ({key_list})")
+
+    logger.info("staging_records")
+    c.execute("DROP TABLE IF EXISTS temp.staging")
+    c.execute(f"CREATE TEMP TABLE staging ({column_list})")
+    # При повторе ключа в DataFrame остается последняя строка
+    staged_df = df.astype(str).drop_duplicates(subset=list(primary_key_cols), keep='last')
+    c.executemany(f"INSERT INTO temp.staging VALUES ({', '.join(['?'] * len(columns))})",
+                  staged_df.itertuples(index=False, name=None))
+
+    # Один проход по временной таблице: новые и изменившиеся строки
+    logger.info("counting_changes")
+    differs = " OR ".join(f"s.{col} IS NOT t.{col}" for col in value_columns) or "0"
+    c.execute("DROP TABLE IF EXISTS temp.changes")
+    c.execute(f"CREATE TEMP TABLE changes AS SELECT s.*, t.rowid IS NULL AS is_new FROM temp.staging s "
+              f"LEFT JOIN {table_name} t ON {key_match} WHERE t.rowid IS NULL OR {differs}")
+    changes = c.execute("SELECT COUNT(*) FROM temp.changes").fetchone()[0]
+    inserts = c.execute("SELECT COUNT(*) FROM temp.changes WHERE is_new").fetchone()[0]
+    updates = changes - inserts
+    unchanged = len(staged_df) - changes
+    existing = c.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+    deleted = existing - (len(staged_df) - inserts)
+
+    logger.info("applying_changes")
+    if deleted:
+        c.execute(f"CREATE UNIQUE INDEX temp.staging_pk ON staging ({key_list})")
+        c.execute(f"DELETE FROM {table_name} WHERE NOT EXISTS (SELECT 1 FROM temp.staging s WHERE "
+                  f"{' AND '.join(f's.{col} = {table_name}.{col}' for col in key_columns)})")
+    if changes:
+        if value_columns:
+            conflict = "DO UPDATE SET " + ", ".join(f"{col} = excluded.{col}" for col in value_columns)
+        else:
+            conflict = "DO NOTHING"
+        # WHERE true нужен SQLite, чтобы отличить ON CONFLICT от условия соединения
+        c.execute(f"INSERT INTO {table_name} ({column_list}) SELECT {column_list} FROM temp.changes WHERE true "
+                  f"ON CONFLICT ({key_list}) {conflict}")
+    c.execute("DROP TABLE temp.staging")
+    c.execute("DROP TABLE temp.changes")
+
+    return {"inserted": inserts, "updated": updates, "unchanged": unchanged, "deleted": deleted}
+
+def save_dataframe_to_database(df, db_name, product_data_table, primary_key_cols):
     conn = None
     try:
         logger.info("database_update_start", table=product_data_table, dataframe_size=len(df))
 
-        conn = sqlite3.connect(db_name)
-        c = conn.cursor()
-
-        logger.info("creating_table_if_not_exists")
-        columns = ", ".join([f'"{col}"' for col in df.columns])
-        c.execute(f"CREATE TABLE IF NOT EXISTS '{product_data_table}' ({columns})")
+        conn = sqlite3.connect(db_name, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-262144")
 
         if primary_key_cols is None:
             primary_key_cols = [df.columns[0]]
         logger.info("primary_keys", keys=primary_key_cols)
 
-        logger.info("fetching_existing_records")
-        c.execute(f"SELECT * FROM '{product_data_table}'")
-        existing_data = {tuple(row[:len(primary_key_cols)]): row for row in c.fetchall()}
-        logger.info("existing_records_count", count=len(existing_data))
-
-        updates = inserts = unchanged = deleted = 0
-
-        logger.info("processing_records_start")
-        for index, row in df.iterrows():
-            key_values = tuple(str(row[col]) for col in primary_key_cols)
-            values = tuple(str(v) for v in row.tolist())
-
-            if key_values in existing_data:
-                if values != existing_data[key_values]:
-                    placeholders = ", ".join([f'"{col}"=?' for col in df.columns])
-                    c.execute(
-                        f"UPDATE '{product_data_table}' SET {placeholders} WHERE {' AND '.join([f'"{col}"=?' for col in primary_key_cols])}",
-                        values + key_values)
-                    updates += 1
-                else:
-                    unchanged += 1
-                del existing_data[key_values]
-            else:
-                placeholders = ", ".join(["?"] * len(values))
-                c.execute(f"INSERT INTO '{product_data_table}' VALUES ({placeholders})", values)
-                inserts += 1
-
-            if index % 1000 == 0:
-                logger.info("processing_progress", records_processed=index + 1)
-
-        logger.info("deleting_missing_records")
-        for key in existing_data.keys():
-            c.execute(
-                f"DELETE FROM '{product_data_table}' WHERE {' AND '.join([f'"{col}"=?' for col in primary_key_cols])}",
-                key)
-            deleted += 1
-
-        conn.commit()
+        conn.execute("BEGIN")
+        try:
+            counters = sync_dataframe_to_table(conn, df, product_data_table, primary_key_cols)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
         logger.info("database_changes_committed")
 
-        total_records = max(len(df) + deleted, 1)
-        change_percentage = (updates + inserts + deleted) / total_records * 100
+        total_records = max(len(df) + counters["deleted"], 1)
+        change_percentage = (counters["updated"] + counters["inserted"] + counters["deleted"]) / total_records * 100
 
         logger.info("update_complete",
-                    inserted=inserts,
-                    updated=updates,
-                    unchanged=unchanged,
-                    deleted=deleted,
+                    **counters,
                     total_records=total_records,
                     change_percentage=f"{change_percentage:.2f}%")
+        return counters
 
     except Exception as e:
         logger.error("database_update_error",
@@ -102,5 +178,15 @@ async def save_to_database(df, db_name, product_data_table='product_data_ozon1',
         if conn:
             conn.close()
             logger.info("database_connection_closed")
+    return None
+
+async def save_to_database(df, db_name, product_data_table='product_data_ozon1', primary_key_cols=None):
+    """
+    Записывает данные из DataFrame в таблицу базы данных, обновляя и удаляя существующие записи.
+
+    :return: Словарь со счетчиками inserted, updated, unchanged, deleted или None при ошибке
+    """
+    return await asyncio.to_thread(save_dataframe_to_database, df, db_name, product_data_table, primary_key_cols)
+
 
 
@@ -1,50 +1,159 @@
-
-import asyncio
+import re
+import numpy as np
 import pandas as pd
-from googleapiclient.discovery import build
+from typing import Dict, List, Optional, Tuple
 from googleapiclient.errors import HttpError
-from .auth import get_credentials
+from .config import SHEETS_DELTA_MAX_SHARE
 from .logger import logger  # Импорт логгера
+from .sheets_client import sheets_client
+
+# Последние успешно записанные данные по (spreadsheet_id, range_name)
+last_written: Dict[Tuple[str, str], List[list]] = {}
+
+A1_RANGE_PATTERN = re.compile(r"^(?:(?P<sheet>.+)!)?(?P<start_col>[A-Z]+)(?P<start_row>\d+)(?::(?P<end_col>[A-Z]+)\d*)?$")
+
+
+def column_to_index(column: str) -> int:
+    index = 0
+    for char in column:
+        index = index * 26 + ord(char) - ord('A') + 1
+    return index
+
+
+def index_to_column(index: int) -> str:
+    column = ''
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        column = chr(ord('A') + remainder) + column
+    return column
+
+
+def changed_row_blocks(previous: List[list], current: List[list]) -> List[Tuple[int, int]]:
+    """Возвращает непрерывные блоки измененных строк как пары (начало, конец включительно)"""
+    blocks: List[Tuple[int, int]] = []
+    for i, (old_row, new_row) in enumerate(zip(previous, current)):
+        if old_row != new_row:
+            if blocks and blocks[-1][1] == i - 1:
+                blocks[-1] = (blocks[-1][0], i)
+            else:
+                blocks.append((i, i))
+    return blocks
+
+
+def build_delta_ranges(range_name: str, previous: Optional[List[list]], data: List[list]) -> Optional[List[dict]]:
+    """
+    Формирует минимальные диапазоны для values().batchUpdate.
+
+    :return: Список {"range", "values"} (пустой, если ничего не изменилось)
+             или None, если нужна полная запись
+    """
+    match = A1_RANGE_PATTERN.match(range_name)
+    if previous is None or match is None or len(previous) != len(data) or not data:
+        return None
+    if any(len(old_row) != len(new_row) for old_row, new_row in zip(previous, data)):
+        return None
+
+    blocks = changed_row_blocks(previous, data)
+    changed_rows = sum(end - start + 1 for start, end in blocks)
+    if changed_rows > len(data) * SHEETS_DELTA_MAX_SHARE:
+        return None
+
+    sheet = f"{match.group('sheet')}!" if match.group('sheet') else ''
+    start_col = match.group('start_col')
+    start_row = int(match.group('start_row'))
+    end_col = index_to_column(column_to_index(start_col) + max(len(row) for row in data) - 1)
+    return [
+        {
+            "range": f"{sheet}{start_col}{start_row + start}:{end_col}{start_row + end}",
+            "values": data[start:end + 1]
+        }
+        for start, end in blocks
+    ]
+
+
+def sheet_values(df: pd.DataFrame) -> List[list]:
+    """
+    Преобразует DataFrame в список строк для записи в Google Sheets, пустые значения - ''.
+    Значения - встроенные типы Python; цены Float32 округляются до копеек, чтобы
+    в таблицу не попадала погрешность float32.
+    """
+    if not len(df.columns):
+        return [[] for _ in range(len(df))]
+    columns = []
+    for _, column in df.items():
+        if pd.api.types.is_float_dtype(column.dtype):
+            values = column.to_numpy(dtype=float, na_value=np.nan).round(2).astype(object)
+        else:
+            values = column.to_numpy(dtype=object)
+        values[pd.isna(values)] = ''
+        columns.append(values)
+    return np.column_stack(columns).tolist()
 
 
 async def write_sheet_data(df, spreadsheet_id, range_name):
+    """
+    Записывает DataFrame в Google Sheets.
+
+    Если в этом процессе диапазон уже записывался, отправляются только
+    изменившиеся блоки строк одним values().batchUpdate. Полная запись
+    выполняется при первой записи, при изменении размеров таблицы или если
+    изменилось больше SHEETS_DELTA_MAX_SHARE строк.
+
+    :return: True, если данные записаны (или не изменились)
+    """
     logger.info("Запуск функции write_sheet_data",
                 spreadsheet_id=spreadsheet_id,
                 range_name=range_name)
 
-    creds = await get_credentials()
-
     try:
-        service = build("sheets", "v4", credentials=creds)
+        service = await sheets_client.get_service()
 
-        # Заполняем пустые значения в DataFrame
-        df = df.fillna('')
+        # Преобразуем DataFrame в список списков для записи в Google Sheets
+        data = sheet_values(df)
         logger.debug("DataFrame подготовлен для записи", rows=len(df), columns=len(df.columns))
 
-        # Преобразуем DataFrame в список списков для записи в Google Sheets
-        data = df.values.tolist()
+        cache_key = (spreadsheet_id, range_name)
+        delta = build_delta_ranges(range_name, last_written.get(cache_key), data)
 
-        body = {
-            "values": data
-        }
+        if delta == []:
+            logger.info("Данные не изменились, запись в Google Sheets пропущена", rows=len(data))
+            return True
+
+        if delta is None:
+            body = {
+                "values": data
+            }
 
-        # Выполняем синхронный вызов в потоке
-        request = service.spreadsheets().values().update(
-            spreadsheetId=spreadsheet_id,
-            range=range_name,
-            valueInputOption="USER_ENTERED",
-            body=body
-        )
+            request = service.spreadsheets().values().update(
+                spreadsheetId=spreadsheet_id,
+                range=range_name,
+                valueInputOption="USER_ENTERED",
+                body=body
+            )
+            logger.info("Выполнение запроса к API Google Sheets: полная запись", rows=len(data))
+        else:
+            body = {
+                "valueInputOption": "USER_ENTERED",
+                "data": delta
+            }
+            request = service.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body=body
+            )
+            logger.info("Выполнение запроса к API Google Sheets: запись изменений",
+                        ranges=len(delta),
+                        rows=sum(len(block["values"]) for block in delta))
 
-        logger.info("Выполнение запроса к API Google Sheets")
-        # Запускаем запрос и получаем ответ
-        response = await asyncio.to_thread(request.execute)
+        # Запускаем запрос в пуле потоков клиента и получаем ответ
+        response = await sheets_client.execute(request)
+        last_written[cache_key] = data
 
         # Теперь response содержит фактический ответ
         logger.info("Данные успешно обновлены в Google Sheets",
-                    updated_cells=response.get('updatedCells', 'Неизвестно'),
-                    updated_rows=response.get('updatedRows', 'Неизвестно'),
-                    updated_columns=response.get('updatedColumns', 'Неизвестно'))
+                    updated_cells=response.get('updatedCells', response.get('totalUpdatedCells', 'Неизвестно')),
+                    updated_rows=response.get('updatedRows', response.get('totalUpdatedRows', 'Неизвестно')),
+                    updated_columns=response.get('updatedColumns', response.get('totalUpdatedColumns', 'Неизвестно')))
+        return True
 
     except HttpError as err:
         # Пример обработки различных ошибок
@@ -63,5 +172,6 @@ async def write_sheet_data(df, spreadsheet_id, range_name):
                          spreadsheet_id=spreadsheet_id,
                          range_name=range_name,
                          error=str(e))
+    return False
 
 
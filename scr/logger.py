@@ -1,11 +1,24 @@
 import structlog
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+import atexit
 import json
+import multiprocessing
 import os
+import queue
+import threading
 from datetime import datetime, timedelta
 import time
 
+# Размер очереди записей лога; при переполнении записи отбрасываются, а не блокируют цикл событий
+LOG_QUEUE_SIZE = 10000
+# Не больше LOG_SAMPLE_LIMIT сообщений с одним sample_key за LOG_SAMPLE_PERIOD секунд
+LOG_SAMPLE_LIMIT = 20
+LOG_SAMPLE_PERIOD = 60
+
+# Обработчик очереди логов; его счетчик dropped экспортирует scr.metrics
+queue_handler = None
+
 class NonEscapingJsonEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, str):
@@ -84,33 +97,70 @@ class ErrorWarningFilter(logging.Filter):
     def filter(self, record):
         return record.levelno in (logging.ERROR, logging.WARNING)
 
-def add_timestamp(logger, method_name, event_dict):
-    event_dict['timestamp'] = time.strftime("%Y-%m-%d %H:%M:%S %z", time.localtime())
-    return event_dict
+class RateLimitProcessor:
+    """
+    Ограничивает частоту однотипных сообщений.
+
+    Сообщения с ключом sample_key (например, ошибки по отдельным товарам)
+    пропускаются не чаще limit раз за period секунд на ключ, остальные
+    отбрасываются. Первое сообщение следующего периода получает поле
+    suppressed с числом отброшенных.
+    """
+
+    def __init__(self, limit=LOG_SAMPLE_LIMIT, period=LOG_SAMPLE_PERIOD):
+        self.limit = limit
+        self.period = period
+        self.lock = threading.Lock()
+        # sample_key -> [начало периода, выведено, отброшено]
+        self.windows = {}
+
+    def __call__(self, logger, method_name, event_dict):
+        key = event_dict.pop('sample_key', None)
+        if key is None:
+            return event_dict
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.setdefault(key, [now, 0, 0])
+            if now - window[0] >= self.period:
+                if window[2]:
+                    event_dict['suppressed'] = window[2]
+                window[:] = [now, 0, 0]
+            if window[1] >= self.limit:
+                window[2] += 1
+                raise structlog.DropEvent
+            window[1] += 1
+        return event_dict
 
-def configure_logging(log_directory='logs', log_level=logging.INFO):
-    os.makedirs(log_directory, exist_ok=True)
-    log_file_path = os.path.join(log_directory, 'app.log')
+class NonFormattingQueueHandler(QueueHandler):
+    """
+    Передает запись в очередь без форматирования: рендеринг JSON и запись
+    в файл выполняет поток QueueListener. Переполненная очередь не блокирует
+    вызывающий код, запись отбрасывается и учитывается в dropped
+    (метрика log_records_dropped_total, см. scr.metrics).
+    """
 
-    root_logger = logging.getLogger()
-    root_logger.setLevel(log_level)
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
 
-    file_handler = TimedRotatingFileHandler(
-        log_file_path,
-        when="midnight",
-        interval=1,
-        backupCount=10,
-        encoding='utf-8'
-    )
-    file_handler.setLevel(log_level)
+    def prepare(self, record):
+        return record
 
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.WARNING)
-    console_handler.addFilter(ErrorWarningFilter())
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def add_timestamp(logger, method_name, event_dict):
+    event_dict['timestamp'] = time.strftime("%Y-%m-%d %H:%M:%S %z", time.localtime())
+    return event_dict
 
+def configure_structlog():
     structlog.configure(
         processors=[
             structlog.stdlib.filter_by_level,
+            RateLimitProcessor(),
             structlog.stdlib.add_logger_name,
             structlog.stdlib.add_log_level,
             structlog.stdlib.PositionalArgumentsFormatter(),
@@ -129,6 +179,35 @@ def configure_logging(log_directory='logs', log_level=logging.INFO):
         cache_logger_on_first_use=True,
     )
 
+def configure_logging(log_directory='logs', log_level=logging.INFO):
+    if multiprocessing.parent_process() is not None:
+        # Процесс пула (scr.sharding): файл лога, поток записи и очистку старых логов
+        # ведет только родительский процесс, сводку по частям пишет он же
+        configure_structlog()
+        logging.getLogger().addHandler(logging.NullHandler())
+        return structlog.get_logger()
+
+    os.makedirs(log_directory, exist_ok=True)
+    log_file_path = os.path.join(log_directory, 'app.log')
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(log_level)
+
+    file_handler = TimedRotatingFileHandler(
+        log_file_path,
+        when="midnight",
+        interval=1,
+        backupCount=10,
+        encoding='utf-8'
+    )
+    file_handler.setLevel(log_level)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.WARNING)
+    console_handler.addFilter(ErrorWarningFilter())
+
+    configure_structlog()
+
     file_processor = structlog.processors.JSONRenderer(serializer=json_serializer)
     file_formatter = structlog.stdlib.ProcessorFormatter(processor=file_processor)
     file_handler.setFormatter(file_formatter)
@@ -137,8 +216,15 @@ def configure_logging(log_directory='logs', log_level=logging.INFO):
     console_formatter = structlog.stdlib.ProcessorFormatter(processor=console_processor)
     console_handler.setFormatter(console_formatter)
 
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
+    # Форматирование и запись в файл и консоль выполняются в отдельном потоке
+    global queue_handler
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonFormattingQueueHandler(log_queue)
+    root_logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    # Дописать оставшиеся в очереди записи при завершении процесса
+    atexit.register(listener.stop)
 
     cleanup_old_logs(log_directory)
 
@@ -0,0 +1,214 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from aiohttp import web
+
+from scr.config import METRICS_ENABLED, METRICS_SUMMARY_PATH
+from scr import logger as log_config
+from scr.logger import logger
+
+# Границы бакетов гистограмм длительности, секунды
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Магазин, к которому относятся метрики текущей задачи
+current_shop: ContextVar[str] = ContextVar('current_shop', default='all')
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label_value(value)}"' for key, value in labels) + '}'
+
+
+class Stage:
+    """Замер длительности этапа; результат попадает в гистограмму и сводку цикла"""
+
+    __slots__ = ('metrics', 'name', 'shop', 'started')
+
+    def __init__(self, metrics: 'Metrics', name: str, shop: str):
+        self.metrics = metrics
+        self.name = name
+        self.shop = shop
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started
+        self.metrics.observe('ym_stage_seconds', seconds, stage=self.name, shop=self.shop)
+        with self.metrics.lock:
+            stages = self.metrics.cycle_shop(self.shop)['stages']
+            stages[self.name] = round(stages.get(self.name, 0.0) + seconds, 3)
+        return False
+
+
+class Metrics:
+    """
+    Счетчики, гистограммы и значения метрик с метками, в том числе по магазину.
+
+    Метка shop по умолчанию берется из current_shop. Экспорт - текстовый формат
+    Prometheus и JSON-сводка по циклу. Если метрики выключены, методы сразу
+    возвращаются, а stage() отдает пустой контекстный менеджер.
+    """
+
+    def __init__(self, enabled: bool = METRICS_ENABLED, summary_path: Optional[str] = METRICS_SUMMARY_PATH):
+        self.enabled = enabled
+        self.summary_path = summary_path
+        self.lock = threading.Lock()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+        # name -> labels -> [счетчики по бакетам..., +Inf, сумма]
+        self.histograms: Dict[str, Dict[Labels, list]] = {}
+        self.cycle: Dict[str, dict] = {}
+        self.cycle_started = time.time()
+        # Сколько отброшенных записей лога уже учтено в log_records_dropped_total
+        self.log_records_dropped = 0
+
+    def _labels(self, labels: Dict[str, str]) -> Labels:
+        labels.setdefault('shop', current_shop.get())
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def cycle_shop(self, shop: str) -> dict:
+        return self.cycle.setdefault(shop, {'stages': {}, 'counters': {}})
+
+    def stage(self, name: str, shop: Optional[str] = None):
+        """Контекстный менеджер замера этапа: with metrics.stage('compare'): ..."""
+        if not self.enabled:
+            return nullcontext()
+        return Stage(self, name, shop if shop is not None else current_shop.get())
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = self._labels(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+            counters = self.cycle_shop(dict(key)['shop'])['counters']
+            counters[name] = counters.get(name, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = self._labels(labels)
+        with self.lock:
+            self.gauges.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = self._labels(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            buckets = series.get(key)
+            if buckets is None:
+                buckets = series[key] = [0] * (len(DURATION_BUCKETS) + 1) + [0.0]
+            buckets[bisect.bisect_left(DURATION_BUCKETS, value)] += 1
+            buckets[-1] += value
+
+    def collect_log_drops(self) -> int:
+        """
+        Переносит в log_records_dropped_total записи лога, отброшенные при
+        переполнении очереди с прошлого вызова, и предупреждает о них.
+
+        :return: Количество новых отброшенных записей
+        """
+        handler = log_config.queue_handler
+        if not self.enabled or handler is None:
+            return 0
+        dropped = handler.dropped - self.log_records_dropped
+        if dropped:
+            self.log_records_dropped += dropped
+            self.inc('log_records_dropped_total', dropped, shop='all')
+            logger.warning(f"Очередь логов переполнена, отброшено записей: {dropped}")
+        return dropped
+
+    def render_prometheus(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        self.collect_log_drops()
+        lines = []
+        with self.lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for name, series in sorted(metrics.items()):
+                    lines.append(f'# TYPE {name} {kind}')
+                    lines.extend(f'{name}{format_labels(labels)} {value:g}' for labels, value in series.items())
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                for labels, buckets in series.items():
+                    cumulative = 0
+                    for bound, count in zip(DURATION_BUCKETS + ('+Inf',), buckets):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{format_labels(labels + (("le", str(bound)),))} {cumulative}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {buckets[-1]:.6f}')
+                    lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def start_cycle(self) -> None:
+        """Начинает сводку нового цикла"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.cycle = {}
+            self.cycle_started = time.time()
+
+    def finish_cycle(self, **extra) -> Optional[dict]:
+        """Завершает цикл: дописывает сводку строкой JSON в summary_path и возвращает ее"""
+        if not self.enabled:
+            return None
+        self.collect_log_drops()
+        with self.lock:
+            summary = {
+                'started': datetime.fromtimestamp(self.cycle_started).isoformat(timespec='seconds'),
+                'seconds': round(time.time() - self.cycle_started, 3),
+                'shops': self.cycle,
+                **extra,
+            }
+        self.set('ym_cycle_seconds', summary['seconds'], shop='all')
+        if self.summary_path:
+            try:
+                os.makedirs(os.path.dirname(self.summary_path) or '.', exist_ok=True)
+                with open(self.summary_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(summary, ensure_ascii=False) + '\n')
+            except OSError as e:
+                logger.error(f"Не удалось сохранить сводку метрик: {str(e)}")
+        return summary
+
+
+metrics = Metrics()
+
+
+async def start_metrics_server(host: str, port: int) -> Optional[web.AppRunner]:
+    """Запускает HTTP-сервер с метриками в формате Prometheus на /metrics"""
+    if not metrics.enabled:
+        return None
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render_prometheus(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        # Метрики не должны останавливать обновление цен: работаем без /metrics
+        logger.error(f"Не удалось запустить сервер метрик на {host}:{port}, /metrics недоступен: {str(e)}")
+        await runner.cleanup()
+        return None
+    logger.info(f"Метрики доступны по адресу http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,234 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from scr.config import SQLITE_DB_NAME
+from scr.logger import logger
+from scr.update_data_ym import DECISION_DEFERRED
+
+# Значение "нет данных" в целочисленных колонках состояния (цены неотрицательны)
+MISSING = -1
+STATE_COLUMNS = ['competitor_price', 'our_price', 'stop_price', 'shop_id', 'decision']
+
+
+def to_kopecks(values: pd.Series) -> np.ndarray:
+    """Цены в целых копейках, MISSING для пустых значений"""
+    numeric = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    missing = np.isnan(numeric)
+    return np.where(missing, MISSING, np.rint(np.where(missing, 0, numeric) * 100)).astype(np.int64)
+
+
+def to_sql_values(values: np.ndarray) -> list:
+    """int64 -> список int, MISSING -> None"""
+    result = values.astype(object)
+    result[values == MISSING] = None
+    return result.tolist()
+
+
+class PriceHistoryStore:
+    """
+    Хранилище истории цен в SQLite, только с добавлением записей.
+
+    Для каждого товара хранится цена конкурента, наша цена, стоп-цена
+    (в целых копейках), магазин с лучшей ценой и код решения DECISION_*.
+    Запись добавляется только в циклах, где состояние товара изменилось,
+    и действует до следующей записи; сами циклы фиксируются в
+    price_history_cycle. Артикулы и магазины вынесены в справочники.
+    Таблица истории кластеризована по (sku_id, ts), поэтому последняя запись
+    по товару и история товара за период читаются по первичному ключу.
+
+    ts - unix-время в миллисекундах, в пределах хранилища строго возрастает,
+    поэтому циклы, записанные в одну миллисекунду (например, два диапазона
+    одного магазина), не совпадают по ключу. Записи добавляются обычным INSERT:
+    совпадение ключа с записью другого процесса - ошибка, а не перезапись.
+    """
+
+    def __init__(self, db_name: str = SQLITE_DB_NAME):
+        self.db_name = db_name
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+        # Справочники: артикул -> sku_id по business_id и магазин -> shop_id
+        self.sku_ids: Dict[str, pd.Series] = {}
+        self.shop_ids: Dict[str, int] = {}
+        # Последнее записанное состояние товаров по business_id, индекс - sku_id
+        self.last_state: Dict[str, pd.DataFrame] = {}
+        self.last_ts = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            conn = sqlite3.connect(self.db_name, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS price_history_sku (
+                    id INTEGER PRIMARY KEY,
+                    business_id TEXT NOT NULL,
+                    sku TEXT NOT NULL,
+                    UNIQUE (business_id, sku)
+                );
+                CREATE TABLE IF NOT EXISTS price_history_shop (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE IF NOT EXISTS price_history_cycle (
+                    business_id TEXT NOT NULL,
+                    ts INTEGER NOT NULL,
+                    rows INTEGER NOT NULL,
+                    changed INTEGER NOT NULL,
+                    PRIMARY KEY (business_id, ts)
+                );
+                CREATE TABLE IF NOT EXISTS price_history (
+                    sku_id INTEGER NOT NULL,
+                    ts INTEGER NOT NULL,
+                    competitor_price INTEGER,
+                    our_price INTEGER,
+                    stop_price INTEGER,
+                    shop_id INTEGER,
+                    decision INTEGER NOT NULL,
+                    PRIMARY KEY (sku_id, ts)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS price_history_ts ON price_history (ts);
+            """)
+            self.conn = conn
+        return self.conn
+
+    def _sku_ids(self, business_id: str, skus: pd.Series) -> np.ndarray:
+        """Возвращает sku_id для артикулов, добавляя новые в справочник"""
+        lookup = self.sku_ids.get(business_id)
+        positions = lookup.index.get_indexer(skus) if lookup is not None else None
+        if positions is None or (positions < 0).any():
+            new_skus = skus.unique() if positions is None else skus[positions < 0].unique()
+            self.conn.executemany("INSERT OR IGNORE INTO price_history_sku (business_id, sku) VALUES (?, ?)",
+                                  [(business_id, sku) for sku in new_skus])
+            rows = self.conn.execute("SELECT id, sku FROM price_history_sku WHERE business_id = ?",
+                                     (business_id,)).fetchall()
+            lookup = pd.Series([row[0] for row in rows], index=[row[1] for row in rows], dtype=np.int64)
+            self.sku_ids[business_id] = lookup
+            positions = lookup.index.get_indexer(skus)
+        return lookup.to_numpy()[positions]
+
+    def _shop_ids(self, shops: pd.Series) -> np.ndarray:
+        """Возвращает shop_id для магазинов, добавляя новые в справочник"""
+        missing = [shop for shop in shops.unique() if shop not in self.shop_ids]
+        if missing:
+            self.conn.executemany("INSERT OR IGNORE INTO price_history_shop (name) VALUES (?)",
+                                  [(shop,) for shop in missing])
+            for shop_id, name in self.conn.execute("SELECT id, name FROM price_history_shop"):
+                self.shop_ids[name] = shop_id
+        return shops.map(self.shop_ids).to_numpy(dtype=np.int64)
+
+    def _load_last_state(self, business_id: str) -> pd.DataFrame:
+        if business_id not in self.last_state:
+            state = pd.read_sql_query("""
+                SELECT h.sku_id, h.competitor_price, h.our_price, h.stop_price, h.shop_id, h.decision
+                FROM price_history_sku s
+                JOIN price_history h ON h.sku_id = s.id
+                    AND h.ts = (SELECT MAX(ts) FROM price_history WHERE sku_id = s.id)
+                WHERE s.business_id = ?
+            """, self.conn, params=(business_id,), index_col='sku_id')
+            self.last_state[business_id] = state.fillna(MISSING).astype(np.int64)
+        return self.last_state[business_id]
+
+    def record_cycle(self, business_id, df: pd.DataFrame, column_names: Dict[str, str],
+                     decisions: pd.Series, ts: Optional[int] = None) -> int:
+        """
+        Записывает цикл: добавляет записи для товаров, состояние которых изменилось.
+        Отложенные товары (DECISION_DEFERRED) в этом цикле не проверялись, для них
+        остается действовать последняя запись.
+
+        :param ts: Время цикла в unix-миллисекундах; по умолчанию текущее
+        :return: Количество добавленных записей
+        """
+        if df.empty:
+            return 0
+        checked = decisions.to_numpy() != DECISION_DEFERRED
+        df, decisions = df[checked], decisions[checked]
+        business_id = str(business_id)
+        skus = df[column_names['seller_id']].astype(str)
+        shops = df[column_names['market_with_mp']].astype(str)
+
+        with self.lock:
+            ts = max(int(ts if ts is not None else time.time() * 1000), self.last_ts + 1)
+            self.last_ts = ts
+            conn = self._connect()
+            with conn:
+                state = pd.DataFrame({
+                    'competitor_price': to_kopecks(df[column_names['mp_on_market']]),
+                    'our_price': to_kopecks(df[column_names['price']]),
+                    'stop_price': to_kopecks(df[column_names['stop']]),
+                    'shop_id': self._shop_ids(shops),
+                    'decision': decisions.to_numpy(dtype=np.int64),
+                }, index=pd.Index(self._sku_ids(business_id, skus), name='sku_id'))
+                state = state[~state.index.duplicated(keep='last')].sort_index()
+
+                previous = self._load_last_state(business_id).reindex(state.index)
+                changed = (state != previous).any(axis=1).to_numpy()
+                delta = state[changed]
+
+                conn.executemany(
+                    "INSERT INTO price_history VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    zip(delta.index.tolist(), [ts] * len(delta),
+                        *(to_sql_values(delta[col].to_numpy()) for col in STATE_COLUMNS))
+                )
+                conn.execute("INSERT INTO price_history_cycle VALUES (?, ?, ?, ?)",
+                                 (business_id, ts, len(state), len(delta)))
+
+            if not delta.empty:
+                last_state = self.last_state[business_id]
+                kept = last_state[~last_state.index.isin(delta.index)]
+                self.last_state[business_id] = pd.concat([kept, delta]) if not kept.empty else delta
+        return len(delta)
+
+    def _query(self, sql: str, params: tuple) -> pd.DataFrame:
+        with self.lock:
+            df = pd.read_sql_query(sql, self._connect(), params=params)
+        for col in ('competitor_price', 'our_price', 'stop_price'):
+            df[col] = df[col] / 100
+        return df
+
+    def latest(self, business_id) -> pd.DataFrame:
+        """Последнее состояние каждого товара бизнеса"""
+        return self._query("""
+            SELECT s.sku, h.ts, h.competitor_price, h.our_price, h.stop_price, sh.name AS shop, h.decision
+            FROM price_history_sku s
+            JOIN price_history h ON h.sku_id = s.id
+                AND h.ts = (SELECT MAX(ts) FROM price_history WHERE sku_id = s.id)
+            LEFT JOIN price_history_shop sh ON sh.id = h.shop_id
+            WHERE s.business_id = ?
+        """, (str(business_id),))
+
+    def history(self, business_id, sku: str, start: Optional[int] = None, end: Optional[int] = None) -> pd.DataFrame:
+        """
+        Изменения товара за период [start, end] в unix-миллисекундах, включая
+        состояние, действовавшее на момент start
+        """
+        start = start or 0
+        end = end or 2 ** 62
+        return self._query("""
+            SELECT h.ts, h.competitor_price, h.our_price, h.stop_price, sh.name AS shop, h.decision
+            FROM price_history_sku s
+            JOIN price_history h ON h.sku_id = s.id
+            LEFT JOIN price_history_shop sh ON sh.id = h.shop_id
+            WHERE s.business_id = ? AND s.sku = ? AND h.ts <= ?
+                AND h.ts >= COALESCE((SELECT MAX(ts) FROM price_history WHERE sku_id = s.id AND ts <= ?), ?)
+            ORDER BY h.ts
+        """, (str(business_id), str(sku), end, start, start))
+
+
+price_history = PriceHistoryStore()
+
+
+async def save_price_history(business_id, df: pd.DataFrame, column_names: Dict[str, str], decisions: pd.Series) -> None:
+    """Сохраняет состояние цикла в истории цен, не блокируя цикл событий"""
+    try:
+        started = time.perf_counter()
+        count = await asyncio.to_thread(price_history.record_cycle, business_id, df, column_names, decisions)
+        logger.info("Сохранена история цен", business_id=str(business_id), rows=len(df), changed=count,
+                    seconds=round(time.perf_counter() - started, 3))
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении истории цен: {str(e)}")
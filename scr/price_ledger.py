@@ -0,0 +1,166 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from scr.config import SQLITE_DB_NAME, PRICE_LEDGER_TTL_SECONDS
+from scr.logger import logger
+from scr.pricing import price_windows, strategy_groups
+from scr.update_data_ym import DECISION_ALREADY_SENT, format_money, revert_price_changes
+
+LEDGER_COLUMNS = ['price', 'discount_base', 'updated_at']
+
+
+class PriceLedger:
+    """
+    Журнал последних цен, принятых API Яндекс.Маркета, по business_id и offerId.
+
+    Нужен, чтобы не отправлять цену повторно, пока отчет еще не отразил
+    уже принятое изменение: если последняя принятая цена попадает в окно
+    допустимых цен при текущей цене конкурента и стоп-цене, товар пропускается.
+    """
+
+    def __init__(self, db_name: str = SQLITE_DB_NAME, ttl_seconds: int = PRICE_LEDGER_TTL_SECONDS):
+        self.db_name = db_name
+        self.ttl_seconds = ttl_seconds
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = threading.Lock()
+        # Записи журнала по business_id, индекс - offerId
+        self.entries: Dict[str, pd.DataFrame] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            conn = sqlite3.connect(self.db_name, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS price_ledger (
+                    business_id TEXT NOT NULL,
+                    offer_id TEXT NOT NULL,
+                    price REAL NOT NULL,
+                    discount_base REAL,
+                    updated_at INTEGER NOT NULL,
+                    PRIMARY KEY (business_id, offer_id)
+                ) WITHOUT ROWID
+            """)
+            self.conn = conn
+        return self.conn
+
+    def _load(self, business_id: str) -> pd.DataFrame:
+        if business_id not in self.entries:
+            self.entries[business_id] = pd.read_sql_query(
+                "SELECT offer_id, price, discount_base, updated_at FROM price_ledger WHERE business_id = ?",
+                self._connect(), params=(business_id,), index_col='offer_id')
+        return self.entries[business_id]
+
+    def record(self, business_id, offer_ids: List[str], prices: np.ndarray, discount_bases: np.ndarray,
+               ts: Optional[int] = None) -> None:
+        """Сохраняет цены, принятые API"""
+        if not len(offer_ids):
+            return
+        ts = int(ts if ts is not None else time.time())
+        business_id = str(business_id)
+        rows = pd.DataFrame({'price': np.asarray(prices, dtype=float),
+                             'discount_base': np.asarray(discount_bases, dtype=float),
+                             'updated_at': ts},
+                            index=pd.Index([str(offer_id) for offer_id in offer_ids], name='offer_id'))
+        rows = rows[~rows.index.duplicated(keep='last')]
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO price_ledger VALUES (?, ?, ?, ?, ?)",
+                    zip([business_id] * len(rows), rows.index.tolist(), rows['price'].tolist(),
+                        rows['discount_base'].astype(object).where(rows['discount_base'].notna(), None).tolist(),
+                        [ts] * len(rows))
+                )
+            entries = self._load(business_id)
+            kept = entries[~entries.index.isin(rows.index)]
+            self.entries[business_id] = pd.concat([kept, rows]) if not kept.empty else rows
+
+    def last_prices(self, business_id, offer_ids: pd.Series, now: Optional[int] = None) -> np.ndarray:
+        """
+        Последние принятые цены товаров, NaN - если записи нет или она устарела.
+
+        :param offer_ids: offerId товаров
+        :param now: Текущее время в unix-секундах
+        """
+        now = int(now if now is not None else time.time())
+        with self.lock:
+            entries = self._load(str(business_id))
+        positions = entries.index.get_indexer(offer_ids.astype(str))
+        found = positions >= 0
+        prices = np.full(len(offer_ids), np.nan)
+        prices[found] = entries['price'].to_numpy(dtype=float)[positions[found]]
+        updated_at = np.zeros(len(offer_ids), dtype=np.int64)
+        updated_at[found] = entries['updated_at'].to_numpy(dtype=np.int64)[positions[found]]
+        prices[now - updated_at > self.ttl_seconds] = np.nan
+        return prices
+
+
+price_ledger = PriceLedger()
+
+
+def still_valid(last_price: np.ndarray, mp_on_market: np.ndarray, stop: np.ndarray,
+                configs: Optional[List[dict]] = None, groups: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Проверяет, попадает ли последняя принятая цена в окно стратегии товара
+    (по умолчанию [max(mp_on_market - 200, stop), mp_on_market - 50]), из которого
+    выбирается новая цена. Границы окна отбрасывают дробную часть, как при выборе цены.
+    Сравнения с NaN ложны, поэтому товары без записи в журнале не проходят проверку.
+    """
+    low, high, _, _ = price_windows(mp_on_market, last_price, stop, configs, groups)
+    return (last_price >= np.trunc(low)) & (last_price <= np.trunc(high))
+
+
+async def skip_already_sent(business_id, updated_df: pd.DataFrame, for_update_df: pd.DataFrame,
+                            decisions: pd.Series, column_names: Dict[str, str]) -> pd.DataFrame:
+    """
+    Убирает из for_update товары, последняя принятая цена которых еще актуальна.
+
+    Для пропущенных товаров в updated_df возвращается последняя принятая цена
+    и пояснение в колонке примечаний, решение меняется на DECISION_ALREADY_SENT.
+
+    :return: Отфильтрованный DataFrame для обновления
+    """
+    if for_update_df.empty:
+        return for_update_df
+    try:
+        last_price = await asyncio.to_thread(price_ledger.last_prices, business_id,
+                                             for_update_df[column_names['seller_id']])
+        mp_on_market = for_update_df[column_names['mp_on_market']].to_numpy(dtype=float, na_value=np.nan)
+        stop = for_update_df[column_names['stop']].to_numpy(dtype=float, na_value=np.nan)
+        configs, groups = strategy_groups(for_update_df[column_names['seller_id']], business_id)
+        valid = still_valid(last_price, mp_on_market, stop, configs, groups)
+        if not valid.any():
+            return for_update_df
+
+        messages = ("Цена не отправлена. Последняя принятая цена " + format_money(last_price[valid])
+                    + " еще актуальна (mp_on_market: " + format_money(mp_on_market[valid])
+                    + ", stop: " + format_money(stop[valid]) + ")")
+        for_update_df = revert_price_changes(updated_df, for_update_df, ~valid, last_price[valid], messages,
+                                             column_names, decisions, DECISION_ALREADY_SENT)
+        logger.info("Пропущены товары с актуальной последней принятой ценой",
+                    business_id=str(business_id), skipped=int(valid.sum()), remaining=len(for_update_df))
+        return for_update_df
+    except Exception as e:
+        logger.error(f"Ошибка при проверке журнала отправленных цен: {str(e)}")
+        return for_update_df
+
+
+async def record_accepted(business_id, for_update_df: pd.DataFrame, accepted: List[str],
+                          offer_id_col: str, new_price_col: str, discount_base_col: str) -> None:
+    """Сохраняет в журнал цены товаров, принятые API"""
+    if not accepted:
+        return
+    try:
+        rows = for_update_df[for_update_df[offer_id_col].astype(str).isin(set(accepted))]
+        await asyncio.to_thread(price_ledger.record, business_id, rows[offer_id_col].astype(str).tolist(),
+                                rows[new_price_col].to_numpy(dtype=float, na_value=np.nan),
+                                rows[discount_base_col].to_numpy(dtype=float, na_value=np.nan))
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении журнала отправленных цен: {str(e)}")
@@ -0,0 +1,126 @@
+"""
+Стратегии расчета новой цены.
+
+Стратегия - векторная функция над массивами (mp_on_market, old_price, stop)
+с параметрами из конфигурации, возвращающая окно (low, high), из которого
+выбирается новая цена. Окно ограничивается снизу стоп-ценой; если окно
+пустое, цена не меняется (DECISION_NO_ROOM). Товары, у которых минимальная
+цена принадлежит своему магазину, не переоцениваются ни одной стратегией.
+
+Конфигурация стратегии - словарь {'strategy': имя, **параметры}, можно
+добавить 'discount_base': (min, max) - множители цены для discount_base.
+Стратегия строки выбирается по первой подходящей группе артикулов
+PRICING_SKU_GROUP_STRATEGIES, затем по магазину PRICING_SHOP_STRATEGIES,
+иначе PRICING_DEFAULT_STRATEGY. Каждая стратегия вызывается один раз на все
+свои строки.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from scr.config import (
+    PRICING_DEFAULT_STRATEGY, PRICING_DISCOUNT_BASE_RANGE, PRICING_SHOP_STRATEGIES, PRICING_SKU_GROUP_STRATEGIES
+)
+
+STRATEGIES: Dict[str, Callable[..., Tuple[np.ndarray, np.ndarray]]] = {}
+
+
+def register_strategy(name: str):
+    """Регистрирует стратегию под именем, которое указывается в конфигурации"""
+    def decorator(func):
+        STRATEGIES[name] = func
+        return func
+    return decorator
+
+
+@register_strategy('fixed_step')
+def fixed_step(mp_on_market: np.ndarray, old_price: np.ndarray, stop: np.ndarray,
+               min_step: float = 50, max_step: float = 200) -> Tuple[np.ndarray, np.ndarray]:
+    """Ниже минимальной цены на рынке на min_step..max_step рублей"""
+    return mp_on_market - max_step, mp_on_market - min_step
+
+
+@register_strategy('percent')
+def percent(mp_on_market: np.ndarray, old_price: np.ndarray, stop: np.ndarray,
+            min_percent: float = 1.0, max_percent: float = 3.0) -> Tuple[np.ndarray, np.ndarray]:
+    """Ниже минимальной цены на рынке на min_percent..max_percent процентов"""
+    return mp_on_market * (1 - max_percent / 100), mp_on_market * (1 - min_percent / 100)
+
+
+@register_strategy('match')
+def match(mp_on_market: np.ndarray, old_price: np.ndarray, stop: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Цена равна минимальной цене на рынке"""
+    return mp_on_market, mp_on_market
+
+
+@register_strategy('ladder_to_stop')
+def ladder_to_stop(mp_on_market: np.ndarray, old_price: np.ndarray, stop: np.ndarray,
+                   step: float = 50) -> Tuple[np.ndarray, np.ndarray]:
+    """Ниже минимальной цены на рынке на step рублей, а если так нельзя - по стоп-цене"""
+    price = np.maximum(mp_on_market - step, stop)
+    return price, price
+
+
+def strategy_params(config: dict) -> Tuple[Callable, dict, Tuple[float, float]]:
+    """Разбирает конфигурацию стратегии на функцию, ее параметры и множители discount_base"""
+    params = dict(config)
+    name = params.pop('strategy')
+    discount_base = params.pop('discount_base', PRICING_DISCOUNT_BASE_RANGE)
+    if name not in STRATEGIES:
+        raise ValueError(f"Неизвестная стратегия цены: {name}")
+    return STRATEGIES[name], params, discount_base
+
+
+def sku_prefix_mask(skus: pd.Series, prefix: str) -> np.ndarray:
+    """Строки, артикул которых начинается с prefix; для категорий проверяются только категории"""
+    if isinstance(skus.dtype, pd.CategoricalDtype):
+        matches = skus.cat.categories.astype(str).str.startswith(prefix)
+        codes = skus.cat.codes.to_numpy()
+        return np.append(np.asarray(matches, dtype=bool), False)[codes]
+    return skus.astype(str).str.startswith(prefix).to_numpy(dtype=bool)
+
+
+def strategy_groups(skus: pd.Series, business_id=None) -> Tuple[List[dict], np.ndarray]:
+    """
+    Выбирает стратегию для каждой строки.
+
+    :param skus: Артикулы товаров
+    :param business_id: Магазин; None - стратегия по умолчанию
+    :return: Список конфигураций стратегий и номер конфигурации каждой строки
+    """
+    configs = [PRICING_SHOP_STRATEGIES.get(str(business_id), PRICING_DEFAULT_STRATEGY)]
+    groups = np.zeros(len(skus), dtype=np.intp)
+    assigned = np.zeros(len(skus), dtype=bool)
+    for prefix, config in PRICING_SKU_GROUP_STRATEGIES:
+        rows = sku_prefix_mask(skus, prefix) & ~assigned
+        if rows.any():
+            configs.append(config)
+            groups[rows] = len(configs) - 1
+            assigned |= rows
+    return configs, groups
+
+
+def price_windows(mp_on_market: np.ndarray, old_price: np.ndarray, stop: np.ndarray,
+                  configs: Optional[List[dict]] = None,
+                  groups: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Рассчитывает окна новой цены по стратегиям строк.
+
+    :param configs: Конфигурации стратегий; None - PRICING_DEFAULT_STRATEGY для всех строк
+    :param groups: Номер конфигурации каждой строки
+    :return: Нижние и верхние границы окна (нижняя не ниже stop) и множители discount_base
+    """
+    if configs is None:
+        configs, groups = [PRICING_DEFAULT_STRATEGY], np.zeros(len(mp_on_market), dtype=np.intp)
+
+    low, high = np.full(len(mp_on_market), np.nan), np.full(len(mp_on_market), np.nan)
+    discount_min, discount_max = np.full(len(mp_on_market), np.nan), np.full(len(mp_on_market), np.nan)
+    for i, config in enumerate(configs):
+        rows = groups == i
+        if not rows.any():
+            continue
+        strategy, params, discount_base = strategy_params(config)
+        low[rows], high[rows] = strategy(mp_on_market[rows], old_price[rows], stop[rows], **params)
+        discount_min[rows], discount_max[rows] = discount_base
+    return np.maximum(low, stop), high, discount_min, discount_max
@@ -0,0 +1,204 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import aiohttp
+
+from scr.config import YM_RATE_LIMITS, YM_MAX_RETRIES, YM_RETRY_BASE_DELAY, YM_RETRY_MAX_DELAY
+from scr.logger import logger
+from scr.metrics import metrics
+
+# 420 - собственный код троттлинга Яндекс.Маркета, 429 - стандартный
+THROTTLE_STATUSES = {420, 429}
+RETRY_STATUSES = THROTTLE_STATUSES | {500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Корзина токенов: rate единиц в секунду, не больше capacity за раз"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        tokens = min(tokens, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def block(self, seconds: float) -> None:
+        """Приостанавливает выдачу токенов, например по заголовку Retry-After"""
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self._refill(now)
+        self.tokens = 0.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбирает Retry-After: число секунд или HTTP-дату"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+async def read_text(response: aiohttp.ClientResponse) -> str:
+    return await response.text()
+
+
+class RateLimiter:
+    """
+    Общий ограничитель запросов к Partner API.
+
+    Для каждой пары (группа методов, business_id) заводится своя корзина токенов
+    и семафор на число одновременных запросов. Ответы 420/429 и 5xx повторяются
+    с учетом Retry-After и экспоненциальной задержкой со случайным разбросом.
+
+    Блокировки и семафоры asyncio привязываются к циклу событий, поэтому при
+    смене цикла (например, новый asyncio.run) они создаются заново; остаток
+    токенов и паузы по Retry-After сохраняются, так как квота общая на сервере.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, Tuple[float, float, int]],
+        max_retries: int = YM_MAX_RETRIES,
+        base_delay: float = YM_RETRY_BASE_DELAY,
+        max_delay: float = YM_RETRY_MAX_DELAY
+    ):
+        self.limits = limits
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self.semaphores: Dict[Tuple[str, str], asyncio.Semaphore] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is self.loop:
+            return
+        if self.loop is not None:
+            for bucket in self.buckets.values():
+                bucket.lock = asyncio.Lock()
+            self.semaphores.clear()
+        self.loop = loop
+
+    def _bucket(self, group: str, key: Any) -> TokenBucket:
+        bucket_key = (group, str(key))
+        if bucket_key not in self.buckets:
+            rate, capacity, _ = self.limits[group]
+            self.buckets[bucket_key] = TokenBucket(rate, capacity)
+        return self.buckets[bucket_key]
+
+    def _semaphore(self, group: str, key: Any) -> asyncio.Semaphore:
+        semaphore_key = (group, str(key))
+        if semaphore_key not in self.semaphores:
+            self.semaphores[semaphore_key] = asyncio.Semaphore(self.limits[group][2])
+        return self.semaphores[semaphore_key]
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def request(
+        self,
+        session: aiohttp.ClientSession,
+        method: str,
+        url: str,
+        group: str,
+        key: Any,
+        tokens: float = 1.0,
+        reader: Callable[[aiohttp.ClientResponse], Awaitable[Any]] = read_text,
+        **kwargs
+    ) -> Tuple[int, Any]:
+        """
+        Выполняет запрос с учетом лимитов и повторами.
+
+        :param group: Группа методов API из YM_RATE_LIMITS
+        :param key: Ключ квоты, обычно business_id
+        :param tokens: Стоимость запроса в единицах квоты
+        :param reader: Корутина чтения тела успешного ответа
+        :return: Код статуса и тело ответа (reader для 200, текст для остальных)
+        """
+        self._bind_loop()
+        bucket = self._bucket(group, key)
+        semaphore = self._semaphore(group, key)
+
+        attempt = 0
+        while True:
+            await bucket.acquire(tokens)
+            try:
+                async with semaphore:
+                    async with session.request(method, url, **kwargs) as response:
+                        status = response.status
+                        metrics.inc('ym_api_responses_total', group=group, status=status)
+                        if status == 200:
+                            return status, await reader(response)
+                        body = await response.text()
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                metrics.inc('ym_api_responses_total', group=group, status='network_error')
+                if attempt >= self.max_retries:
+                    logger.error(f"Запрос {method} {url} не выполнен после {attempt + 1} попыток: {str(e)}",
+                                 group=group, key=str(key))
+                    raise
+                delay = self.backoff_delay(attempt)
+                logger.warning(f"Сетевая ошибка, повтор через {delay:.1f} с: {str(e)}",
+                               group=group, key=str(key), attempt=attempt + 1)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+
+            if status not in RETRY_STATUSES:
+                return status, body
+
+            if attempt >= self.max_retries:
+                logger.error(f"Запрос {method} {url} отброшен после {attempt + 1} попыток, код {status}",
+                             group=group, key=str(key), response=body)
+                return status, body
+
+            delay = self.backoff_delay(attempt, retry_after)
+            if status in THROTTLE_STATUSES:
+                # Квота исчерпана для всей группы: притормаживаем и остальные запросы
+                bucket.block(delay)
+                logger.warning(f"Превышен лимит запросов (код {status}), повтор через {delay:.1f} с",
+                               group=group, key=str(key), attempt=attempt + 1)
+            else:
+                logger.warning(f"Ошибка сервера (код {status}), повтор через {delay:.1f} с",
+                               group=group, key=str(key), attempt=attempt + 1)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+# Общий ограничитель для всех запросов к Яндекс.Маркету
+ym_limiter = RateLimiter(YM_RATE_LIMITS)
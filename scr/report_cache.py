@@ -0,0 +1,153 @@
+import hashlib
+import os
+import time
+import zipfile
+from typing import Dict, Optional
+
+import pandas as pd
+
+from scr.config import REPORT_CACHE_DIR, REPORT_CACHE_TTL_SECONDS, REPORT_CACHE_MAX_BYTES
+from scr.logger import logger
+
+# Отчеты хранятся только в колоночном формате Feather; без pyarrow кэш выключен
+try:
+    import pyarrow  # noqa: F401
+    CACHE_AVAILABLE = True
+except ImportError:
+    CACHE_AVAILABLE = False
+CACHE_FORMAT = 'feather'
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def report_digest(zip_source) -> str:
+    """
+    Хэш содержимого отчета: sha256 распакованных файлов архива.
+
+    Считается по содержимому, а не по байтам ZIP, потому что архив заново
+    собирается при каждой генерации и отличается хотя бы датами файлов.
+    """
+    digest = hashlib.sha256()
+    with zipfile.ZipFile(zip_source) as zip_file:
+        for filename in sorted(zip_file.namelist()):
+            digest.update(filename.encode('utf-8'))
+            with zip_file.open(filename) as member:
+                for chunk in iter(lambda: member.read(HASH_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """Хэш содержимого DataFrame вместе с названиями колонок"""
+    digest = hashlib.sha256("\x1f".join(map(str, df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class ReportCache:
+    """
+    Дисковый кэш разобранных отчетов по business_id и хэшу содержимого.
+
+    Записи удаляются, если к ним не обращались дольше ttl секунд, а при
+    превышении max_bytes - начиная с самых давних по обращению.
+
+    Формат записей - Feather (pyarrow). Если pyarrow не установлен, кэш не
+    читается и не пишется, об этом один раз выводится предупреждение;
+    определение неизменившегося отчета по хэшу работает и без кэша.
+    """
+
+    def __init__(self, directory: str = REPORT_CACHE_DIR, ttl: float = REPORT_CACHE_TTL_SECONDS,
+                 max_bytes: int = REPORT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.current: Dict[str, str] = {}
+        self.previous: Dict[str, str] = {}
+        self.enabled = CACHE_AVAILABLE
+        self.disabled_warned = False
+
+    def _path(self, business_id, digest: str) -> str:
+        return os.path.join(self.directory, str(business_id), f"{digest}.{CACHE_FORMAT}")
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def warn_disabled(self) -> None:
+        if not self.disabled_warned:
+            self.disabled_warned = True
+            logger.warning("pyarrow не установлен, кэш отчетов в формате Feather отключен")
+
+    def get(self, business_id, digest: str) -> Optional[pd.DataFrame]:
+        if not self.enabled:
+            self.warn_disabled()
+            self.misses += 1
+            return None
+        path = self._path(business_id, digest)
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) <= self.ttl:
+            try:
+                df = pd.read_feather(path)
+                os.utime(path)
+                self.hits += 1
+                return df
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать отчет из кэша: {str(e)}", path=path)
+        self.misses += 1
+        return None
+
+    def put(self, business_id, digest: str, df: pd.DataFrame) -> None:
+        if not self.enabled:
+            self.warn_disabled()
+            return
+        path = self._path(business_id, digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        try:
+            df.reset_index(drop=True).to_feather(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить отчет в кэш: {str(e)}", path=path)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+
+    def evict(self) -> None:
+        if not os.path.isdir(self.directory):
+            return
+        now = time.time()
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                if now - stat.st_mtime > self.ttl:
+                    os.remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def mark_current(self, business_id, digest: str) -> None:
+        """Запоминает хэш последнего полученного отчета"""
+        key = str(business_id)
+        if key in self.current:
+            self.previous[key] = self.current[key]
+        self.current[key] = digest
+
+    def current_digest(self, business_id) -> Optional[str]:
+        return self.current.get(str(business_id))
+
+    def is_unchanged(self, business_id) -> bool:
+        """Совпадает ли последний отчет с предыдущим"""
+        key = str(business_id)
+        return key in self.previous and self.previous[key] == self.current.get(key)
+
+
+report_cache = ReportCache()
@@ -0,0 +1,345 @@
+import heapq
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from scr.config import (
+    SCHEDULER_MIN_INTERVAL_MINUTES, SCHEDULER_MAX_INTERVAL_MINUTES, SCHEDULER_VOLATILITY_ALPHA,
+    SCHEDULER_MAX_SKUS_PER_CYCLE, SCHEDULER_CPU_BUDGET_SECONDS, SCHEDULER_MAX_PRICE_REQUESTS_PER_CYCLE,
+    YM_PRICE_BATCH_SIZE
+)
+from scr.logger import logger
+from scr.metrics import metrics
+from scr.update_data_ym import (
+    DECISION_DEFERRED, compare_prices_and_create_for_update, format_money, revert_price_changes
+)
+
+
+def shop_hashes(shops: pd.Series) -> np.ndarray:
+    """Хэши магазинов строк; 0 - магазин не указан"""
+    if isinstance(shops.dtype, pd.CategoricalDtype):
+        hashes = pd.util.hash_array(np.asarray(shops.cat.categories.astype(str), dtype=object))
+        return np.append(hashes, np.uint64(0))[shops.cat.codes.to_numpy()]
+    values = shops.astype(object)
+    return np.where(values.notna(), pd.util.hash_array(values.astype(str).to_numpy(dtype=object)), np.uint64(0))
+
+
+def values_changed(new: np.ndarray, old: np.ndarray) -> np.ndarray:
+    """Цена изменилась больше чем на полкопейки; два пустых значения равны"""
+    return ~(np.abs(new - old) < 0.005) & ~(np.isnan(new) & np.isnan(old))
+
+
+class SkuState:
+    """Состояние планировщика по товарам одного business_id; позиция товара - номер в sku_index"""
+
+    def __init__(self, initial_rate: float = 0.0):
+        self.initial_rate = initial_rate
+        self.sku_index = pd.Index([], dtype=object)
+        self.last_mp = np.empty(0)
+        self.last_stop = np.empty(0)
+        self.last_price = np.empty(0)
+        self.last_shop = np.empty(0, dtype=np.uint64)
+        self.last_seen = np.empty(0)
+        # Оценка частоты изменения цены конкурента, изменений в час
+        self.rate = np.empty(0)
+        self.next_due = np.empty(0)
+        # Версия записи в очереди: устаревшие записи пропускаются при извлечении
+        self.version = np.empty(0, dtype=np.int64)
+        # Очередь (срок проверки, -частота, версия, позиция)
+        self.heap: List[Tuple[float, float, int, int]] = []
+
+    def positions(self, skus: pd.Series) -> np.ndarray:
+        """Позиции товаров; новые товары добавляются со сроком проверки 'сейчас'"""
+        if isinstance(skus.dtype, pd.CategoricalDtype):
+            categories = skus.cat.categories.astype(str)
+            codes = skus.cat.codes.to_numpy()
+        else:
+            categories, codes = pd.Index(pd.unique(skus.astype(str))), None
+        found = self.sku_index.get_indexer(categories)
+        new = categories[found < 0]
+        if len(new):
+            start = len(self.sku_index)
+            self.sku_index = self.sku_index.append(pd.Index(new, dtype=object))
+            self.last_mp = np.concatenate([self.last_mp, np.full(len(new), np.nan)])
+            self.last_stop = np.concatenate([self.last_stop, np.full(len(new), np.nan)])
+            self.last_price = np.concatenate([self.last_price, np.full(len(new), np.nan)])
+            self.last_shop = np.concatenate([self.last_shop, np.zeros(len(new), dtype=np.uint64)])
+            self.last_seen = np.concatenate([self.last_seen, np.full(len(new), np.nan)])
+            self.rate = np.concatenate([self.rate, np.full(len(new), self.initial_rate)])
+            self.next_due = np.concatenate([self.next_due, np.zeros(len(new))])
+            self.version = np.concatenate([self.version, np.zeros(len(new), dtype=np.int64)])
+            found[found < 0] = np.arange(start, len(self.sku_index))
+            self.push(np.arange(start, len(self.sku_index)))
+        if codes is None:
+            return found[categories.get_indexer(skus.astype(str))]
+        return np.where(codes >= 0, found[np.maximum(codes, 0)], -1)
+
+    def push(self, positions: np.ndarray) -> None:
+        self.version[positions] += 1
+        entries = zip(self.next_due[positions].tolist(), (-self.rate[positions]).tolist(),
+                      self.version[positions].tolist(), positions.tolist())
+        if len(positions) > len(self.heap):
+            self.heap.extend(entries)
+            heapq.heapify(self.heap)
+        else:
+            for entry in entries:
+                heapq.heappush(self.heap, entry)
+        # Устаревших записей слишком много: очередь строится заново
+        if len(self.heap) > 3 * len(self.sku_index) + 1000:
+            self.heap = [entry for entry in self.heap if entry[2] == self.version[entry[3]]]
+            heapq.heapify(self.heap)
+
+
+class RepricingScheduler:
+    """
+    Планировщик переоценки товаров по волатильности цены конкурента.
+
+    По каждому отчету для всех товаров обновляется оценка частоты изменения
+    лучшего предложения конкурента - mp_on_market или магазина с лучшей ценой
+    (скользящее среднее изменений в час). Товар проверяется снова через
+    интервал, за который лучшее предложение в среднем меняется полраза,
+    в пределах [min_interval, max_interval]; новые товары начинают с
+    min_interval. Товары, у которых с прошлого отчета изменились mp_on_market,
+    магазин с лучшей ценой, stop или наша цена (не считая записанной
+    нами самими, см. remember_prices), становятся к проверке сразу. Очередь -
+    куча по сроку проверки, при равных сроках первыми идут более волатильные
+    товары.
+
+    Объем работы цикла ограничен числом товаров, бюджетом времени сравнения
+    (по средней стоимости товара в прошлых циклах) и числом запросов на
+    обновление цен.
+    """
+
+    def __init__(self, min_interval: float = SCHEDULER_MIN_INTERVAL_MINUTES * 60,
+                 max_interval: float = SCHEDULER_MAX_INTERVAL_MINUTES * 60,
+                 alpha: float = SCHEDULER_VOLATILITY_ALPHA,
+                 max_skus: int = SCHEDULER_MAX_SKUS_PER_CYCLE,
+                 cpu_budget: float = SCHEDULER_CPU_BUDGET_SECONDS,
+                 max_price_requests: int = SCHEDULER_MAX_PRICE_REQUESTS_PER_CYCLE):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.alpha = alpha
+        self.max_skus = max_skus
+        self.cpu_budget = cpu_budget
+        self.max_price_requests = max_price_requests
+        self.states: Dict[str, SkuState] = {}
+        # Среднее время сравнения одного товара, секунд
+        self.seconds_per_sku: Optional[float] = None
+
+    def state(self, business_id) -> SkuState:
+        state = self.states.get(str(business_id))
+        if state is None:
+            # Частота, при которой интервал проверки равен min_interval
+            state = self.states[str(business_id)] = SkuState(0.5 * 3600 / self.min_interval)
+        return state
+
+    def intervals(self, rate: np.ndarray) -> np.ndarray:
+        """Интервал до следующей проверки по частоте изменений, секунд"""
+        with np.errstate(divide='ignore'):
+            seconds = 0.5 * 3600 / rate
+        return np.clip(seconds, self.min_interval, self.max_interval)
+
+    def observe(self, business_id, skus: pd.Series, mp_on_market: np.ndarray, stop: np.ndarray,
+                price: Optional[np.ndarray] = None, shops: Optional[pd.Series] = None,
+                now: Optional[float] = None) -> np.ndarray:
+        """
+        Учитывает цены из очередного отчета и таблицы.
+
+        :param price: Наши цены из таблицы; None - не отслеживаются
+        :param shops: Магазины с лучшей ценой; None - не отслеживаются
+        :return: Позиции товаров строк в состоянии планировщика
+        """
+        now = time.time() if now is None else now
+        state = self.state(business_id)
+        positions = state.positions(skus)
+        present = positions >= 0
+        rows, positions_present = np.flatnonzero(present), positions[present]
+        # При повторе артикула в таблице учитывается последняя строка
+        positions_present, last = np.unique(positions_present[::-1], return_index=True)
+        rows = rows[::-1][last]
+
+        mp, new_stop = mp_on_market[rows], stop[rows]
+        seen = ~np.isnan(state.last_seen[positions_present])
+        mp_changed = seen & values_changed(mp, state.last_mp[positions_present])
+        changed = mp_changed | (seen & values_changed(new_stop, state.last_stop[positions_present]))
+        competitor_changed = mp_changed
+        if price is not None:
+            new_price = price[rows]
+            changed |= seen & values_changed(new_price, state.last_price[positions_present])
+            state.last_price[positions_present] = new_price
+        if shops is not None:
+            new_shop = shop_hashes(shops)[rows]
+            # Лучшее предложение перешло к другому магазину, даже если цена та же
+            shop_changed = seen & (new_shop != state.last_shop[positions_present])
+            competitor_changed = competitor_changed | shop_changed
+            changed |= shop_changed
+            state.last_shop[positions_present] = new_shop
+
+        hours = np.maximum(now - np.where(seen, state.last_seen[positions_present], now), 1.0) / 3600
+        rate = state.rate[positions_present]
+        state.rate[positions_present] = np.where(
+            seen, (1 - self.alpha) * rate + self.alpha * competitor_changed / hours, rate)
+        state.last_mp[positions_present] = mp
+        state.last_stop[positions_present] = new_stop
+        state.last_seen[positions_present] = now
+
+        # Товары, вернувшиеся в таблицу, проверяются сразу
+        changed = positions_present[changed | np.isinf(state.next_due[positions_present])]
+        changed = changed[state.next_due[changed] > now]
+        if len(changed):
+            state.next_due[changed] = now
+            state.push(changed)
+        return positions
+
+    def remember_prices(self, business_id, skus: pd.Series, prices: pd.Series) -> None:
+        """
+        Запоминает цены, записанные в таблицу по итогам цикла: в следующем
+        цикле они не считаются изменением нашей цены
+        """
+        state = self.state(business_id)
+        positions = state.positions(skus)
+        present = positions >= 0
+        state.last_price[positions[present]] = prices.to_numpy(dtype=float, na_value=np.nan)[present]
+
+    def sku_limit(self) -> int:
+        """Сколько товаров можно проверить за цикл с учетом бюджета времени"""
+        limit = self.max_skus
+        if self.cpu_budget and self.seconds_per_sku:
+            limit = min(limit, int(self.cpu_budget / self.seconds_per_sku))
+        return max(limit, 1)
+
+    def select_due(self, business_id, positions: np.ndarray, now: Optional[float] = None) -> np.ndarray:
+        """
+        Извлекает из очереди товары со сроком проверки до now, не больше sku_limit(),
+        и назначает им следующий срок.
+
+        :param positions: Позиции товаров строк, которые есть в текущих данных
+        :return: Маска строк, которые нужно проверить в этом цикле
+        """
+        now = time.time() if now is None else now
+        state = self.state(business_id)
+        present = np.zeros(len(state.sku_index), dtype=bool)
+        present[positions[positions >= 0]] = True
+
+        limit = self.sku_limit()
+        selected = []
+        while state.heap and state.heap[0][0] <= now and len(selected) < limit:
+            due, _, version, position = heapq.heappop(state.heap)
+            if version != state.version[position]:
+                continue
+            if not present[position]:
+                # Товара больше нет в таблице; вернется в очередь, если появится снова
+                state.next_due[position] = math.inf
+                continue
+            selected.append(position)
+
+        selected = np.asarray(selected, dtype=np.int64)
+        state.next_due[selected] = now + self.intervals(state.rate[selected])
+        state.push(selected)
+        due_positions = np.zeros(len(state.sku_index), dtype=bool)
+        due_positions[selected] = True
+        return (positions >= 0) & due_positions[np.maximum(positions, 0)]
+
+    def defer(self, business_id, positions: np.ndarray, now: Optional[float] = None) -> None:
+        """Возвращает товары в очередь со сроком 'сейчас': проверка перенесена на следующий цикл"""
+        state = self.state(business_id)
+        positions = np.unique(positions[positions >= 0])
+        state.next_due[positions] = time.time() if now is None else now
+        state.push(positions)
+
+    def record_cost(self, seconds: float, skus: int) -> None:
+        # На малом числе товаров время сравнения - в основном постоянные накладные расходы
+        if skus >= 1000:
+            cost = seconds / skus
+            self.seconds_per_sku = cost if self.seconds_per_sku is None else (
+                (1 - self.alpha) * self.seconds_per_sku + self.alpha * cost)
+
+    def seconds_until_due(self, now: Optional[float] = None, business_id=None) -> Optional[float]:
+        """
+        Секунды до ближайшего срока проверки среди всех магазинов или только business_id;
+        None, если очередь пуста
+        """
+        now = time.time() if now is None else now
+        earliest = None
+        states = self.states.values() if business_id is None else [self.states.get(str(business_id), SkuState())]
+        for state in states:
+            while state.heap and state.heap[0][2] != state.version[state.heap[0][3]]:
+                heapq.heappop(state.heap)
+            if state.heap and (earliest is None or state.heap[0][0] < earliest):
+                earliest = state.heap[0][0]
+        return None if earliest is None else max(earliest - now, 0.0)
+
+
+scheduler = RepricingScheduler()
+
+
+async def compare_due_prices(business_id, merged_df: pd.DataFrame, column_names: Dict[str, str],
+                             my_market: list[str]) -> tuple:
+    """
+    Сравнивает цены только у товаров, срок проверки которых наступил.
+
+    Остальные строки остаются как в таблице (цена и примечание прошлой проверки),
+    их решение - DECISION_DEFERRED.
+
+    :return: Кортеж из обновленного DataFrame, DataFrame для обновления и кодов решений
+    """
+    mp_on_market = merged_df[column_names['mp_on_market']].to_numpy(dtype=float, na_value=np.nan)
+    stop = merged_df[column_names['stop']].to_numpy(dtype=float, na_value=np.nan)
+    price = merged_df[column_names['price']].to_numpy(dtype=float, na_value=np.nan)
+    positions = scheduler.observe(business_id, merged_df[column_names['seller_id']], mp_on_market, stop,
+                                  price, merged_df[column_names['market_with_mp']])
+    due = scheduler.select_due(business_id, positions)
+
+    started = time.perf_counter()
+    due_df, for_update_df, due_decisions = await compare_prices_and_create_for_update(
+        merged_df[due], column_names, my_market, with_decisions=True, business_id=business_id)
+    scheduler.record_cost(time.perf_counter() - started, int(due.sum()))
+
+    updated_df = merged_df.copy(deep=False)
+    for column in (column_names['price'], column_names['prim']):
+        values = updated_df[column].copy()
+        values.loc[due_df.index] = due_df[column]
+        updated_df[column] = values
+    decisions = pd.Series(DECISION_DEFERRED, index=updated_df.index, dtype=np.int8)
+    decisions.loc[due_decisions.index] = due_decisions
+
+    logger.info("Проверка товаров по расписанию", business_id=str(business_id),
+                due=int(due.sum()), deferred=int((~due).sum()), sku_limit=scheduler.sku_limit())
+    metrics.set('ym_scheduler_due_skus', int(due.sum()))
+    metrics.set('ym_scheduler_deferred_skus', int((~due).sum()))
+    return updated_df, for_update_df, decisions
+
+
+def limit_price_pushes(business_id, merged_df: pd.DataFrame, updated_df: pd.DataFrame,
+                       for_update_df: pd.DataFrame, decisions: pd.Series,
+                       column_names: Dict[str, str]) -> pd.DataFrame:
+    """
+    Оставляет к отправке не больше товаров, чем помещается в бюджет запросов цикла.
+    Первыми отправляются самые волатильные товары, остальные возвращаются в очередь.
+
+    :param merged_df: Данные до сравнения: из них берутся прежние цены отложенных товаров
+    :return: DataFrame для обновления в пределах бюджета
+    """
+    budget = scheduler.max_price_requests * YM_PRICE_BATCH_SIZE
+    if not scheduler.max_price_requests or len(for_update_df) <= budget:
+        return for_update_df
+
+    state = scheduler.state(business_id)
+    positions = state.positions(for_update_df[column_names['seller_id']])
+    order = np.argsort(-state.rate[np.maximum(positions, 0)], kind='stable')
+    keep_mask = np.zeros(len(for_update_df), dtype=bool)
+    keep_mask[order[:budget]] = True
+
+    deferred = for_update_df.index[~keep_mask]
+    old_prices = merged_df.loc[deferred, column_names['price']].to_numpy(dtype=float, na_value=np.nan)
+    new_prices = for_update_df.loc[deferred, column_names['price']].to_numpy(dtype=float, na_value=np.nan)
+    messages = ("Изменение цены на " + format_money(new_prices)
+                + " отложено до следующего цикла: исчерпан лимит запросов на обновление цен")
+    scheduler.defer(business_id, positions[~keep_mask])
+    logger.warning(f"Лимит запросов на обновление цен за цикл исчерпан, отложено товаров: {len(deferred)}",
+                   business_id=str(business_id), budget=budget)
+    return revert_price_changes(updated_df, for_update_df, keep_mask, old_prices, messages, column_names,
+                                decisions, DECISION_DEFERRED)
@@ -0,0 +1,78 @@
+"""
+Схема колонок листа магазина и отчета Яндекс.Маркета.
+
+Тип задается для логических колонок из column_names: артикулы и названия
+магазинов хранятся как category, цены - как Float32 с NA для пустых
+значений. Лист и отчет приводятся к схеме один раз при чтении, дальше
+сравнение и запись работают с компактными колонками без повторных
+pd.to_numeric и astype(str).
+"""
+from typing import Dict, Optional
+
+import pandas as pd
+
+# Колонки листа и отчета Яндекс.Маркета по логическим именам
+YM_COLUMN_NAMES = {
+    'seller_id': 'SHOP_SKU',
+    'name': 'OFFER',
+    'link': 'LINK',
+    'price': 'MERCH_PRICE_WITH_PROMOS',
+    'stop': 'STOP',
+    'mp_on_market': 'PRICE.1',
+    'market_with_mp': 'SHOP_WITH_BEST_PRICE_ON_MARKET',
+    'prim': 'PRIM'
+}
+
+CATEGORY = 'category'
+PRICE = 'Float32'
+
+# Тип логической колонки; остальные колонки остаются строками
+COLUMN_DTYPES = {
+    'seller_id': CATEGORY,
+    'market_with_mp': CATEGORY,
+    'price': PRICE,
+    'stop': PRICE,
+    'mp_on_market': PRICE,
+}
+
+
+def schema_dtypes(column_names: Dict[str, str] = YM_COLUMN_NAMES) -> Dict[str, str]:
+    """Тип по фактическому имени колонки"""
+    return {column_names[key]: dtype for key, dtype in COLUMN_DTYPES.items() if key in column_names}
+
+
+def to_dtype(values, dtype: str, index: Optional[pd.Index] = None) -> pd.Series:
+    """
+    Приводит значения к типу схемы. Строки цен разбираются как pd.to_numeric
+    с errors='coerce', колонка нужного типа возвращается без копирования.
+    """
+    if not isinstance(values, pd.Series):
+        values = pd.Series(values, index=index)
+    if values.dtype == dtype:
+        return values
+    if dtype == PRICE:
+        if values.dtype == object:
+            values = pd.to_numeric(values, errors='coerce')
+        return values.astype(PRICE)
+    if dtype == CATEGORY:
+        # factorize без сортировки категорий заметно быстрее astype('category') на уникальных артикулах
+        codes, categories = pd.factorize(values)
+        return pd.Series(pd.Categorical.from_codes(codes, categories), index=values.index, name=values.name)
+    return values.astype(dtype)
+
+
+def apply_schema(df: pd.DataFrame, column_names: Dict[str, str] = YM_COLUMN_NAMES) -> pd.DataFrame:
+    """Приводит колонки DataFrame, описанные в схеме, к их типам; DataFrame изменяется на месте"""
+    for column, dtype in schema_dtypes(column_names).items():
+        if column in df.columns and df[column].dtype != dtype:
+            df[column] = to_dtype(df[column], dtype)
+    return df
+
+
+def fill_missing(values: pd.Series, fallback: pd.Series) -> pd.Series:
+    """Заполняет пропуски значениями fallback; категории двух колонок объединяются"""
+    if isinstance(values.dtype, pd.CategoricalDtype) and isinstance(fallback.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories.union(fallback.cat.categories)
+        values = values.cat.set_categories(categories)
+        fallback = fallback.cat.set_categories(categories)
+    return values.fillna(fallback)
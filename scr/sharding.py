@@ -0,0 +1,228 @@
+"""
+Сравнение цен большого каталога по частям в пуле процессов.
+
+Строки делятся на REPRICING_SHARDS частей по хэшу артикула. Числовые колонки
+и артикулы частей передаются процессам через общую память
+(multiprocessing.shared_memory): цены - массивами float64, магазины - кодами
+категорий, артикулы - одной строкой UTF-8 на часть с разделителем '\\0'.
+Процессы пишут цены, discount_base и коды решений в общий выходной блок,
+а примечания возвращают той же упакованной строкой.
+
+Части собираются в исходном порядке строк. Случайные цены каждой части
+берутся из своего генератора SeedSequence.spawn, поэтому при одном seed
+результат не зависит от числа процессов и порядка их завершения.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from scr.config import REPRICING_PROCESSES, REPRICING_SHARDS
+from scr.logger import logger
+from scr.schema import PRICE, apply_schema, to_dtype
+from scr.update_data_ym import DECISION_BELOW_STOP, DECISION_REPRICED, compare_prices
+
+SEPARATOR = '\0'
+
+# Колонки блоков общей памяти: на входе процессов и на выходе
+INPUT_FIELDS = (('price', np.float64), ('mp_on_market', np.float64), ('stop', np.float64), ('shop', np.int32))
+OUTPUT_FIELDS = (('price', np.float64), ('discount_base', np.float64), ('decision', np.int8))
+
+process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def fields_size(fields, n: int) -> int:
+    return sum(np.dtype(dtype).itemsize * n for _, dtype in fields)
+
+
+def field_views(buffer, fields, n: int) -> Dict[str, np.ndarray]:
+    """Массивы колонок поверх буфера общей памяти, колонки идут подряд"""
+    views, offset = {}, 0
+    for name, dtype in fields:
+        views[name] = np.ndarray(n, dtype=dtype, buffer=buffer, offset=offset)
+        offset += np.dtype(dtype).itemsize * n
+    return views
+
+
+def init_worker() -> None:
+    # Сводку по частям пишет родительский процесс
+    logging.disable(logging.CRITICAL)
+
+
+def get_process_pool() -> Tuple[ProcessPoolExecutor, int]:
+    """Пул процессов создается при первом использовании; spawn - чтобы не копировать потоки приложения"""
+    global process_pool
+    processes = REPRICING_PROCESSES or min(os.cpu_count() or 1, REPRICING_SHARDS)
+    if process_pool is None:
+        process_pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=init_worker)
+        atexit.register(process_pool.shutdown, cancel_futures=True)
+    return process_pool, processes
+
+
+def reset_process_pool() -> None:
+    """Останавливает пул; следующий вызов get_process_pool создаст новый"""
+    global process_pool
+    if process_pool is not None:
+        process_pool.shutdown(wait=False, cancel_futures=True)
+        process_pool = None
+
+
+def shard_ids(skus: pd.Series, shards: int) -> np.ndarray:
+    """Номер части по хэшу артикула; хэш считается один раз на категорию"""
+    categories = np.asarray(skus.cat.categories.astype(str), dtype=object)
+    category_shards = (pd.util.hash_array(categories) % np.uint64(shards)).astype(np.int64)
+    codes = skus.cat.codes.to_numpy()
+    return np.where(codes >= 0, category_shards[np.maximum(codes, 0)], 0)
+
+
+def compare_shard(input_name: str, output_name: str, n: int, start: int, end: int, text_start: int,
+                  text_end: int, shops: List[str], column_names: Dict[str, str], my_market: List[str],
+                  seed: np.random.SeedSequence, business_id=None) -> bytes:
+    """
+    Сравнивает цены строк [start, end) в процессе пула.
+
+    :return: Примечания строк части, UTF-8 с разделителем SEPARATOR
+    """
+    input_memory = shared_memory.SharedMemory(name=input_name)
+    output_memory = shared_memory.SharedMemory(name=output_name)
+    try:
+        inputs = field_views(input_memory.buf, INPUT_FIELDS, n)
+        outputs = field_views(output_memory.buf, OUTPUT_FIELDS, n)
+        skus = bytes(input_memory.buf[text_start:text_end]).decode('utf-8').split(SEPARATOR)
+        df = pd.DataFrame({
+            column_names['seller_id']: skus,
+            column_names['price']: inputs['price'][start:end],
+            column_names['mp_on_market']: inputs['mp_on_market'][start:end],
+            column_names['stop']: inputs['stop'][start:end],
+            column_names['market_with_mp']: pd.Categorical.from_codes(inputs['shop'][start:end], shops),
+        })
+        updated_df, for_update, decisions = compare_prices(apply_schema(df, column_names), column_names, my_market,
+                                                           np.random.default_rng(seed), business_id)
+
+        outputs['price'][start:end] = updated_df[column_names['price']].to_numpy(dtype=float, na_value=np.nan)
+        outputs['decision'][start:end] = decisions.to_numpy()
+        outputs['discount_base'][start:end] = np.nan
+        outputs['discount_base'][start + for_update.index.to_numpy()] = for_update['discount_base'].to_numpy()
+        return SEPARATOR.join(updated_df[column_names['prim']].tolist()).encode('utf-8')
+    finally:
+        # Массивы поверх буферов должны быть освобождены до закрытия общей памяти
+        inputs = outputs = None
+        input_memory.close()
+        output_memory.close()
+
+
+def compare_prices_sharded(df: pd.DataFrame, column_names: Dict[str, str], my_market: list[str],
+                           rng: Optional[np.random.Generator] = None, business_id=None,
+                           shards: int = REPRICING_SHARDS) -> tuple:
+    """
+    Сравнивает цены по частям в пуле процессов; результат в том же виде, что у compare_prices.
+
+    Если процесс пула завершился аварийно (BrokenProcessPool), пул создается
+    заново и сравнение повторяется один раз с тем же seed; при повторном сбое
+    цены сравниваются в текущем процессе.
+
+    :param rng: Генератор, из которого берется seed частей; при фиксированном seed решения воспроизводимы
+    :return: Кортеж из обновленного DataFrame, DataFrame для обновления и кодов решений DECISION_*
+    """
+    # spawn меняет состояние SeedSequence, поэтому каждая попытка строит ее заново из entropy
+    entropy = np.random.SeedSequence().entropy if rng is None else int(rng.integers(2 ** 63))
+    for attempt in range(2):
+        try:
+            return compare_shards(df, column_names, my_market, entropy, business_id, shards)
+        except BrokenProcessPool as e:
+            reset_process_pool()
+            logger.warning(f"Пул процессов сравнения цен сломан, пул пересоздан: {str(e)}", attempt=attempt + 1)
+    logger.error("Пул процессов сравнения цен недоступен, цены сравниваются в текущем процессе")
+    return compare_prices(df, column_names, my_market, np.random.default_rng(entropy), business_id)
+
+
+def compare_shards(df: pd.DataFrame, column_names: Dict[str, str], my_market: list[str],
+                   entropy: int, business_id=None, shards: int = REPRICING_SHARDS) -> tuple:
+    """Одна попытка сравнения по частям в пуле процессов; seed частей - SeedSequence(entropy).spawn"""
+    seller_id = column_names['seller_id']
+    price_col = column_names['price']
+    prim_col = column_names['prim']
+
+    updated_df = apply_schema(df.copy(), column_names)
+    n = len(updated_df)
+    skus = updated_df[seller_id]
+    shops = updated_df[column_names['market_with_mp']]
+
+    # Строки упорядочиваются по частям: каждая часть - непрерывный отрезок [bounds[i], bounds[i + 1])
+    shard = shard_ids(skus, shards)
+    order = np.argsort(shard, kind='stable')
+    bounds = np.searchsorted(shard[order], np.arange(shards + 1))
+    sku_codes = skus.cat.codes.to_numpy()[order]
+    sku_text = np.append(np.asarray(skus.cat.categories.astype(str), dtype=object), 'nan')[sku_codes]
+    texts = [SEPARATOR.join(sku_text[bounds[i]:bounds[i + 1]]).encode('utf-8') for i in range(shards)]
+    text_offsets = np.concatenate([[0], np.cumsum([len(text) for text in texts])]) + fields_size(INPUT_FIELDS, n)
+
+    pool, processes = get_process_pool()
+
+    input_memory = shared_memory.SharedMemory(create=True, size=max(int(text_offsets[-1]), 1))
+    output_memory = shared_memory.SharedMemory(create=True, size=max(fields_size(OUTPUT_FIELDS, n), 1))
+    try:
+        inputs = field_views(input_memory.buf, INPUT_FIELDS, n)
+        inputs['price'][:] = updated_df[price_col].to_numpy(dtype=float, na_value=np.nan)[order]
+        inputs['mp_on_market'][:] = updated_df[column_names['mp_on_market']].to_numpy(
+            dtype=float, na_value=np.nan)[order]
+        inputs['stop'][:] = updated_df[column_names['stop']].to_numpy(dtype=float, na_value=np.nan)[order]
+        inputs['shop'][:] = shops.cat.codes.to_numpy()[order]
+        for i, text in enumerate(texts):
+            input_memory.buf[text_offsets[i]:text_offsets[i + 1]] = text
+
+        shard_seeds = np.random.SeedSequence(entropy).spawn(shards)
+        futures = [
+            pool.submit(compare_shard, input_memory.name, output_memory.name, n, int(bounds[i]), int(bounds[i + 1]),
+                        int(text_offsets[i]), int(text_offsets[i + 1]), shops.cat.categories.tolist(),
+                        column_names, my_market, shard_seeds[i], business_id)
+            for i in range(shards) if bounds[i] < bounds[i + 1]
+        ]
+        # Результаты собираются в порядке частей, а не завершения процессов
+        prim_texts = [future.result() for future in futures]
+
+        outputs = field_views(output_memory.buf, OUTPUT_FIELDS, n)
+        new_price, discount_base, decisions = np.empty(n), np.empty(n), np.empty(n, dtype=np.int8)
+        new_price[order] = outputs['price']
+        discount_base[order] = outputs['discount_base']
+        decisions[order] = outputs['decision']
+    finally:
+        inputs = outputs = None
+        input_memory.close()
+        input_memory.unlink()
+        output_memory.close()
+        output_memory.unlink()
+
+    prim = np.empty(n, dtype=object)
+    non_empty = [i for i in range(shards) if bounds[i] < bounds[i + 1]]
+    for i, text in zip(non_empty, prim_texts):
+        prim[order[bounds[i]:bounds[i + 1]]] = text.decode('utf-8').split(SEPARATOR)
+
+    updated_df[price_col] = to_dtype(new_price, PRICE, updated_df.index)
+    updated_df[prim_col] = prim
+    decisions = pd.Series(decisions, index=updated_df.index)
+    price_changed = (decisions == DECISION_REPRICED).to_numpy()
+    for_update = updated_df[price_changed].copy()
+    for_update['discount_base'] = discount_base[price_changed]
+    updated_df = updated_df.drop('discount_base', axis=1, errors='ignore')
+
+    # Логи процессов отключены, предупреждения по каталогу пишутся здесь
+    nan_mask = updated_df[[price_col, column_names['mp_on_market'], column_names['stop']]].isna().any(axis=1)
+    if nan_mask.any():
+        logger.warning(f"Обнаружены NaN значения в {nan_mask.sum()} строках")
+        logger.warning(updated_df[nan_mask].head(20).to_string(), sample_key="nan_rows_dump")
+    below_stop = (decisions == DECISION_BELOW_STOP).to_numpy()
+    if below_stop.any():
+        logger.warning(f"Оптимальная цена mp_on_market ниже или равна минимальной stop для {below_stop.sum()} товаров",
+                       skus=skus[below_stop].astype(str).head(20).tolist())
+    logger.info("Цены сравнены по частям в пуле процессов", rows=n, shards=len(futures), processes=processes,
+                repriced=int(price_changed.sum()))
+    return updated_df, for_update, decisions
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import google_auth_httplib2
+import httplib2
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build
+
+from .auth import get_credentials, save_credentials
+from .config import SHEETS_MAX_WORKERS, SHEETS_TOKEN_REFRESH_MARGIN
+from .logger import logger
+
+
+class SheetsClient:
+    """
+    Общий для процесса клиент Google Sheets API.
+
+    Учетные данные загружаются один раз и обновляются заранее, за
+    SHEETS_TOKEN_REFRESH_MARGIN секунд до истечения. Сервис собирается один раз
+    из встроенного в googleapiclient документа discovery, без сетевого запроса.
+    Все блокирующие вызовы выполняются в отдельном ограниченном пуле потоков;
+    у каждого потока свой httplib2.Http, так как он не потокобезопасен.
+    """
+
+    def __init__(self, max_workers: int = SHEETS_MAX_WORKERS,
+                 refresh_margin: float = SHEETS_TOKEN_REFRESH_MARGIN):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sheets")
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self.creds = None
+        self.service = None
+        self._init_lock = asyncio.Lock()
+        self._refresh_lock = threading.Lock()
+        self._local = threading.local()
+
+    async def get_service(self):
+        if self.service is None:
+            async with self._init_lock:
+                if self.service is None:
+                    self.creds = await get_credentials()
+                    self.service = await asyncio.get_running_loop().run_in_executor(self.executor, self._build)
+                    logger.info("Клиент Google Sheets инициализирован")
+        return self.service
+
+    def _build(self):
+        return build("sheets", "v4", credentials=self.creds, static_discovery=True, cache_discovery=False)
+
+    def _ensure_fresh(self) -> None:
+        expiry = self.creds.expiry
+        # expiry в google-auth хранится как UTC без часового пояса
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        if self.creds.valid and (expiry is None or expiry - now > self.refresh_margin):
+            return
+        with self._refresh_lock:
+            expiry = self.creds.expiry
+            if self.creds.valid and (expiry is None or expiry - now > self.refresh_margin):
+                return
+            logger.info("Заблаговременное обновление учетных данных Google")
+            self.creds.refresh(Request())
+            save_credentials(self.creds)
+
+    def _http(self):
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http())
+            self._local.http = http
+        return http
+
+    def _execute(self, request):
+        self._ensure_fresh()
+        return request.execute(http=self._http())
+
+    async def execute(self, request):
+        """Выполняет запрос googleapiclient в пуле потоков клиента"""
+        await self.get_service()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._execute, request)
+
+
+# Общий клиент Google Sheets
+sheets_client = SheetsClient()
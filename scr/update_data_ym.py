@@ -1,11 +1,14 @@
 import pandas as pd
 import numpy as np
 import logging
-import random
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-from typing import Dict
+from typing import Dict, List, Optional
+from scr.config import REPRICING_EXECUTOR, REPRICING_PROCESS_MIN_ROWS
 from scr.logger import logger
+from scr.metrics import metrics
+from scr.pricing import price_windows, strategy_groups
+from scr.schema import PRICE, apply_schema, fill_missing, to_dtype
 
 # Настройка логирования
 logger = logger
@@ -19,6 +22,51 @@ async def run_in_executor(func, *args):
     return await loop.run_in_executor(executor, func, *args)
 
 
+def join_report_prices(sheet_df: pd.DataFrame, report_df: pd.DataFrame,
+                       column_names: Dict[str, str]) -> tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Переносит mp_on_market и market_with_mp из отчета в строки таблицы по артикулу.
+
+    Для каждого кода артикула таблицы заранее строится позиция строки отчета,
+    значения берутся take по этим позициям. Остальные колонки таблицы не
+    копируются. Пустые значения отчета и артикулы, которых нет в отчете,
+    оставляют значение из таблицы. При повторе артикула в отчете берется
+    последняя строка.
+
+    :return: Обновленный DataFrame и счетчики сопоставления артикулов
+    """
+    seller_id = column_names['seller_id']
+    mp_on_market = column_names['mp_on_market']
+    market_with_mp = column_names['market_with_mp']
+
+    # Данные, прочитанные get_sheet_data и из отчета, уже приведены к схеме: здесь без копирования
+    updated_df = apply_schema(sheet_df.copy(deep=False), column_names)
+    report = apply_schema(report_df[[seller_id, mp_on_market, market_with_mp]].copy(deep=False), column_names)
+
+    sheet_skus = updated_df[seller_id].cat
+    # Коды артикулов отчета в категориях таблицы; -1 - артикула нет в таблице
+    report_codes = report[seller_id].cat.set_categories(sheet_skus.categories).cat.codes.to_numpy()
+    known = report_codes >= 0
+    row_by_code = np.full(len(sheet_skus.categories), -1, dtype=np.int64)
+    row_by_code[report_codes[known]] = np.flatnonzero(known)
+
+    sheet_codes = sheet_skus.codes.to_numpy()
+    positions = np.where(sheet_codes >= 0, row_by_code[sheet_codes], -1)
+
+    for column in (mp_on_market, market_with_mp):
+        taken = pd.Series(report[column].array.take(positions, allow_fill=True), index=updated_df.index)
+        updated_df[column] = fill_missing(taken, updated_df[column])
+
+    matched = int((positions >= 0).sum())
+    stats = {
+        'matched': matched,
+        'unmatched': len(updated_df) - matched,
+        'report_only': int((~known).sum()),
+        'report_duplicates': int(known.sum() - np.count_nonzero(row_by_code >= 0)),
+    }
+    return updated_df, stats
+
+
 async def update_dataframe(df1: pd.DataFrame, df2: pd.DataFrame, column_names: Dict[str, str]) -> pd.DataFrame:
     """
     Асинхронно обновляет первый DataFrame данными из второго DataFrame на основе seller_id.
@@ -28,137 +76,248 @@ async def update_dataframe(df1: pd.DataFrame, df2: pd.DataFrame, column_names: D
     :param column_names: Словарь с названиями колонок
     :return: Обновленный DataFrame
     """
-
-    def update_df():
-        df1_updated = df1.copy()
-        df2_updated = df2.copy()
-
-        seller_id = column_names['seller_id']
-        mp_on_market = column_names['mp_on_market']
-        market_with_mp = column_names['market_with_mp']
-
-        df1_updated[seller_id] = df1_updated[seller_id].astype(str)
-        df2_updated[seller_id] = df2_updated[seller_id].astype(str)
-
-        merged_df = df1_updated.merge(df2_updated[[seller_id, mp_on_market, market_with_mp]],
-                                      on=seller_id,
-                                      how='left',
-                                      suffixes=('', '_new'))
-
-        merged_df[mp_on_market] = merged_df[f'{mp_on_market}_new'].fillna(merged_df[mp_on_market])
-        merged_df[market_with_mp] = merged_df[f'{market_with_mp}_new'].fillna(merged_df[market_with_mp])
-
-        merged_df = merged_df.drop([f'{mp_on_market}_new', f'{market_with_mp}_new'], axis=1)
-
-        original_type = df1[seller_id].dtype
-        merged_df[seller_id] = merged_df[seller_id].astype(original_type)
-
-        return merged_df
-
-    return await run_in_executor(update_df)
-
-
-async def compare_prices_and_create_for_update(df: pd.DataFrame, column_names: Dict[str, str], my_market: list[str]) -> tuple[pd.DataFrame, pd.DataFrame]:
+    updated_df, stats = await run_in_executor(join_report_prices, df1, df2, column_names)
+    logger.info("Сопоставление артикулов таблицы и отчета", **stats)
+    metrics.set('ym_skus_matched', stats['matched'])
+    metrics.set('ym_skus_unmatched', stats['unmatched'])
+    if stats['report_duplicates']:
+        logger.warning(f"В отчете повторяются артикулы: {stats['report_duplicates']} строк, "
+                       f"использована последняя строка каждого артикула")
+    return updated_df
+
+
+# Коды решений по цене товара
+DECISION_NOT_EVALUATED = 0
+DECISION_OWN_SHOP = 1
+DECISION_NO_ROOM = 2
+DECISION_REPRICED = 3
+DECISION_BELOW_STOP = 4
+DECISION_EMPTY_STOP = 5
+DECISION_ALREADY_SENT = 6
+DECISION_DEFERRED = 7
+
+
+def calculate_new_prices(old_price: np.ndarray, mp_on_market: np.ndarray, stop: np.ndarray,
+                         own_shop: np.ndarray, rng: np.random.Generator,
+                         configs: Optional[List[dict]] = None,
+                         groups: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Векторно рассчитывает новые цены для строк, где цена выше минимальной на рынке.
+
+    Окно новой цены задает стратегия строки (scr.pricing), по умолчанию
+    [max(mp_on_market - 200, stop), mp_on_market - 50]. Новая цена выбирается
+    случайно из окна, новая discount_base - случайно из [цена * 1.3, цена * 1.6]
+    или из множителей стратегии.
+
+    :param old_price: Текущие цены
+    :param mp_on_market: Минимальные цены на рынке
+    :param stop: Минимально допустимые цены
+    :param own_shop: Признак того, что минимальная цена у одного из ваших магазинов
+    :param rng: Генератор случайных чисел
+    :param configs: Конфигурации стратегий; None - PRICING_DEFAULT_STRATEGY
+    :param groups: Номер конфигурации стратегии каждой строки
+    :return: Новые цены, новые discount_base (NaN без изменения цены) и коды решений
+    """
+    min_new_price, max_new_price, discount_min, discount_max = price_windows(
+        mp_on_market, old_price, stop, configs, groups)
+
+    decision = np.where(own_shop, DECISION_OWN_SHOP,
+                        np.where(min_new_price > max_new_price, DECISION_NO_ROOM, DECISION_REPRICED))
+    repriced = decision == DECISION_REPRICED
+
+    new_price = old_price.astype(float)
+    new_discount_base = np.full(len(old_price), np.nan)
+    if repriced.any():
+        drawn = rng.integers(np.trunc(min_new_price[repriced]).astype(np.int64),
+                             np.trunc(max_new_price[repriced]).astype(np.int64),
+                             endpoint=True)
+        drawn = np.maximum(drawn, np.trunc(stop[repriced]).astype(np.int64))
+        new_price[repriced] = drawn
+        new_discount_base[repriced] = np.round(rng.uniform(drawn * discount_min[repriced],
+                                                           drawn * discount_max[repriced]), 0)
+
+    return new_price, new_discount_base, decision
+
+
+# Дробная часть для форматирования цен: '.00' ... '.99'
+CENTS = np.array(['.%02d' % i for i in range(100)], dtype=object)
+
+
+def format_money(values) -> np.ndarray:
+    """Векторно форматирует числа с двумя знаками после запятой, как '{:.2f}'"""
+    values = np.asarray(values, dtype=float)
+    result = np.full(len(values), 'nan', dtype=object)
+    finite = np.isfinite(values)
+    scaled = np.abs(values[finite]) * 100
+    cents = np.rint(scaled).astype(np.int64)
+    text = (cents // 100).astype(str).astype(object) + CENTS[cents % 100]
+    negative = values[finite] < 0
+    text[negative] = '-' + text[negative]
+    # Значения на границе округления форматируем так же, как '%.2f'
+    halfway = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    text[halfway] = ['%.2f' % value for value in values[finite][halfway]]
+    result[finite] = text
+    return result
+
+
+async def compare_prices_and_create_for_update(df: pd.DataFrame, column_names: Dict[str, str], my_market: list[str],
+                                               rng: Optional[np.random.Generator] = None,
+                                               with_decisions: bool = False, business_id=None) -> tuple:
     """
     Асинхронно сравнивает цены и создает DataFrame для обновления.
 
+    При REPRICING_EXECUTOR = 'process' большие каталоги сравниваются по частям
+    в пуле процессов (scr.sharding), иначе - в текущем потоке.
+
     :param df: Исходный DataFrame
     :param column_names: Словарь с названиями колонок
     :param my_market: Список названий ваших магазинов
+    :param rng: Генератор случайных чисел; при фиксированном seed решения воспроизводимы
+    :param with_decisions: Вернуть третьим элементом коды решений DECISION_* по строкам
+    :param business_id: Магазин, по которому выбирается стратегия цены (scr.pricing)
     :return: Кортеж из обновленного DataFrame и DataFrame для обновления
     """
     try:
-        updated_df = df.copy()
-        updated_df[column_names['prim']] = ''
-
-        numeric_columns = [column_names['price'], column_names['mp_on_market'], column_names['stop']]
-        for col in numeric_columns:
-            updated_df[col] = pd.to_numeric(updated_df[col], errors='coerce')
-
-        # Проверка на пустые значения в колонке'stop'
-        empty_stop_mask = updated_df[column_names['stop']].isna()
-        updated_df.loc[empty_stop_mask, column_names['prim']] = "Пустое значение в колонке 'stop'"
-
-        nan_mask = updated_df[numeric_columns].isna().any(axis=1)
-        if nan_mask.any():
-            logger.warning(f"Обнаружены NaN значения в {nan_mask.sum()} строках")
-            logger.warning(updated_df[nan_mask].to_string())
-
-        mask = (updated_df[column_names['price']] > updated_df[column_names['mp_on_market']]) & \
-               (updated_df[column_names['mp_on_market']] > updated_df[column_names['stop']]) & \
-               (~empty_stop_mask)# Исключаем строки с пустым 'stop'
-
-        async def calculate_new_price(row):
-            try:
-                old_price = row[column_names['price']]
-                mp_on_market = row[column_names['mp_on_market']]
-                stop = row[column_names['stop']]
-                shop_with_best_price = row[column_names['market_with_mp']]
-
-                # Проверяем, является ли магазин с лучшей ценой одним из наших
-                if shop_with_best_price in my_market:
-                    return old_price, f"Цена не изменена. У одного из ваших магазинов ({shop_with_best_price}) уже минимальная цена на рынке.", None
-
-                min_new_price = max(mp_on_market - 200, stop)
-                max_new_price = mp_on_market - 50
-
-                if min_new_price > max_new_price:
-                    return old_price, f"Цена не изменена. Текущая цена: {old_price:.2f}, mp_on_market: {mp_on_market:.2f}, stop: {stop:.2f}", None
-
-                new_price = max(random.randint(int(min_new_price), int(max_new_price)), int(stop))
-
-                # Расчет новой discount_base только если цена изменилась
-                new_discount_base = round(random.uniform(new_price * 1.3, new_price * 1.6), 0)
-
-                return new_price, f"Цена изменена с {old_price:.2f} на {new_price:.2f}. Новая discount_base: {new_discount_base:.2f} (mp_on_market: {mp_on_market:.2f})", new_discount_base
-            except Exception as e:
-                logger.error(f"Ошибка при расчете новой цены для товара {row[column_names['seller_id']]}: {str(e)}")
-                return row[column_names['price']], f"Ошибка при расчете новой цены: {str(e)}", None
-
-        results = await asyncio.gather(*[calculate_new_price(row) for _, row in updated_df[mask].iterrows()])
-
-        price_changed = pd.Series(False, index=updated_df.index)
-
-        if results:
-            new_prices, new_prims, new_discount_bases = zip(*results)
-            price_changed[mask] = [new_price != old_price for new_price, old_price in
-                                   zip(new_prices, updated_df.loc[mask, column_names['price']])]
-
-            updated_df.loc[mask, column_names['price']] = new_prices
-            updated_df.loc[mask, column_names['prim']] = new_prims
-
-            # Обновляем discount_base только для товаров с измененной ценой
-            discount_base_mask = mask & price_changed
-            updated_df.loc[discount_base_mask, 'discount_base'] = [db for db, changed in
-                                                                   zip(new_discount_bases, price_changed[mask]) if changed and db is not None]
+        if REPRICING_EXECUTOR == 'process' and len(df) >= REPRICING_PROCESS_MIN_ROWS:
+            # scr.sharding сам импортирует этот модуль, поэтому импорт здесь
+            from scr.sharding import compare_prices_sharded
+            updated_df, for_update, decisions = await run_in_executor(
+                compare_prices_sharded, df, column_names, my_market, rng, business_id)
         else:
-            logger.info("Нет строк для обновления цен")
-
-        for index, row in updated_df.iterrows():
-            if not pd.isna(row[column_names['mp_on_market']]) and not pd.isna(row[column_names['stop']]):
-                if row[column_names['mp_on_market']] <= row[column_names['stop']]:
-                    warning_msg = f"Оптимальная цена mp_on_market ({row[column_names['mp_on_market']]:.2f}) ниже или равна минимальной stop ({row[column_names['stop']]:.2f}) для товара с артикулом {row[column_names['seller_id']]}"
-                    logger.warning(warning_msg)
-                    updated_df.loc[index, column_names['prim']] = warning_msg
-
-        # Создаем for_update только для товаров с измененными ценами
-        for_update = updated_df[price_changed].copy()
-        try:
-            updated_df = updated_df.drop('discount_base',axis=1)
-        except :
-            logger.warning("Колонка 'discount_base' отсутствует в DataFrame updated_df")
-        # Убедимся, что колонка 'discount_base' присутствует в for_update
-        if 'discount_base' not in for_update.columns:
-            logger.warning("Колонка 'discount_base' отсутствует в DataFrame for_update")
-            # Если колонки нет, добавим ее с пустыми значениями
-            # for_update['discount_base'] = pd.NA
-
-        return updated_df, for_update
-
+            updated_df, for_update, decisions = compare_prices(df, column_names, my_market, rng, business_id)
     except Exception as e:
         logger.error(f"Критическая ошибка при обработке данных: {str(e)}")
         raise
 
+    if with_decisions:
+        return updated_df, for_update, decisions
+    return updated_df, for_update
+
+
+def compare_prices(df: pd.DataFrame, column_names: Dict[str, str], my_market: list[str],
+                   rng: Optional[np.random.Generator] = None, business_id=None) -> tuple:
+    """
+    Сравнивает цены и создает DataFrame для обновления в текущем потоке.
+
+    :return: Кортеж из обновленного DataFrame, DataFrame для обновления и кодов решений DECISION_*
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    price_col = column_names['price']
+    mp_col = column_names['mp_on_market']
+    stop_col = column_names['stop']
+    prim_col = column_names['prim']
+
+    updated_df = apply_schema(df.copy(), column_names)
+    prim = np.full(len(updated_df), '', dtype=object)
+
+    numeric_columns = [price_col, mp_col, stop_col]
+
+    old_price = updated_df[price_col].to_numpy(dtype=float, na_value=np.nan)
+    mp_on_market = updated_df[mp_col].to_numpy(dtype=float, na_value=np.nan)
+    stop = updated_df[stop_col].to_numpy(dtype=float, na_value=np.nan)
+    shop_with_best_price = updated_df[column_names['market_with_mp']]
+
+    # Проверка на пустые значения в колонке'stop'
+    empty_stop_mask = np.isnan(stop)
+    prim[empty_stop_mask] = "Пустое значение в колонке 'stop'"
+    decisions = np.full(len(updated_df), DECISION_NOT_EVALUATED, dtype=np.int8)
+    decisions[empty_stop_mask] = DECISION_EMPTY_STOP
+
+    nan_mask = updated_df[numeric_columns].isna().any(axis=1)
+    if nan_mask.any():
+        logger.warning(f"Обнаружены NaN значения в {nan_mask.sum()} строках")
+        # Полный дамп больших каталогов слишком дорог, выводим только первые строки
+        logger.warning(updated_df[nan_mask].head(20).to_string(), sample_key="nan_rows_dump")
+
+    # Сравнения с NaN ложны, поэтому строки с пустым 'stop' сюда не попадают
+    mask = (old_price > mp_on_market) & (mp_on_market > stop)
+    price_changed = np.zeros(len(updated_df), dtype=bool)
+    discount_base = np.full(len(updated_df), np.nan)
+
+    if mask.any():
+        own_shop = shop_with_best_price.isin(my_market).to_numpy()[mask]
+        configs, groups = strategy_groups(updated_df[column_names['seller_id']][mask], business_id)
+        new_price, new_discount_base, decision = calculate_new_prices(
+            old_price[mask], mp_on_market[mask], stop[mask], own_shop, rng, configs, groups)
+
+        # Сообщения формируются только для строк со своим решением
+        messages = np.empty(len(decision), dtype=object)
+        shops = shop_with_best_price[mask].astype(str).to_numpy(dtype=object)
+        masked_old_price, masked_mp, masked_stop = old_price[mask], mp_on_market[mask], stop[mask]
+
+        rows = decision == DECISION_OWN_SHOP
+        messages[rows] = ("Цена не изменена. У одного из ваших магазинов (" + shops[rows]
+                          + ") уже минимальная цена на рынке.")
+        rows = decision == DECISION_NO_ROOM
+        messages[rows] = ("Цена не изменена. Текущая цена: " + format_money(masked_old_price[rows])
+                          + ", mp_on_market: " + format_money(masked_mp[rows])
+                          + ", stop: " + format_money(masked_stop[rows]))
+        rows = decision == DECISION_REPRICED
+        messages[rows] = ("Цена изменена с " + format_money(masked_old_price[rows])
+                          + " на " + format_money(new_price[rows])
+                          + ". Новая discount_base: " + format_money(new_discount_base[rows])
+                          + " (mp_on_market: " + format_money(masked_mp[rows]) + ")")
+        prim[mask] = messages
+
+        changed = (decision == DECISION_REPRICED) & (new_price != old_price[mask])
+        price_changed[mask] = changed
+        # Попытка переоценки без изменения цены считается отсутствием окна для цены
+        decisions[mask] = np.where((decision == DECISION_REPRICED) & ~changed, DECISION_NO_ROOM, decision)
+        discount_base[np.flatnonzero(mask)[changed]] = new_discount_base[changed]
+
+        new_prices = old_price.copy()
+        new_prices[mask] = new_price
+        updated_df[price_col] = to_dtype(new_prices, PRICE, updated_df.index)
+    else:
+        logger.info("Нет строк для обновления цен")
+
+    below_stop_mask = ~np.isnan(mp_on_market) & ~empty_stop_mask & (mp_on_market <= stop)
+    if below_stop_mask.any():
+        decisions[below_stop_mask] = DECISION_BELOW_STOP
+        skus = updated_df[column_names['seller_id']][below_stop_mask].astype(str)
+        prim[below_stop_mask] = (
+            "Оптимальная цена mp_on_market (" + format_money(mp_on_market[below_stop_mask])
+            + ") ниже или равна минимальной stop (" + format_money(stop[below_stop_mask])
+            + ") для товара с артикулом " + skus.to_numpy(dtype=object)
+        )
+        logger.warning(f"Оптимальная цена mp_on_market ниже или равна минимальной stop для {below_stop_mask.sum()} товаров",
+                       skus=skus.head(20).tolist())
+
+    updated_df[prim_col] = prim
+
+    # Создаем for_update только для товаров с измененными ценами
+    for_update = updated_df[price_changed].copy()
+    for_update['discount_base'] = discount_base[price_changed]
+    updated_df = updated_df.drop('discount_base', axis=1, errors='ignore')
+
+    return updated_df, for_update, pd.Series(decisions, index=updated_df.index)
+
+
+def revert_price_changes(updated_df: pd.DataFrame, for_update_df: pd.DataFrame, keep_mask: np.ndarray,
+                         prices: np.ndarray, messages: np.ndarray, column_names: Dict[str, str],
+                         decisions: Optional[pd.Series] = None,
+                         decision: int = DECISION_NO_ROOM) -> pd.DataFrame:
+    """
+    Отменяет изменение цены для части строк for_update.
+
+    :param updated_df: Обновленный DataFrame, изменяется на месте
+    :param for_update_df: DataFrame для обновления, индексы совпадают с updated_df
+    :param keep_mask: Строки for_update, которые остаются к отправке
+    :param prices: Цены, записываемые в updated_df для отмененных строк
+    :param messages: Примечания для отмененных строк
+    :param decisions: Коды решений по строкам updated_df, изменяются на месте
+    :param decision: Код решения для отмененных строк
+    :return: DataFrame для обновления без отмененных строк
+    """
+    reverted = for_update_df.index[~keep_mask]
+    updated_df.loc[reverted, column_names['price']] = prices
+    updated_df.loc[reverted, column_names['prim']] = messages
+    if decisions is not None:
+        decisions.loc[reverted] = decision
+    return for_update_df[keep_mask]
+
 
 # async def main():
 #     # Определение названий колонок
@@ -1,10 +1,101 @@
-
 from scr.logger import logger
+from scr.config import (
+    YM_MAX_OFFERS_PER_REQUEST, YM_PRICE_BATCH_SIZE, YM_API_BASE_URL, Tech_PC_Components_YM, B_id_Tech_PC_Components_YM
+)
+from scr.rate_limiter import ym_limiter
+from scr.ym_client import use_session
 import asyncio
 import aiohttp
 import pandas as pd
 import json
-from typing import Dict, Any
+import re
+import time
+from typing import Dict, Any, List, Optional
+
+# Индекс товара в сообщении об ошибке, например "offers[3].price.value"
+OFFER_INDEX_PATTERN = re.compile(r"offers\[(\d+)\]")
+
+
+def build_offers(
+    df: pd.DataFrame,
+    offer_id_col: str,
+    new_price_col: str,
+    discount_base_col: str
+) -> List[Dict[str, Any]]:
+    """
+    Формирует список товаров для тела запроса offer-prices/updates.
+
+    :param df: DataFrame с товарами для обновления
+    :param offer_id_col: Колонка с идентификатором товара
+    :param new_price_col: Колонка с новой ценой
+    :param discount_base_col: Колонка с ценой до скидки
+    :return: Список словарей в формате API
+    """
+    offers = []
+    for offer_id, new_price, discount_base in zip(df[offer_id_col].tolist(),
+                                                  df[new_price_col].tolist(),
+                                                  df[discount_base_col].tolist()):
+        try:
+            discount_base = int(discount_base)
+        except (TypeError, ValueError):
+            logger.warning(f"Недопустимое значение базы скидки для товара {offer_id}: {discount_base}, "
+                           f"установлено значение по умолчанию 0", sample_key="invalid_discount_base")
+            discount_base = 0
+
+        offers.append({
+            "offerId": offer_id,
+            "price": {
+                "value": new_price,
+                "currencyId": "RUR",
+                "discountBase": discount_base
+            }
+        })
+    return offers
+
+
+def split_into_batches(offers: List[Dict[str, Any]], batch_size: int) -> List[List[Dict[str, Any]]]:
+    """Делит список товаров на пачки размером не больше лимита API"""
+    batch_size = max(1, min(int(batch_size), YM_MAX_OFFERS_PER_REQUEST))
+    return [offers[i:i + batch_size] for i in range(0, len(offers), batch_size)]
+
+
+def map_offer_errors(response_data: Dict[str, Any], offer_ids: List[str]) -> Dict[str, str]:
+    """
+    Сопоставляет ошибки из ответа API с offerId товаров пачки.
+
+    Ошибка относится к товару, если в ней есть поле offerId или индекс
+    вида offers[N] в сообщении. Остальные ошибки считаются ошибками всей пачки.
+
+    :param response_data: Разобранный JSON ответа
+    :param offer_ids: offerId товаров в порядке отправки
+    :return: Словарь offerId -> сообщение об ошибке
+    """
+    offer_errors: Dict[str, str] = {}
+    batch_errors: List[str] = []
+
+    errors = list(response_data.get('errors') or [])
+    if response_data.get('success') == 0:
+        errors.append(response_data.get('error') or {})
+
+    for error in errors:
+        message = error.get('message') or error.get('code') or 'Неизвестная ошибка'
+        offer_id = error.get('offerId')
+        if offer_id is None:
+            match = OFFER_INDEX_PATTERN.search(message)
+            if match and int(match.group(1)) < len(offer_ids):
+                offer_id = offer_ids[int(match.group(1))]
+        if offer_id is not None:
+            offer_errors[str(offer_id)] = message
+        else:
+            batch_errors.append(message)
+
+    if batch_errors:
+        message = "; ".join(batch_errors)
+        for offer_id in offer_ids:
+            offer_errors.setdefault(str(offer_id), message)
+
+    return offer_errors
+
 
 async def update_price_ym(
     df: pd.DataFrame,
@@ -13,88 +104,143 @@ async def update_price_ym(
     offer_id_col: str,
     new_price_col: str,
     discount_base_col: str,
-    debug: bool = False
-) -> None:
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for _, row in df.iterrows():
-            offer_id = row[offer_id_col]
-            new_price = row[new_price_col]
-            discount_base = row[discount_base_col]
-
-            try:
-                discount_base = int(discount_base)
-            except ValueError:
-                logger.warning(f"Недопустимое значение базы скидки для товара {offer_id}: {discount_base}")
-                discount_base = 0
-                logger.warning(f"Установлено значение по умолчанию для базы скидки товара {offer_id}: {discount_base}")
-
-            data = {
-                "offers": [
-                    {
-                        "offerId": offer_id,
-                        "price": {
-                            "value": new_price,
-                            "currencyId": "RUR",
-                            "discountBase": discount_base
-                        }
-                    }
-                ]
-            }
+    debug: bool = False,
+    batch_size: int = YM_PRICE_BATCH_SIZE,
+    session: Optional[aiohttp.ClientSession] = None
+) -> Dict[str, Any]:
+    """
+    Отправляет новые цены в Яндекс.Маркет пачками по batch_size товаров.
 
-            url = f"https://api.partner.market.yandex.ru/businesses/{campaign_id}/offer-prices/updates"
-            headers = {
-                "Content-Type": "application/json",
-                "Api-Key": access_token
-            }
+    :param session: Общая сессия клиента; если не передана, открывается временная
+    :return: Сводка по отправке: статистика каждой пачки, количество успешных
+             и неуспешных товаров и ошибки по offerId
+    """
+    offers = build_offers(df, offer_id_col, new_price_col, discount_base_col)
+    batches = split_into_batches(offers, batch_size)
+
+    url = f"{YM_API_BASE_URL}/businesses/{campaign_id}/offer-prices/updates"
+    headers = {
+        "Content-Type": "application/json",
+        "Api-Key": access_token
+    }
+
+    summary: Dict[str, Any] = {
+        "offers": len(offers),
+        "succeeded": 0,
+        "failed": 0,
+        "accepted": [],
+        "errors": {},
+        "batches": []
+    }
+
+    if debug:
+        for i, batch in enumerate(batches):
+            logger.info(f"Режим отладки включен. Пачка {i} из {len(batch)} товаров не будет отправлена.")
+            logger.info(json.dumps({"offers": batch}, ensure_ascii=False, indent=2))
+        return summary
+
+    async with use_session(session) as session:
+        tasks = [
+            asyncio.create_task(send_request(session, url, headers, {"offers": batch}, i, campaign_id))
+            for i, batch in enumerate(batches)
+        ]
+        results = await asyncio.gather(*tasks)
 
-            if debug:
-                logger.info(f"Режим отладки включен. Запрос для товара {offer_id} не будет отправлен.")
-                logger.info(f"Данные для отправки для товара {offer_id}:")
-                logger.info(json.dumps(data, ensure_ascii=False, indent=2))
-            else:
-                task = asyncio.create_task(send_request(session, url, headers, data, offer_id))
-                tasks.append(task)
+    for result in results:
+        summary["succeeded"] += result["succeeded"]
+        summary["failed"] += result["failed"]
+        summary["accepted"].extend(result["accepted"])
+        summary["errors"].update(result["errors"])
+        summary["batches"].append({k: v for k, v in result.items() if k not in ("accepted", "errors")})
+
+    logger.info("Обновление цен завершено",
+                offers=summary["offers"],
+                batches=len(batches),
+                succeeded=summary["succeeded"],
+                failed=summary["failed"])
+    return summary
 
-        if not debug:
-            await asyncio.gather(*tasks)
 
 async def send_request(
     session: aiohttp.ClientSession,
     url: str,
     headers: Dict[str, str],
     data: Dict[str, Any],
-    offer_id: str
-) -> None:
+    batch_index: int = 0,
+    business_id: Any = None
+) -> Dict[str, Any]:
+    """
+    Отправляет одну пачку товаров и возвращает её статистику.
+
+    Запрос проходит через общий ограничитель: квота считается в товарах
+    на business_id, троттлинг и ошибки сервера повторяются.
+
+    :return: Словарь с номером пачки, размером, задержкой, кодом ответа,
+             количеством успешных/неуспешных товаров, списком принятых offerId
+             и ошибками по offerId
+    """
+    offer_ids = [str(offer["offerId"]) for offer in data["offers"]]
+    result: Dict[str, Any] = {
+        "batch": batch_index,
+        "size": len(offer_ids),
+        "status": None,
+        "latency": 0.0,
+        "succeeded": 0,
+        "failed": 0,
+        "accepted": [],
+        "errors": {}
+    }
+
+    started = time.perf_counter()
     try:
-        async with session.post(url, headers=headers, json=data) as response:
-            response_text = await response.text()
-            logger.info(f"Полный ответ сервера для товара {offer_id}:")
-            logger.info(response_text)
-
-            if response.status == 200:
-                try:
-                    response_data = json.loads(response_text)
-                    if response_data.get('success') == 0:
-                        error_message = response_data.get('error', {}).get('message', 'Неизвестная ошибка')
-                        logger.error(f"Ошибка при обновлении цены для товара {offer_id}: {error_message}")
-                    else:
-                        logger.info(f"Цена для товара {offer_id} успешно обновлена!")
-                except json.JSONDecodeError as e:
-                    logger.error(f"Ошибка при разборе JSON для товара {offer_id}: {str(e)}")
-            else:
-                logger.error(f"Ошибка при отправке цены в Яндекс.Маркет для товара {offer_id}")
-                logger.info(f"Статус ответа: {response.status}")
-                logger.info(f"Заголовки ответа: {response.headers}")
+        status, response_text = await ym_limiter.request(session, 'POST', url, 'price_updates', business_id,
+                                                         tokens=len(offer_ids), headers=headers, json=data)
+        result["status"] = status
+        logger.debug("Полный ответ сервера для пачки %s: %s", batch_index, response_text)
+
+        try:
+            response_data = json.loads(response_text) if response_text else {}
+            if not isinstance(response_data, dict):
+                response_data = {}
+        except json.JSONDecodeError as e:
+            logger.error(f"Ошибка при разборе JSON для пачки {batch_index}: {str(e)}")
+            response_data = {}
+
+        errors = map_offer_errors(response_data, offer_ids)
+        if status != 200:
+            logger.error(f"Ошибка при отправке цен в Яндекс.Маркет для пачки {batch_index}")
+            logger.info(f"Статус ответа: {status}")
+            # Запрос отклонен целиком: товары без собственной ошибки тоже не приняты
+            for offer_id in offer_ids:
+                errors.setdefault(offer_id, f"Пачка отклонена, HTTP {status}")
     except aiohttp.ClientError as e:
-        logger.error(f"Ошибка сети для товара {offer_id}: {str(e)}")
+        logger.error(f"Ошибка сети для пачки {batch_index}: {str(e)}")
+        errors = {offer_id: f"Ошибка сети: {str(e)}" for offer_id in offer_ids}
     except Exception as e:
-        logger.error(f"Непредвиденная ошибка для товара {offer_id}: {str(e)}")
+        logger.error(f"Непредвиденная ошибка для пачки {batch_index}: {str(e)}")
+        errors = {offer_id: f"Непредвиденная ошибка: {str(e)}" for offer_id in offer_ids}
+
+    result["latency"] = round(time.perf_counter() - started, 3)
+    result["errors"] = errors
+    result["accepted"] = [offer_id for offer_id in offer_ids if offer_id not in errors]
+    result["succeeded"] = len(result["accepted"])
+    result["failed"] = len(offer_ids) - result["succeeded"]
+
+    for offer_id, message in errors.items():
+        logger.error(f"Ошибка при обновлении цены для товара {offer_id}: {message}", sample_key="offer_price_error")
+    logger.info(f"Пачка {batch_index} обработана",
+                size=result["size"],
+                status=result["status"],
+                latency=result["latency"],
+                succeeded=result["succeeded"],
+                failed=result["failed"])
+    return result
 
 # Пример использования
 async def main():
-    access_token = "ACMA:D4a5OExH6Hvtcx8BxgTqv2gfIpc2E7KmTPlekqDE:43a81531"
-    campaign_id = "76443469"
+    # Ключ берется из окружения; для проверки без реального API задайте YM_API_BASE_URL
+    access_token = Tech_PC_Components_YM
+    campaign_id = B_id_Tech_PC_Components_YM
     df = pd.DataFrame({
         "offer_id": ["ST16000NM001G"],
         "new_price": [31500],
@@ -1,15 +1,87 @@
-import aiohttp
 import asyncio
 import json
+import os
+import tempfile
+import time
 import zipfile
-import io
 import pandas as pd
 from datetime import datetime
+from scr.config import (
+    REPORT_POLL_MIN_INTERVAL, REPORT_POLL_MAX_INTERVAL, REPORT_POLL_BACKOFF, REPORT_POLL_TIMEOUT, YM_API_BASE_URL
+)
 from scr.logger import logger
+from scr.metrics import metrics
+from scr.rate_limiter import ym_limiter
+from scr.report_cache import report_cache, report_digest
+from scr.schema import apply_schema
+from scr.ym_client import use_session
+
+# Колонки отчета, которые используются при обработке, и их типы при чтении CSV.
+# Артикулы, магазины и цены из схемы после чтения приводятся к типам scr.schema
+REPORT_COLUMNS = [
+    'SHOP_SKU', 'OFFER', 'MAIN_PRICE', 'MERCH_PRICE_WITH_PROMOS',
+    'PRICE_GREEN_THRESHOLD', 'PRICE_RED_THRESHOLD', 'PRICE_WITH_PROMOS',
+    'SHOP_WITH_BEST_PRICE_ON_MARKET', 'PRICE.1'
+]
+REPORT_DTYPES = {
+    'SHOP_SKU': str,
+    'OFFER': str,
+    'MAIN_PRICE': 'float32',
+    'MERCH_PRICE_WITH_PROMOS': 'float32',
+    'PRICE_GREEN_THRESHOLD': 'float32',
+    'PRICE_RED_THRESHOLD': 'float32',
+    'PRICE_WITH_PROMOS': 'float32',
+    'SHOP_WITH_BEST_PRICE_ON_MARKET': str,
+    'PRICE.1': 'float32',
+}
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # размер блока при скачивании отчета, байт
+CSV_CHUNK_ROWS = 100_000  # строк CSV, читаемых за один раз
+
+
+class ReportGenerationStats:
+    """
+    Статистика фактического времени генерации отчетов по business_id.
+
+    Хранит скользящее среднее отношения фактического времени к
+    estimatedGenerationTime и самого фактического времени, чтобы в следующих
+    циклах точнее предсказывать готовность отчета.
+    """
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.stats = {}
+
+    def predict(self, business_id, estimated_time: float) -> float:
+        entry = self.stats.get(str(business_id))
+        if not entry:
+            return estimated_time
+        if estimated_time > 0:
+            return estimated_time * entry['ratio']
+        return entry['actual']
+
+    def record(self, business_id, estimated_time: float, actual_time: float) -> None:
+        key = str(business_id)
+        ratio = actual_time / estimated_time if estimated_time > 0 else 1.0
+        entry = self.stats.get(key)
+        if entry is None:
+            self.stats[key] = {'count': 1, 'actual': actual_time, 'ratio': ratio,
+                               'last': actual_time, 'max': actual_time}
+        else:
+            entry['count'] += 1
+            entry['actual'] += self.alpha * (actual_time - entry['actual'])
+            entry['ratio'] += self.alpha * (ratio - entry['ratio'])
+            entry['last'] = actual_time
+            entry['max'] = max(entry['max'], actual_time)
+        logger.info(f"Отчет сгенерирован за {actual_time:.1f} секунд (ожидалось {estimated_time:.1f})",
+                    business_id=key, **{k: round(v, 2) for k, v in self.stats[key].items()})
+
+
+report_stats = ReportGenerationStats()
 
 
 async def generate_price_report(session, api_key, business_id):
-    url = "https://api.partner.market.yandex.ru/reports/prices/generate"
+    url = f"{YM_API_BASE_URL}/reports/prices/generate"
     headers = {
         "Api-Key": api_key,
         "Content-Type": "application/json"
@@ -28,22 +100,22 @@ async def generate_price_report(session, api_key, business_id):
     logger.info(f"Отправка запроса на генерацию отчета. URL: {url}")
     logger.debug(f"Заголовки запроса: {headers}")
     logger.debug(f"Параметры запроса: {params}")
-    logger.debug(f"Тело запроса: {json.dumps(data, ensure_ascii=False, indent=2)}")
+    logger.debug("Тело запроса: %s", data)
 
-    async with session.post(url, headers=headers, params=params, json=data) as response:
-        logger.info(f"Получен ответ. Код статуса: {response.status}")
-        response_text = await response.text()
-        logger.debug(f"Тело ответа: {response_text}")
+    status, response_text = await ym_limiter.request(session, 'POST', url, 'reports_generate', business_id,
+                                                     headers=headers, params=params, json=data)
+    logger.info(f"Получен ответ. Код статуса: {status}")
+    logger.debug("Тело ответа: %s", response_text)
 
-        if response.status == 200:
-            return json.loads(response_text)
-        else:
-            logger.error(f"Ошибка при генерации отчета. Код статуса: {response.status}")
-            return None
+    if status == 200:
+        return json.loads(response_text)
+    else:
+        logger.error(f"Ошибка при генерации отчета. Код статуса: {status}")
+        return None
 
 
-async def check_report_status(session, api_key, report_id):
-    url = f"https://api.partner.market.yandex.ru/reports/info/{report_id}"
+async def check_report_status(session, api_key, report_id, business_id=None):
+    url = f"{YM_API_BASE_URL}/reports/info/{report_id}"
     headers = {
         "Api-Key": api_key
     }
@@ -52,19 +124,20 @@ async def check_report_status(session, api_key, report_id):
     logger.debug(f"URL запроса: {url}")
     logger.debug(f"Заголовки запроса: {headers}")
 
-    async with session.get(url, headers=headers) as response:
-        logger.info(f"Получен ответ. Код статуса: {response.status}")
-        response_text = await response.text()
-        logger.debug(f"Тело ответа: {response_text}")
+    status, response_text = await ym_limiter.request(session, 'GET', url, 'reports_info', business_id,
+                                                     headers=headers)
+    logger.info(f"Получен ответ. Код статуса: {status}")
+    logger.debug("Тело ответа: %s", response_text)
 
-        if response.status == 200:
-            return json.loads(response_text)
-        else:
-            logger.error(f"Ошибка при проверке статуса отчета. Код статуса: {response.status}")
-            return None
+    if status == 200:
+        return json.loads(response_text)
+    else:
+        logger.error(f"Ошибка при проверке статуса отчета. Код статуса: {status}")
+        return None
 
 
-async def download_report(session, api_key, file_url):
+async def download_report(session, api_key, file_url, business_id=None):
+    """Скачивает отчет блоками во временный файл и возвращает путь к нему"""
     headers = {
         "Authorization": f"OAuth {api_key}"
     }
@@ -72,38 +145,122 @@ async def download_report(session, api_key, file_url):
     logger.info(f"Начало загрузки отчета. URL файла: {file_url}")
     logger.debug(f"Заголовки запроса: {headers}")
 
-    async with session.get(file_url, headers=headers) as response:
-        logger.info(f"Получен ответ. Код статуса: {response.status}")
-
-        if response.status == 200:
-            content = await response.read()
-            logger.info(f"Отчет успешно загружен. Размер: {len(content)} байт")
-            return content
-        else:
-            logger.error(f"Ошибка при загрузке отчета. Код статуса: {response.status}")
-            return None
-
-
-def process_csv_from_zip(zip_content):
+    fd, report_path = tempfile.mkstemp(prefix=f"ym_report_{business_id}_", suffix=".zip")
+    os.close(fd)
+
+    async def spool_to_file(response):
+        # При повторе запроса файл перезаписывается с начала; запись на диск идет
+        # в потоке, чтобы не останавливать цикл событий для других магазинов
+        size = 0
+        with open(report_path, 'wb') as report_file:
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                await asyncio.to_thread(report_file.write, chunk)
+                size += len(chunk)
+        return size
+
+    try:
+        status, size = await ym_limiter.request(session, 'GET', file_url, 'reports_download', business_id,
+                                                headers=headers, reader=spool_to_file)
+    except Exception:
+        os.remove(report_path)
+        raise
+    logger.info(f"Получен ответ. Код статуса: {status}")
+
+    if status == 200:
+        logger.info(f"Отчет успешно загружен. Размер: {size} байт")
+        return report_path
+    else:
+        logger.error(f"Ошибка при загрузке отчета. Код статуса: {status}")
+        os.remove(report_path)
+        return None
+
+
+def process_csv_from_zip(zip_source):
+    """
+    Читает CSV из ZIP-архива потоково: только колонки REPORT_COLUMNS с заданными
+    типами, блоками по CSV_CHUNK_ROWS строк, сразу отбрасывая строки без PRICE.1.
+    Колонки из схемы приводятся к ее типам после объединения блоков, чтобы
+    категории были общими для всего отчета.
+
+    :param zip_source: Путь к ZIP-файлу или файловый объект
+    :return: DataFrame с колонками REPORT_COLUMNS
+    """
     logger.info("Начало обработки ZIP-архива с CSV-данными")
-    with zipfile.ZipFile(io.BytesIO(zip_content)) as zip_file:
+    with zipfile.ZipFile(zip_source) as zip_file:
         file_list = zip_file.namelist()
         logger.info(f"Файлы в архиве: {', '.join(file_list)}")
 
         for filename in file_list:
             logger.info(f"Обработка файла: {filename}")
             with zip_file.open(filename) as csv_file:
-                df = pd.read_csv(csv_file, encoding='utf-8')
+                chunks = [
+                    chunk.dropna(subset=['PRICE.1'])
+                    for chunk in pd.read_csv(csv_file, encoding='utf-8', usecols=REPORT_COLUMNS,
+                                             dtype=REPORT_DTYPES, chunksize=CSV_CHUNK_ROWS)
+                ]
+                if not chunks:
+                    # В отчете нет строк данных: пустой DataFrame с типами REPORT_DTYPES
+                    chunks = [pd.DataFrame({column: pd.Series(dtype=REPORT_DTYPES[column])
+                                            for column in REPORT_COLUMNS})]
+                df = apply_schema(pd.concat(chunks, ignore_index=True)[REPORT_COLUMNS])
                 logger.info(f"CSV успешно прочитан. Размер DataFrame: {df.shape}")
                 return df
 
 
-async def get_yandex_market_report(api_key, business_id):
+async def wait_for_report(session, api_key, report_id, business_id, estimated_time):
+    """
+    Ждет готовности отчета: сначала спит предсказанное время генерации,
+    затем опрашивает статус с растущим интервалом до REPORT_POLL_TIMEOUT.
+
+    :return: URL файла отчета или None, если отчет не готов или генерация не удалась
+    """
+    started = time.monotonic()
+    deadline = started + REPORT_POLL_TIMEOUT
+    # Первая проверка чуть раньше прогноза: иначе замеренное время никогда не
+    # станет меньше прогноза и оценка будет только расти
+    first_wait = min(0.8 * report_stats.predict(business_id, estimated_time), REPORT_POLL_TIMEOUT)
+    logger.info(f"Первая проверка статуса через {first_wait:.1f} секунд")
+    await asyncio.sleep(first_wait)
+
+    interval = REPORT_POLL_MIN_INTERVAL
+    while True:
+        logger.info("Проверка статуса отчета...")
+        status_info = await check_report_status(session, api_key, report_id, business_id)
+        if not status_info:
+            logger.error("Не удалось получить статус отчета")
+            return None
+
+        status = status_info['result']['status']
+        logger.info(f"Текущий статус: {status}")
+
+        if status == 'DONE':
+            logger.info("Отчет готов")
+            report_stats.record(business_id, estimated_time, time.monotonic() - started)
+            file_url = status_info['result']['file']
+            logger.info(f"URL для скачивания: {file_url}")
+            return file_url
+        elif status in ['FAILED', 'NO_DATA']:
+            logger.error(f"Произошла ошибка при генерации отчета: {status}")
+            if 'subStatus' in status_info['result']:
+                logger.error(f"Дополнительный статус: {status_info['result']['subStatus']}")
+            return None
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.error(f"Отчет не сгенерирован за {REPORT_POLL_TIMEOUT} секунд", report_id=report_id)
+            return None
+        logger.info(f"Отчет все еще генерируется, следующая проверка через {min(interval, remaining):.1f} секунд")
+        await asyncio.sleep(min(interval, remaining))
+        interval = min(interval * REPORT_POLL_BACKOFF, REPORT_POLL_MAX_INTERVAL)
+
+
+async def get_yandex_market_report(api_key, business_id, session=None):
     logger.info("Начало процесса получения отчета с Яндекс.Маркета")
-    async with aiohttp.ClientSession() as session:
+    async with use_session(session) as session:
         # Генерация отчета
         logger.info("Запуск процесса генерации отчета")
-        report_info = await generate_price_report(session, api_key, business_id)
+        with metrics.stage('report_generate'):
+            report_info = await generate_price_report(session, api_key, business_id)
         if not report_info:
             logger.error("Не удалось сгенерировать отчет")
             return None
@@ -115,37 +272,34 @@ async def get_yandex_market_report(api_key, business_id):
         logger.info(f"Ожидаемое время генерации: {estimated_time} секунд")
 
         # Ожидание генерации отчета
-        while True:
-            await asyncio.sleep(10)
-            logger.info("Проверка статуса отчета...")
-            status_info = await check_report_status(session, api_key, report_id)
-            if not status_info:
-                logger.error("Не удалось получить статус отчета")
-                return None
-
-            status = status_info['result']['status']
-            logger.info(f"Текущий статус: {status}")
-
-            if status == 'DONE':
-                logger.info("Отчет готов")
-                file_url = status_info['result']['file']
-                logger.info(f"URL для скачивания: {file_url}")
-                break
-            elif status in ['FAILED', 'NO_DATA']:
-                logger.error(f"Произошла ошибка при генерации отчета: {status}")
-                if 'subStatus' in status_info['result']:
-                    logger.error(f"Дополнительный статус: {status_info['result']['subStatus']}")
-                return None
-            else:
-                logger.info("Отчет все еще генерируется...")
+        with metrics.stage('report_wait'):
+            file_url = await wait_for_report(session, api_key, report_id, business_id, estimated_time)
+        if not file_url:
+            return None
 
         # Скачивание отчета
         logger.warning("Начало скачивания отчета")
-        report_content = await download_report(session, api_key, file_url)
-        if report_content:
+        with metrics.stage('report_download'):
+            report_path = await download_report(session, api_key, file_url, business_id)
+        if report_path:
             # Обработка CSV-данных из ZIP-архива
             logger.info("Обработка загруженного отчета")
-            return process_csv_from_zip(report_content)
+            try:
+                with metrics.stage('report_parse'):
+                    digest = await asyncio.to_thread(report_digest, report_path)
+                    df = await asyncio.to_thread(report_cache.get, business_id, digest)
+                    if df is None:
+                        df = await asyncio.to_thread(process_csv_from_zip, report_path)
+                        await asyncio.to_thread(report_cache.put, business_id, digest, df)
+                    else:
+                        logger.info("Отчет взят из кэша", digest=digest)
+                metrics.inc('ym_report_rows_total', len(df))
+                report_cache.mark_current(business_id, digest)
+                logger.info("Статистика кэша отчетов", hits=report_cache.hits, misses=report_cache.misses,
+                            hit_ratio=round(report_cache.hit_ratio(), 3))
+                return df
+            finally:
+                os.remove(report_path)
         else:
             logger.error("Не удалось скачать отчет")
             return None
@@ -153,8 +307,6 @@ async def get_yandex_market_report(api_key, business_id):
 
 # Пример использования функции
 if __name__ == "__main__":
-    # API_KEY = "ACMA:D4a5OExH6Hvtcx8BxgTqv2gfIpc2E7KmTPlekqDE:43a81531"
-    # BUSINESS_ID = 76443469
 
 
     async def main():
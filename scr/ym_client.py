@@ -0,0 +1,100 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+import aiohttp
+
+from scr.config import (
+    YM_HTTP_POOL_LIMIT, YM_HTTP_POOL_LIMIT_PER_HOST, YM_HTTP_KEEPALIVE_SECONDS, YM_HTTP_DNS_TTL_SECONDS,
+    YM_HTTP_CONNECT_TIMEOUT, YM_HTTP_READ_TIMEOUT
+)
+from scr.logger import logger
+
+
+class YandexMarketClient:
+    """
+    Долгоживущий HTTP-клиент API Яндекс.Маркета с общим пулом соединений.
+
+    Одна сессия используется для генерации, проверки и скачивания отчетов
+    и для обновления цен всех магазинов, поэтому TCP/TLS-соединения и
+    результаты DNS переиспользуются между запросами и циклами.
+    """
+
+    def __init__(self, limit: int = YM_HTTP_POOL_LIMIT, limit_per_host: int = YM_HTTP_POOL_LIMIT_PER_HOST,
+                 keepalive_timeout: float = YM_HTTP_KEEPALIVE_SECONDS, dns_ttl: int = YM_HTTP_DNS_TTL_SECONDS):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.stats: Dict[str, int] = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "dns_cache_hits": 0,
+            "dns_cache_misses": 0,
+        }
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        def counter(name: str):
+            async def handler(session, context, params):
+                self.stats[name] += 1
+            return handler
+
+        trace_config.on_request_start.append(counter("requests"))
+        trace_config.on_connection_create_end.append(counter("connections_created"))
+        trace_config.on_connection_reuseconn.append(counter("connections_reused"))
+        trace_config.on_dns_cache_hit.append(counter("dns_cache_hits"))
+        trace_config.on_dns_cache_miss.append(counter("dns_cache_misses"))
+        return trace_config
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Общая сессия; создается при первом обращении внутри цикла событий"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_ttl,
+                use_dns_cache=True,
+                enable_cleanup_closed=True,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Accept-Encoding": "gzip, deflate"},
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=YM_HTTP_CONNECT_TIMEOUT,
+                                              sock_read=YM_HTTP_READ_TIMEOUT),
+                trace_configs=[self._trace_config()],
+            )
+        return self._session
+
+    def pool_stats(self) -> Dict[str, int]:
+        """Статистика пула: запросы, новые и переиспользованные соединения, DNS-кэш"""
+        return dict(self.stats)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            # Дать закрыться SSL-транспортам до остановки цикла событий
+            await asyncio.sleep(0.25)
+        self._session = None
+
+    async def __aenter__(self) -> "YandexMarketClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        logger.info("Статистика пула соединений Яндекс.Маркета", **self.pool_stats())
+        await self.close()
+
+
+@asynccontextmanager
+async def use_session(session: Optional[aiohttp.ClientSession] = None) -> AsyncIterator[aiohttp.ClientSession]:
+    """Отдает переданную общую сессию или открывает временную, если сессия не передана"""
+    if session is not None:
+        yield session
+        return
+    async with aiohttp.ClientSession() as own_session:
+        yield own_session
@@ -0,0 +1,53 @@
+from scr.data_writer import build_delta_ranges, changed_row_blocks
+
+
+def make_rows(n):
+    return [[f'SKU-{i}', 1000 + i, ''] for i in range(n)]
+
+
+def test_changed_row_blocks_merges_adjacent_rows():
+    previous = make_rows(6)
+    current = make_rows(6)
+    for i in (1, 2, 4):
+        current[i][1] += 1
+
+    assert changed_row_blocks(previous, current) == [(1, 2), (4, 4)]
+    assert changed_row_blocks(previous, make_rows(6)) == []
+
+
+def test_build_delta_ranges_offsets_rows_and_columns():
+    previous = make_rows(10)
+    current = make_rows(10)
+    current[0][1] = 1
+    current[1][2] = 'обновлено'
+    current[7][1] = 2
+
+    assert build_delta_ranges("'Лист 1'!B3:D", previous, current) == [
+        {"range": "'Лист 1'!B3:D4", "values": current[0:2]},
+        {"range": "'Лист 1'!B10:D10", "values": current[7:8]},
+    ]
+    assert build_delta_ranges("A2", previous, make_rows(10)) == []
+
+
+def test_build_delta_ranges_column_past_z():
+    previous = [[1, 2, 3]] * 4
+    current = [[1, 2, 3]] * 3 + [[1, 2, 4]]
+
+    assert build_delta_ranges("Y1", previous, current) == [{"range": "Y4:AA4", "values": [[1, 2, 4]]}]
+
+
+def test_build_delta_ranges_requests_full_write():
+    previous = make_rows(10)
+
+    # Нет предыдущей записи, другой размер, неразборчивый диапазон
+    assert build_delta_ranges("A2", None, make_rows(10)) is None
+    assert build_delta_ranges("A2", previous, make_rows(11)) is None
+    assert build_delta_ranges("A2", previous, [row + [''] for row in make_rows(10)]) is None
+    assert build_delta_ranges("Лист1", previous, make_rows(10)) is None
+    assert build_delta_ranges("A2", [], []) is None
+
+    # Изменилось больше SHEETS_DELTA_MAX_SHARE строк
+    current = make_rows(10)
+    for row in current[:4]:
+        row[1] = 0
+    assert build_delta_ranges("A2", previous, current) is None
@@ -0,0 +1,78 @@
+import sqlite3
+
+import pandas as pd
+
+from scr.price_history import PriceHistoryStore
+from scr.schema import YM_COLUMN_NAMES
+from scr.update_data_ym import DECISION_DEFERRED, DECISION_NO_ROOM, DECISION_REPRICED
+
+
+def make_frame(mp_on_market):
+    return pd.DataFrame({
+        YM_COLUMN_NAMES['seller_id']: ['SKU-1', 'SKU-2'],
+        YM_COLUMN_NAMES['price']: [1000.0, 2000.0],
+        YM_COLUMN_NAMES['stop']: [500.0, 500.0],
+        YM_COLUMN_NAMES['mp_on_market']: mp_on_market,
+        YM_COLUMN_NAMES['market_with_mp']: ['Конкурент 1', 'Конкурент 2'],
+    })
+
+
+def test_deferred_sku_writes_no_history_row(tmp_path):
+    db_name = str(tmp_path / 'history.db')
+    store = PriceHistoryStore(db_name)
+
+    decisions = pd.Series([DECISION_REPRICED, DECISION_NO_ROOM])
+    assert store.record_cycle(1, make_frame([900.0, 1900.0]), YM_COLUMN_NAMES, decisions, ts=1000) == 2
+
+    # SKU-2 отложен: цена конкурента изменилась, но товар в этом цикле не проверялся
+    decisions = pd.Series([DECISION_REPRICED, DECISION_DEFERRED])
+    assert store.record_cycle(1, make_frame([800.0, 1800.0]), YM_COLUMN_NAMES, decisions, ts=2000) == 1
+
+    rows = sqlite3.connect(db_name).execute("""
+        SELECT s.sku, h.ts, h.decision FROM price_history h
+        JOIN price_history_sku s ON s.id = h.sku_id ORDER BY s.sku, h.ts
+    """).fetchall()
+    assert rows == [('SKU-1', 1000, DECISION_REPRICED), ('SKU-1', 2000, DECISION_REPRICED),
+                    ('SKU-2', 1000, DECISION_NO_ROOM)]
+    assert store.latest(1).set_index('sku').loc['SKU-2', 'decision'] == DECISION_NO_ROOM
+
+
+def test_unchanged_state_writes_no_rows(tmp_path):
+    store = PriceHistoryStore(str(tmp_path / 'history.db'))
+    decisions = pd.Series([DECISION_REPRICED, DECISION_NO_ROOM])
+
+    assert store.record_cycle(1, make_frame([900.0, 1900.0]), YM_COLUMN_NAMES, decisions, ts=1000) == 2
+    assert store.record_cycle(1, make_frame([900.0, 1900.0]), YM_COLUMN_NAMES, decisions, ts=2000) == 0
+    assert store.record_cycle(1, make_frame([900.0, 1850.0]), YM_COLUMN_NAMES, decisions, ts=3000) == 1
+
+    # Состояние читается и после перезапуска, из базы
+    store = PriceHistoryStore(store.db_name)
+    assert store.record_cycle(1, make_frame([900.0, 1850.0]), YM_COLUMN_NAMES, decisions, ts=4000) == 0
+    latest = store.latest(1).set_index('sku')
+    assert latest.loc['SKU-1', 'ts'] == 1000
+    assert latest.loc['SKU-2', 'ts'] == 3000
+    assert latest.loc['SKU-2', 'competitor_price'] == 1850.0
+
+
+def test_cycles_in_same_millisecond_keep_both_rows(tmp_path):
+    store = PriceHistoryStore(str(tmp_path / 'history.db'))
+    decisions = pd.Series([DECISION_REPRICED, DECISION_REPRICED])
+
+    assert store.record_cycle(1, make_frame([900.0, 1900.0]), YM_COLUMN_NAMES, decisions, ts=1000) == 2
+    assert store.record_cycle(1, make_frame([800.0, 1800.0]), YM_COLUMN_NAMES, decisions, ts=1000) == 2
+
+    history = store.history(1, 'SKU-1')
+    assert history['ts'].tolist() == [1000, 1001]
+    assert history['competitor_price'].tolist() == [900.0, 800.0]
+
+
+def test_history_includes_state_at_period_start(tmp_path):
+    store = PriceHistoryStore(str(tmp_path / 'history.db'))
+    decisions = pd.Series([DECISION_REPRICED, DECISION_REPRICED])
+    for ts, price in ((1000, 900.0), (2000, 800.0), (3000, 700.0)):
+        store.record_cycle(1, make_frame([price, 1900.0]), YM_COLUMN_NAMES, decisions, ts=ts)
+
+    history = store.history(1, 'SKU-1', start=2500, end=3000)
+    assert history['ts'].tolist() == [2000, 3000]
+    assert history['competitor_price'].tolist() == [800.0, 700.0]
+    assert history['shop'].tolist() == ['Конкурент 1', 'Конкурент 1']
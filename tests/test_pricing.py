@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scr import pricing
+from scr.config import PRICING_DISCOUNT_BASE_RANGE
+from scr.pricing import price_windows, strategy_groups
+
+MP_ON_MARKET = np.array([1000.0, 1000.0, 1000.0])
+OLD_PRICE = np.array([1100.0, 1100.0, 1100.0])
+STOP = np.array([500.0, 900.0, 990.0])
+
+
+def windows(config):
+    return price_windows(MP_ON_MARKET, OLD_PRICE, STOP, [config], np.zeros(3, dtype=np.intp))
+
+
+def test_fixed_step_window_is_raised_to_stop():
+    low, high, discount_min, discount_max = windows({'strategy': 'fixed_step', 'min_step': 50, 'max_step': 200})
+
+    assert low.tolist() == [800.0, 900.0, 990.0]
+    assert high.tolist() == [950.0, 950.0, 950.0]
+    # Для третьей строки окно пустое: low > high
+    assert (discount_min == PRICING_DISCOUNT_BASE_RANGE[0]).all()
+    assert (discount_max == PRICING_DISCOUNT_BASE_RANGE[1]).all()
+
+
+def test_percent_match_and_ladder_windows():
+    low, high, _, _ = windows({'strategy': 'percent', 'min_percent': 1, 'max_percent': 5})
+    assert low.tolist() == [950.0, 950.0, 990.0]
+    assert high.tolist() == pytest.approx([990.0, 990.0, 990.0])
+
+    low, high, _, _ = windows({'strategy': 'match'})
+    assert low.tolist() == [1000.0, 1000.0, 1000.0]
+    assert high.tolist() == [1000.0, 1000.0, 1000.0]
+
+    low, high, _, _ = windows({'strategy': 'ladder_to_stop', 'step': 50, 'discount_base': (1.1, 1.2)})
+    assert low.tolist() == [950.0, 950.0, 990.0]
+    assert high.tolist() == [950.0, 950.0, 990.0]
+
+
+def test_price_windows_per_group_and_discount_base():
+    configs = [{'strategy': 'match'}, {'strategy': 'fixed_step', 'min_step': 10, 'max_step': 20,
+                                       'discount_base': (1.1, 1.2)}]
+    low, high, discount_min, discount_max = price_windows(MP_ON_MARKET, OLD_PRICE, STOP, configs,
+                                                          np.array([1, 0, 1]))
+
+    assert low.tolist() == [980.0, 1000.0, 990.0]
+    assert high.tolist() == [990.0, 1000.0, 990.0]
+    assert discount_min.tolist() == [1.1, PRICING_DISCOUNT_BASE_RANGE[0], 1.1]
+    assert discount_max.tolist() == [1.2, PRICING_DISCOUNT_BASE_RANGE[1], 1.2]
+
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError):
+        windows({'strategy': 'random_walk'})
+
+
+def test_strategy_groups_sku_prefix_before_shop(monkeypatch):
+    monkeypatch.setattr(pricing, 'PRICING_SHOP_STRATEGIES', {'42': {'strategy': 'match'}})
+    monkeypatch.setattr(pricing, 'PRICING_SKU_GROUP_STRATEGIES', [
+        ('PROMO-', {'strategy': 'percent'}),
+        ('PRO', {'strategy': 'ladder_to_stop'}),
+        ('NONE-', {'strategy': 'fixed_step'}),
+    ])
+    skus = pd.Series(['PROMO-1', 'PRO-2', 'BASE-3', None], dtype='category')
+
+    configs, groups = strategy_groups(skus, business_id=42)
+
+    # Группа без строк в список не попадает; первая подходящая группа важнее следующих
+    assert configs == [{'strategy': 'match'}, {'strategy': 'percent'}, {'strategy': 'ladder_to_stop'}]
+    assert groups.tolist() == [1, 2, 0, 0]
+
+    configs, groups = strategy_groups(pd.Series(['BASE-3']), business_id=7)
+    assert configs == [pricing.PRICING_DEFAULT_STRATEGY]
+    assert groups.tolist() == [0]
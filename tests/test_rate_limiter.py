@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from scr.rate_limiter import RateLimiter, TokenBucket, parse_retry_after
+
+
+def test_token_bucket_spends_burst_then_waits_for_refill():
+    async def run():
+        bucket = TokenBucket(rate=20.0, capacity=2.0)
+        started = time.monotonic()
+        await bucket.acquire()
+        await bucket.acquire()
+        burst = time.monotonic() - started
+        await bucket.acquire()
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(run())
+    assert burst < 0.02
+    # Третий токен появляется через 1 / rate = 0.05 с
+    assert total >= 0.045
+
+
+def test_token_bucket_cost_above_capacity_is_capped():
+    async def run():
+        bucket = TokenBucket(rate=1.0, capacity=2.0)
+        await asyncio.wait_for(bucket.acquire(10.0), timeout=0.5)
+        return bucket.tokens
+
+    assert asyncio.run(run()) == 0.0
+
+
+def test_token_bucket_block_pauses_acquire():
+    async def run():
+        bucket = TokenBucket(rate=1000.0, capacity=5.0)
+        bucket.block(0.05)
+        assert bucket.tokens == 0.0
+        started = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.045
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after('-1') == 0.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert parse_retry_after('') is None
+    assert parse_retry_after('soon') is None
+
+
+class FakeResponse:
+    status = 200
+    headers = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def text(self):
+        return 'ok'
+
+
+class FakeSession:
+    def request(self, method, url, **kwargs):
+        return FakeResponse()
+
+
+def test_limiter_survives_new_event_loop():
+    limiter = RateLimiter({'prices': (1000.0, 1.0, 1)})
+
+    async def run():
+        return await asyncio.gather(*[limiter.request(FakeSession(), 'GET', 'url', 'prices', 1) for _ in range(3)])
+
+    # Второй asyncio.run - другой цикл событий; блокировки первого к нему не подходят
+    assert asyncio.run(run()) == [(200, 'ok')] * 3
+    assert asyncio.run(run()) == [(200, 'ok')] * 3
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from scr.schema import YM_COLUMN_NAMES
+from scr.update_data_ym import join_report_prices
+
+SELLER_ID = YM_COLUMN_NAMES['seller_id']
+MP_ON_MARKET = YM_COLUMN_NAMES['mp_on_market']
+MARKET_WITH_MP = YM_COLUMN_NAMES['market_with_mp']
+
+
+def make_sheet():
+    return pd.DataFrame({
+        SELLER_ID: ['SKU-1', 'SKU-2', 'SKU-3'],
+        YM_COLUMN_NAMES['price']: [1000.0, 2000.0, 3000.0],
+        YM_COLUMN_NAMES['stop']: [500.0, 500.0, 500.0],
+        MP_ON_MARKET: [950.0, 1950.0, 2950.0],
+        MARKET_WITH_MP: ['Старый 1', 'Старый 2', 'Старый 3'],
+    })
+
+
+def test_join_report_prices_last_duplicate_wins():
+    report = pd.DataFrame({
+        SELLER_ID: ['SKU-1', 'SKU-2', 'SKU-1'],
+        MP_ON_MARKET: [900.0, 1900.0, 850.0],
+        MARKET_WITH_MP: ['Конкурент 1', 'Конкурент 2', 'Конкурент 3'],
+    })
+
+    updated, stats = join_report_prices(make_sheet(), report, YM_COLUMN_NAMES)
+
+    assert updated[MP_ON_MARKET].astype(float).tolist() == [850.0, 1900.0, 2950.0]
+    assert updated[MARKET_WITH_MP].astype(str).tolist() == ['Конкурент 3', 'Конкурент 2', 'Старый 3']
+    assert stats == {'matched': 2, 'unmatched': 1, 'report_only': 0, 'report_duplicates': 1}
+
+
+def test_join_report_prices_keeps_sheet_values_for_unmatched_and_empty():
+    report = pd.DataFrame({
+        SELLER_ID: ['SKU-2', 'SKU-9', 'SKU-3'],
+        MP_ON_MARKET: [np.nan, 100.0, 2900.0],
+        MARKET_WITH_MP: [None, 'Конкурент 9', 'Конкурент 3'],
+    })
+
+    updated, stats = join_report_prices(make_sheet(), report, YM_COLUMN_NAMES)
+
+    # SKU-1 нет в отчете, у SKU-2 в отчете пустые значения - остаются значения таблицы
+    assert updated[MP_ON_MARKET].astype(float).tolist() == [950.0, 1950.0, 2900.0]
+    assert updated[MARKET_WITH_MP].astype(str).tolist() == ['Старый 1', 'Старый 2', 'Конкурент 3']
+    assert updated[SELLER_ID].astype(str).tolist() == ['SKU-1', 'SKU-2', 'SKU-3']
+    assert updated[YM_COLUMN_NAMES['price']].astype(float).tolist() == [1000.0, 2000.0, 3000.0]
+    assert stats == {'matched': 2, 'unmatched': 1, 'report_only': 1, 'report_duplicates': 0}
@@ -0,0 +1,53 @@
+from scr.config import YM_MAX_OFFERS_PER_REQUEST
+from scr.update_ym import map_offer_errors, split_into_batches
+
+
+def test_split_into_batches_keeps_order_and_limit():
+    offers = [{'offerId': str(i)} for i in range(7)]
+
+    batches = split_into_batches(offers, 3)
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert [offer for batch in batches for offer in batch] == offers
+
+    assert split_into_batches([], 3) == []
+    assert [len(batch) for batch in split_into_batches(offers, 0)] == [1] * 7
+
+
+def test_split_into_batches_caps_batch_size_at_api_limit():
+    offers = [{'offerId': str(i)} for i in range(YM_MAX_OFFERS_PER_REQUEST + 1)]
+
+    batches = split_into_batches(offers, YM_MAX_OFFERS_PER_REQUEST * 2)
+    assert [len(batch) for batch in batches] == [YM_MAX_OFFERS_PER_REQUEST, 1]
+
+
+def test_map_offer_errors_by_offer_id_and_index():
+    response = {'status': 'ERROR', 'errors': [
+        {'code': 'INVALID_PRICE', 'offerId': 'B', 'message': 'Цена ниже допустимой'},
+        {'code': 'BAD_REQUEST', 'message': 'offers[2].price.value: must be positive'},
+    ]}
+
+    assert map_offer_errors(response, ['A', 'B', 'C']) == {
+        'B': 'Цена ниже допустимой',
+        'C': 'offers[2].price.value: must be positive',
+    }
+
+
+def test_map_offer_errors_batch_error_applies_to_other_offers():
+    response = {'errors': [
+        {'offerId': 'A', 'message': 'Товар не найден'},
+        {'code': 'LOCKED'},
+        # Индекс за пределами пачки - ошибка всей пачки
+        {'message': 'offers[5] is invalid'},
+    ]}
+
+    assert map_offer_errors(response, ['A', 'B']) == {
+        'A': 'Товар не найден',
+        'B': 'LOCKED; offers[5] is invalid',
+    }
+
+
+def test_map_offer_errors_legacy_failure_and_success():
+    response = {'success': 0, 'error': {'message': 'Неверный токен'}}
+    assert map_offer_errors(response, ['A', 'B']) == {'A': 'Неверный токен', 'B': 'Неверный токен'}
+
+    assert map_offer_errors({'status': 'OK'}, ['A', 'B']) == {}